@@ -1,25 +1,40 @@
 import datetime
-import math
 import mimetypes
 import os
-import random
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import click
 import gdown
 import maya
-import requests
 from ayrshare import SocialPost
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from moviepy.video.io.VideoFileClip import VideoFileClip
 from pytube import YouTube
-from pytube.cli import on_progress
-
+from sqlalchemy import or_
+
+from bot.services.ayrshare import get_client
+from bot.services.clip_cache import ClipCache, clip_cache_key
+from bot.services.clip_ranges import ClipRangeIndex
+from bot.services.downloader import Downloader, DownloadError, google_drive_download_url, print_progress
+from bot.services.encoder_pool import ClipJob, EncoderPool
+from bot.services.ffprobe import get_duration, source_fingerprint
+from bot.services.fingerprint import content_fingerprint
+from bot.services.highlights import HighlightDetector
+from bot.services.loudness import get_loudness, loudnorm_filter
+from bot.services.partial_download import download_clip_window, PartialDownloadError
+from bot.services.preflight import preflight
+from bot.services.source_metadata import get_source_metadata, canonical_source_id, is_youtube_url, is_tiktok_url, \
+    is_google_drive_url
+from bot.services.source_cache import SourceCache, file_sha256
 from bot.services.tiktok import TikTokDownloader
-from bot.utils import ffmpeg_convert_to_mp4, ffmpeg_extract_subclip, extract_hashtags
+from bot.services.uploader import upload_file
+from bot.services.workspace import Workspace
+from bot.utils import ffmpeg_convert_to_mp4, ffmpeg_extract_subclip, ffmpeg_encode_subclip, extract_hashtags, \
+    ffmpeg_extract_subclips, ffmpeg_encode_subclips, is_video_file, is_image_file, download_image, compile_keywords, \
+    ffmpeg_encode_preview, ffmpeg_merge_streams
 from bot.webapp.config import DefaultConfig
-from bot.webapp.models import ImageDb, VideoClip as BotClip, MediaUpload, SocialMediaPost, VideoClip
+from bot.webapp.database import db
+from bot.webapp.models import ImageDb, VideoClip as BotClip, MediaUpload, SocialMediaPost, VideoClip, \
+    PublishedSocialMediaPost
 
 social = SocialPost(DefaultConfig.AYRSHARE_API_KEY)
 
@@ -39,7 +54,9 @@ class VidBot(object):
                  subclip_start=-1, scheduled_date=None,
                  post_title=None,
                  platforms=["tiktok", "instagram", "twitter", "facebook", "youtube"],
-                 application_config=DefaultConfig(), already_clipped=False, ffmpeg=False, no_cleanup=False):
+                 application_config=DefaultConfig(), already_clipped=False, ffmpeg=False, ffmpeg_accurate_cut=False,
+                 no_cleanup=False, encoder_workers=1, partial_download=False, highlights=False,
+                 scene_detection=False, preview=False, adaptive=False):
         """
         Initializes the VidBot class with the defined configuration.
         :param youtube_video_download_link: Youtube video download link
@@ -58,31 +75,35 @@ class VidBot(object):
         :param application_config: application configuration
         :param already_clipped: whether or not the video has already been clipped
         :param ffmpeg: whether or not to use ffmpeg to extract the subclip
+        :param ffmpeg_accurate_cut: with ffmpeg, re-encode the GOP before the first keyframe instead of snapping
+            the start time to the nearest keyframe.
+        :param encoder_workers: number of clips to encode concurrently when cutting multiple clips.
+        :param partial_download: only download the part of the youtube video the clip is cut from.
+        :param highlights: start clips on the liveliest windows of the source instead of at random.
+        :param scene_detection: with highlights, also score the windows on scene changes (slower).
+        :param preview: review low resolution proxies of the candidate clips before the full quality encode.
+        :param adaptive: download the best adaptive (separate video & audio) youtube streams instead of the
+            progressive one, which tops out at 720p.
         """
-        self.yt_vid: YouTube = None
+        # Source metadata (& the YouTube / TikTok clients) are only loaded when a stage needs them.
         self.youtube_video_download_link = youtube_video_download_link
         self.output_filename = None
-        if youtube_video_download_link is not None:
-            self.yt_vid: YouTube = YouTube(youtube_video_download_link, on_progress_callback=on_progress)
 
         self.image_url = image_url
         self.local_image_location = local_image_location
         self.tiktok_video_url = tiktok_video_url
-        self.tiktok_downloader: TikTokDownloader = None
-        if self.tiktok_video_url is not None:
-            self.tiktok_downloader = TikTokDownloader(self.tiktok_video_url, output_filename=output_filename)
 
         self.google_drive_link = google_drive_link
         self.downloaded: bool = False
         # local file
         self.local_video_clip_location = local_video_clip_location
         self.video_path = None if self.local_video_clip_location is None else self.local_video_clip_location
-        self.video: VideoFileClip = None if local_video_clip_location is None else VideoFileClip(
-            local_video_clip_location)
-        self.audio: AudioFileClip = None if self.video is None else self.video.audio
+        self._video_duration = None
+        self._clip_range_index: ClipRangeIndex = None
+        self._content_fingerprint = None
+        # Whether the source is a partial (clip window only) download
+        self.partial_source = False
         self.clip_length = clip_length
-        # The created subclip
-        self.clip: VideoFileClip = None
         # Where the clip is saved
         self.clip_path: Path = None
         self.skip_intro_time = skip_intro_time
@@ -93,31 +114,103 @@ class VidBot(object):
         self.subclip_start = subclip_start
         self.scheduled_date = scheduled_date
         self.platforms = platforms
-        self.post_title = post_title
-        if self.post_title is None and self.youtube_video_download_link is not None:
-            self.post_title = self.yt_vid.title
-
-        if self.post_title is None and self.tiktok_video_url is not None:
-            self.post_title = self.tiktok_downloader.title
+        self._post_title = post_title
 
         self.application_config = application_config
+        self.source_cache = SourceCache(max_size=application_config.SOURCE_CACHE_MAX_SIZE)
+        self.clip_cache = ClipCache(max_size=application_config.CLIP_CACHE_MAX_SIZE)
         self.already_clipped = already_clipped
         self.ffmpeg = ffmpeg  # Whether or not to use ffmpeg to extract the subclip
-        self.created_files = [
-            "tempaudio.m4a"
-        ]  # This will be removed after upload & such :)
+        self.ffmpeg_accurate_cut = ffmpeg_accurate_cut
+        self.encoder_workers = encoder_workers
+        self.partial_download = partial_download
+        self.highlights = highlights
+        self.scene_detection = scene_detection
+        self.preview = preview
+        self.adaptive = adaptive
+        # Private scratch directory holding every file created by this run, see the workspace property.
+        self._workspace: Workspace = None
 
         self.downloaded_file_path = None
         self.no_cleanup = no_cleanup
 
+    @property
+    def ayrshare(self):
+        """
+        Shared (pooled) client of the Ayrshare API.
+        """
+        return get_client(self.application_config.AYRSHARE_API_KEY)
+
+    @property
+    def source_metadata(self):
+        """
+        Memoized metadata of the online source, None for local & image sources.
+        """
+        if self.youtube_video_download_link is None and self.tiktok_video_url is None and self.google_drive_link is None:
+            return None
+        return get_source_metadata(self.get_video_url())
+
+    @property
+    def yt_vid(self) -> YouTube:
+        if self.youtube_video_download_link is None:
+            return None
+        return self.source_metadata.youtube
+
+    @property
+    def tiktok_downloader(self) -> TikTokDownloader:
+        if self.tiktok_video_url is None:
+            return None
+        return self.source_metadata.tiktok
+
+    @property
+    def post_title(self):
+        """
+        Title of the post, defaults to the title of the online source (looked up the first time it's needed).
+        """
+        if self._post_title is None and self.source_metadata is not None:
+            self._post_title = self.source_metadata.title
+        return self._post_title
+
+    @post_title.setter
+    def post_title(self, value):
+        self._post_title = value
+
+    @property
+    def workspace(self):
+        """
+        Scratch directory of this run, created the first time it's needed.
+        Raises once it's been cleaned up: a new one would never be removed.
+        """
+        if self._workspace is None:
+            downloads = self.youtube_video_download_link is not None or self.tiktok_video_url is not None or \
+                        self.google_drive_link is not None
+            self._workspace = Workspace(downloads=downloads)
+        elif not self._workspace.exists:
+            raise RuntimeError(f"The workspace of this run ({self._workspace.path}) was already cleaned up.")
+        return self._workspace
+
     @property
     def output_filename(self):
-        return self._output_filename
+        """
+        Path of the output file, inside the workspace of this run.
+        """
+        if self._output_filename is None:
+            return None
+        return self.workspace.file(self._output_filename)
 
     @output_filename.setter
     def output_filename(self, value):
         self._output_filename = value
 
+    @property
+    def video_duration(self):
+        """
+        Duration (seconds) of the source video, probed with ffprobe the first time it's needed.
+        """
+        if self._video_duration is None and self.video_path is not None:
+            self._video_duration = get_duration(self.video_path)
+        return self._video_duration
+
     def is_local_video(self):
         """
         Check whether or not the video file we're editing is local.
@@ -149,84 +242,291 @@ class VidBot(object):
 
         return False
 
+    @property
+    def clip_range_index(self):
+        """
+        Ranges of the source already used by uploaded clips, loaded from the database the first time it's needed.
+        Empty when skipping the duplicate check.
+        """
+        if self._clip_range_index is None:
+            if self.skip_duplicate_check is True:
+                self._clip_range_index = ClipRangeIndex(self.video_duration, self.clip_length,
+                                                        skip_intro_time=self.skip_intro_time)
+            else:
+                self._clip_range_index = ClipRangeIndex.for_source(self.source_id, self.video_duration,
+                                                                   self.clip_length,
+                                                                   skip_intro_time=self.skip_intro_time,
+                                                                   fingerprint=self.content_fingerprint)
+        return self._clip_range_index
+
+    @property
+    def source_id(self):
+        """
+        Canonical id of the source, the same however its url is spelled.
+        """
+        return canonical_source_id(self.get_video_url())
+
+    @property
+    def content_fingerprint(self):
+        """
+        Fingerprint of the source's content, None until the (complete) source is on disk
+        or when CLIP_CONTENT_FINGERPRINT is disabled.
+        """
+        if self._content_fingerprint is None and self.application_config.CLIP_CONTENT_FINGERPRINT \
+                and self.video_path is not None and not self.partial_source and os.path.exists(self.video_path):
+            self._content_fingerprint = content_fingerprint(str(self.video_path))
+        return self._content_fingerprint
+
+    def find_video_clip(self, start_time, duration):
+        """
+        Find a previously created clip of this source with the same start time & duration.
+        :return: VideoClip or None
+        """
+        source_filter = VideoClip.source_id == self.source_id
+        if self.content_fingerprint is not None:
+            source_filter = or_(source_filter, VideoClip.fingerprint == self.content_fingerprint)
+
+        return VideoClip.query.filter(source_filter).filter_by(start_time=start_time, duration=duration) \
+            .order_by(VideoClip.id.desc()).first()
+
+    def new_video_clip(self, start_time, duration):
+        """
+        Create (without saving) the VideoClip record of a clip cut from this source.
+        """
+        return VideoClip(url=self.get_video_url(), title=self.post_title, start_time=start_time, duration=duration,
+                         source_id=self.source_id, fingerprint=self.content_fingerprint)
+
+    @property
+    def encoder_settings(self):
+        """
+        Describes how clips are encoded, clips encoded differently aren't interchangeable in the clip cache.
+        """
+        if self.ffmpeg:
+            return "ffmpeg-accurate" if self.ffmpeg_accurate_cut else "ffmpeg-copy"
+        if self.application_config.CLIP_LOUDNESS_TARGET is not None:
+            return f"x264-loudnorm{self.application_config.CLIP_LOUDNESS_TARGET}"
+        return "x264"
+
+    def loudness_filter(self, source_path, start_time, duration):
+        """
+        Loudness normalization filter of the clip's encode, from the (cached) measurement of its window.
+        :return: ffmpeg audio filter, or None when the clip isn't normalized.
+        """
+        target = self.application_config.CLIP_LOUDNESS_TARGET
+        if target is None or self.ffmpeg:
+            return None
+
+        # Local files are measured by their contents, downloads by their source so any copy of it reuses the measurement.
+        source_key = None if self.is_local_video() else self.source_id
+        return loudnorm_filter(get_loudness(str(source_path), start_time, duration, target, source_key=source_key),
+                               target)
+
+    def clip_cache_key(self, start_time, duration):
+        """
+        Key of the clip in the clip cache, None when the source can't be identified.
+        Local sources are keyed by their file (its size & modification time), not its path: a different
+        or edited video at the same path must never be served another video's clip.
+        """
+        source_key = self.source_id
+        if self.is_local_video():
+            if not os.path.exists(self.local_video_clip_location):
+                return None
+            source_key = f"local:{source_fingerprint(self.local_video_clip_location)}"
+
+        return clip_cache_key(source_key, start_time, duration, self.encoder_settings)
+
+    def reuse_video_clip(self):
+        """
+        Reuse a clip that's being recreated without downloading the source: its upload when it hasn't expired,
+        otherwise its encode from the clip cache.
+        :return: (path of the clip, VideoClip record), or (None, None) if the clip has to be cut again.
+                 The path is None when the upload is reused.
+        """
+        if not self.already_clipped or self.clip_length == -1 or self.subclip_start == -1:
+            return None, None
+
+        video_clip_record = self.find_video_clip(self.subclip_start, self.clip_length)
+        if video_clip_record is None:
+            return None, None
+
+        if video_clip_record.upload is not None and not video_clip_record.upload.is_expired:
+            print(f"~ Clip ({video_clip_record.id}) is still uploaded, skipping the download & encode.")
+            return None, video_clip_record
+
+        if self.clip_cache.fetch(self.clip_cache_key(self.subclip_start, self.clip_length), self.output_filename):
+            print(f"~ Recreated video clip ({video_clip_record.id}) from the clip cache, skipping the download & encode.")
+            return f"{self.output_filename}", video_clip_record
+
+        return None, None
+
     def check_for_duplicate_clips(self, start_time: int):
         """
-        Checks if the video clip already exists in the database by comparing start times.
+        Checks if a clip starting at start_time overlaps a previously uploaded clip of the same video.
         :param start_time: start time of the video clip
-        :return: True if the clip already exists, False if it does not
+        :return: True if the clip overlaps an existing one, False if it does not
         """
 
         if self.skip_duplicate_check is True:
             return False
 
-        search_clip = VideoClip.query.filter_by(start_time=start_time,
-                                                url=self.get_video_url()).all()
-
-        if len(search_clip) == 0:
-            return False
-
-        for clip in search_clip:
-            if clip.upload is not None and clip.upload.uploaded is True:
-                return True
-        return False
+        return self.clip_range_index.overlaps(start_time)
 
     def download_image(self):
         """
         Downloads the image from the URL
         :return:
         """
-        r = requests.get(self.image_url, stream=True)
-        if r.status_code == 200:
-            with open(self.output_filename, 'wb') as f:
-                r.raw.decode_content = True
-                shutil.copyfileobj(r.raw, f)
-                return self.output_filename
-
-        return None
+        return download_image(self.image_url, self.output_filename)
 
     def download_video(self):
         """
         Downloads the highest possible quality video for creating the clip.
+        Sources that were downloaded before are reused from the source cache.
         :return: path of the video downloaded
         """
+        if not self.is_local_video():
+            cached_path = self.source_cache.get(self.get_video_url())
+            if cached_path is not None:
+                print(f"Using cached source {cached_path} for {self.get_video_url()}")
+                self.downloaded = True
+                self.video_path = cached_path
+                return cached_path
+
         if self.youtube_video_download_link is not None:
-            path = self.yt_vid.streams.filter(progressive=True).get_highest_resolution().download()
+            if self.adaptive:
+                path = self.download_youtube_adaptive()
+                if path is not None:
+                    path = self.source_cache.put(self.youtube_video_download_link, path)
+                    self.downloaded = True
+                    self.video_path = path
+                    return path
+
+            # Highlights are found from the audio of the whole video, so it's downloaded completely.
+            if self.partial_download and self.clip_length != -1 and not self.highlights:
+                path = self.download_youtube_clip_window()
+                if path is not None:
+                    self.downloaded = True
+                    self.partial_source = True
+                    self.video_path = path
+                    return path
+
+            path = self.yt_vid.streams.filter(progressive=True).get_highest_resolution().download(
+                output_path=self.workspace.path)
+            path = self.source_cache.put(self.youtube_video_download_link, path)
             self.downloaded = True
             self.video_path = path
-            self.video = VideoFileClip(path)
-            self.audio = self.video.audio
             return path
 
         if self.tiktok_video_url is not None:
+            self.tiktok_downloader.output_filename = self.output_filename
             self.tiktok_downloader.download_video()
             self.downloaded = True
-            self.video_path = self.output_filename
-            self.video = VideoFileClip(self.output_filename)
-            self.audio = self.video.audio
-            return self.output_filename
+            self.video_path = self.source_cache.put(self.tiktok_video_url, self.output_filename)
+            return self.video_path
 
         if self.google_drive_link is not None:
-            output_filename = gdown.download(self.google_drive_link, quiet=False, fuzzy=True)
+            output_filename = self.download_google_drive_file()
             self.downloaded_file_path = output_filename
-            if self.is_video_file(output_filename):
+            if is_video_file(output_filename):
 
                 if "mp4" not in mimetypes.guess_type(output_filename)[0]:
                     print(f"Converting file to MP4 Format: {output_filename} to {self.output_filename}")
                     ffmpeg_convert_to_mp4(output_filename, targetname=self.output_filename)
 
-                    self.video_path = self.output_filename
-                    self.video = VideoFileClip(self.output_filename)
-                    self.audio = self.video.audio
+                    self.video_path = self.source_cache.put(self.google_drive_link, self.output_filename)
                 else:
-                    self.video_path = output_filename
-                    self.video = VideoFileClip(output_filename)
-                    self.audio = self.video.audio
+                    self.video_path = self.source_cache.put(self.google_drive_link, output_filename)
+                # The download was moved into the source cache (or converted), this is where it is now.
+                self.downloaded_file_path = self.video_path
+                self.downloaded = True
+                return self.video_path
             else:
                 print(f"~ Downloaded {output_filename} is not a video file.")
             return output_filename
 
         return None
 
+    def download_google_drive_file(self):
+        """
+        Download the file shared by the google drive link, streamed & resumable through the shared downloader.
+        Falls back to gdown for links the file id can't be read from (or that don't serve the file directly).
+        :return: path of the downloaded file
+        """
+        download_url = google_drive_download_url(self.google_drive_link)
+        if download_url is not None:
+            try:
+                return Downloader(progress_callback=print_progress).download(download_url,
+                                                                             output_dir=self.workspace.path,
+                                                                             require_attachment=True)
+            except DownloadError as e:
+                print(f"!! {e}, retrying with gdown")
+
+        return gdown.download(self.google_drive_link, output=self.workspace.path + os.sep, quiet=False, fuzzy=True)
+
+    def download_youtube_adaptive(self):
+        """
+        Download the best adaptive video-only & audio-only streams of the youtube video at the same time,
+        then merge them (stream copy) into a single mp4.
+        :return: path of the merged video, or None if the progressive stream has to be downloaded instead.
+        """
+        streams = self.yt_vid.streams
+        video_streams = streams.filter(adaptive=True, only_video=True, file_extension="mp4").order_by(
+            'resolution').desc()
+        # H.264 (avc1) streams are preferred, they're playable (& stream copyable) everywhere.
+        video_stream = next((stream for stream in video_streams if stream.video_codec.startswith("avc1")),
+                            video_streams.first())
+        audio_stream = streams.filter(adaptive=True, only_audio=True, file_extension="mp4").order_by('abr').desc() \
+            .first()
+
+        if video_stream is None or audio_stream is None:
+            print("~ No adaptive streams available, downloading the progressive stream instead.")
+            return None
+
+        print(f"Downloading {video_stream.resolution} video & {audio_stream.abr} audio streams of {self.get_video_url()}")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            video_download = executor.submit(video_stream.download, output_path=self.workspace.path,
+                                             filename=f"video_{video_stream.default_filename}")
+            audio_download = executor.submit(audio_stream.download, output_path=self.workspace.path,
+                                             filename=f"audio_{audio_stream.default_filename}")
+            video_path, audio_path = video_download.result(), audio_download.result()
+
+        path = self.workspace.file(video_stream.default_filename)
+        if not ffmpeg_merge_streams(video_path, audio_path, path):
+            print("!! Failed merging the adaptive streams, downloading the progressive stream instead.")
+            return None
+
+        os.remove(video_path)
+        os.remove(audio_path)
+        return path
+
+    def download_youtube_clip_window(self):
+        """
+        Download only the byte ranges of the youtube video that hold the clip, using HTTP Range requests.
+        The start time of the clip is chosen up front, from the duration youtube reports.
+        :return: path of the (sparse) video downloaded, or None if the full video has to be downloaded instead.
+        """
+        stream = self.yt_vid.streams.filter(progressive=True, file_extension="mp4").get_highest_resolution()
+        if stream is None:
+            return None
+
+        if self.subclip_start == -1:
+            self._video_duration = self.source_metadata.duration
+            start_time = self.get_random_start_time()
+            if start_time is None:
+                return None
+            self.subclip_start = start_time
+
+        path = self.workspace.file(f"partial_{stream.default_filename}")
+        try:
+            download_clip_window(stream.url, self.subclip_start, self.clip_length, path)
+        except PartialDownloadError as e:
+            print(f"~ Partial download failed ({e}), downloading the full video instead.")
+            return None
+
+        # Probe the downloaded file rather than trusting the duration youtube reports.
+        self._video_duration = None
+        return path
+
     def is_downloaded_clip(self):
         """
         Check whether or not the video file we're editing was downloaded by the bot.
@@ -258,119 +558,254 @@ class VidBot(object):
 
         return self.local_video_clip_location
 
-    def create_video_clip(self):
+    def create_video_clip(self, start_time=None):
         """
         Clips the video to the defined length.
-        :param check_duplicates: Check if the clip already exists by comparing start times in the database
+        :param start_time: start time that was already chosen (& reviewed), skips picking one & the duplicate check.
         :return: path of the clip
         """
 
-        # get a random start time
-        start_time = self.get_random_start_time() if self.subclip_start == -1 else self.subclip_start
-
-        # CHECK FOR DUPLICATE CLIPS IN DB **
-        if self.check_for_duplicate_clips(start_time):
-            print(f"Duplicate clip starting @ {start_time}s! Retrying...")
-            return self.create_video_clip()
         if self.clip_length == -1:
-            self.clip_length = self.video.duration
+            start_time = 0 if self.subclip_start == -1 else self.subclip_start
+            self.clip_length = self.video_duration
             # write the entry to the db
 
-            video_clip_record = VideoClip.query.filter_by(url=self.get_video_url(), start_time=start_time,
-                                                          duration=self.video.duration, title=self.post_title).first()
+            video_clip_record = self.find_video_clip(start_time, int(self.video_duration))
+            if video_clip_record is None:
+                video_clip_record = self.new_video_clip(start_time, int(self.video_duration))
+                video_clip_record.save(commit=True)
 
-            video_clip_record = VideoClip(url=self.get_video_url(), title=self.post_title,
-                                          start_time=start_time,
-                                          duration=self.video.duration)
-            video_clip_record.save(commit=True)
-
-            print(
-                f"Created database entry ({video_clip_record.id}) for video clip of {self.output_filename} starting @ {start_time}s")
-            return f"{self.downloaded_file_path if self.downloaded_file_path is not None else self.output_filename}", video_clip_record
+                print(
+                    f"Created database entry ({video_clip_record.id}) for video clip of {self.output_filename} starting @ {start_time}s")
+            # The whole source is posted, wherever it is (the source cache, or the local video).
+            return f"{self.video_path}", video_clip_record
+
+        # get a start time from the parts of the video that haven't been clipped yet.
+        if start_time is None and self.subclip_start == -1:
+            start_time = self.get_start_time()
+            if start_time is None:
+                print(f"All of {self.get_video_url()} has already been clipped! "
+                      f"No room left for a new {self.clip_length}s clip.")
+                return None, None
+        elif start_time is None:
+            start_time = self.subclip_start
+            # Reposting an existing cut is intended, anything else overlapping is a duplicate.
+            if not self.already_clipped and self.check_for_duplicate_clips(start_time):
+                print(f"A clip overlapping {start_time}s - {start_time + self.clip_length}s was already uploaded! "
+                      f"Use --force to clip it anyway.")
+                return None, None
 
         end_time = start_time + self.clip_length
         # Create & save the clip
 
-        if self.ffmpeg:
-            ffmpeg_extract_subclip(
-                self.downloaded_file_path if self.downloaded_file_path is not None else self.output_filename,
-                start_time, end_time,
-                targetname=f"sub_{self.output_filename}" if self.downloaded_file_path is None else self.output_filename)
-            self.output_filename = f"sub_{self.output_filename}" if self.downloaded_file_path is None else self.output_filename
-            print("New filename: ", self.output_filename)
-            self.created_files.append(f"{self.output_filename}")
-            # write the entry to the db
+        if self.clip_cache.fetch(self.clip_cache_key(start_time, self.clip_length), self.output_filename):
+            print(f"~ Found [{start_time}s - {end_time}s] in the clip cache, skipping the encode.")
         else:
-            if self.video is None:
-                self.video = VideoFileClip(
-                    self.output_filename if self.output_filename is not None else self.local_video_clip_location if self.local_video_clip_location is not None else None)
-                print(
-                    f"Video clip is None. Setting video to {self.output_filename if self.output_filename is not None else self.local_video_clip_location if self.local_video_clip_location is not None else None}")
-            self.clip = self.video.subclip(start_time, end_time)
-            audio_clip = self.video.audio.subclip(start_time, end_time)
-            #
-            # self.clip = self.clip.set_audio(audio_clip)
-            self.clip.write_videofile(f"clip_{self.output_filename}",
-                                      temp_audiofile=f"tempaudio.m4a",
-                                      audio_codec="aac", remove_temp=False, codec="libx264")
-            # self.created_files.append(f"{self.output_filename.replace('.', '_')}_tempaudio.m4a")
-            self.created_files.append(
-                f"{self.downloaded_file_path if self.downloaded_file_path is not None else self.output_filename}")
-            self.created_files.append(f"clip_{self.output_filename}")
-            self.clip.close()
-            # invoke ffmpeg to append audio subclip.
-            import subprocess as sp
-            command = ['ffmpeg',
-                       '-y',  # approve output file overwite
-                       '-i', f"clip_{self.output_filename}",
-                       '-i', f"tempaudio.m4a",
-                       '-c:v', 'libx264',
-                       '-c:a', 'aac',  # to convert mp3 to aac
-                       '-shortest',
-                       f"{self.output_filename}"]
-
-            print(f"Running command: {' '.join(command)}")
-            process = sp.Popen(command, stdout=sp.PIPE, stderr=sp.PIPE)
-            process.wait()
-
-            os.remove(f"clip_{self.output_filename}")
-
-            # write the entry to the db
-        video_clip_record = VideoClip(url=self.get_video_url(), title=self.post_title,
-                                      start_time=start_time,
-                                      duration=self.clip_length)
+            source_path = self.get_source_path()
+            if self.ffmpeg:
+                start_time = ffmpeg_extract_subclip(source_path, start_time, end_time, targetname=self.output_filename,
+                                                    accurate=self.ffmpeg_accurate_cut)
+                if start_time is None:
+                    return None, None
+                start_time = int(round(start_time))
+            else:
+                print(f"Encoding {source_path} [{start_time}s - {end_time}s] to {self.output_filename}")
+                if not ffmpeg_encode_subclip(source_path, start_time, end_time, targetname=self.output_filename,
+                                             audio_filter=self.loudness_filter(source_path, start_time,
+                                                                               self.clip_length)):
+                    print(f"!! Failed encoding {source_path} [{start_time}s - {end_time}s]")
+                    return None, None
+
+            # Keyed on the start the clip actually got, which is what its record (& redo_clip) uses.
+            self.clip_cache.put(self.clip_cache_key(start_time, self.clip_length), self.output_filename)
+
+        # Reposts reuse the record (& upload) of the clip they recreate.
+        video_clip_record = self.find_video_clip(start_time, self.clip_length) if self.already_clipped else None
+        if video_clip_record is not None:
+            print(f"Recreated video clip ({video_clip_record.id}) of {self.post_title} starting @ {start_time}s")
+            return f"{self.output_filename}", video_clip_record
+
+        # write the entry to the db
+        video_clip_record = self.new_video_clip(start_time, self.clip_length)
         video_clip_record.save(commit=True)
 
         print(
             f"Created database entry ({video_clip_record.id}) for video clip of {self.post_title} starting @ {start_time}s")
         return f"{self.output_filename}", video_clip_record
 
-    def get_random_start_time(self):
+    def create_video_clips(self, count):
         """
-        Generate a random start time for the clip.
-        Created using the formula:
-        r   andom_start_time = random.randint(0 + skip_intro_time, video_duration - clip_length)
+        Cuts multiple non-overlapping clips of the defined length from the source in a single ffmpeg run.
+        :param count: number of clips to create
+        :return: list of (path of the clip, VideoClip record) tuples
+        """
+        if self.clip_length == -1:
+            raise ValueError("A clip length is required to cut multiple clips from a video.")
+
+        start_times = self.get_start_times(count)
+        if len(start_times) < count:
+            print(f"~ Only found room for {len(start_times)} of {count} clips in {self.get_video_url()}")
+
+        if len(start_times) == 0:
+            return []
+
+        name, ext = os.path.splitext(self.output_filename)
+        clip_paths = [f"{name}_{index + 1}{ext}" for index in range(len(start_times))]
+        ranges = [(start_time, start_time + self.clip_length) for start_time in start_times]
+
+        source_path = self.get_source_path()
+        print(f"Cutting {len(ranges)} clips from {source_path}")
+        if not self.ffmpeg and self.encoder_workers > 1:
+            jobs = [ClipJob(source_path, start_time, self.clip_length, clip_path, url=self.get_video_url(),
+                            title=self.post_title, source_id=self.source_id, fingerprint=self.content_fingerprint,
+                            audio_filter=self.loudness_filter(source_path, start_time, self.clip_length))
+                    for start_time, clip_path in zip(start_times, clip_paths)]
+            return [(job.output, video_clip_record) for job, video_clip_record in
+                    EncoderPool(workers=self.encoder_workers).run(jobs)]
+
+        if self.ffmpeg:
+            start_times = [int(round(start_time)) if start_time is not None else None for start_time in
+                           ffmpeg_extract_subclips(source_path, ranges, targetnames=clip_paths)]
+        else:
+            outputs = ffmpeg_encode_subclips(source_path, ranges, targetnames=clip_paths,
+                                             audio_filters=[self.loudness_filter(source_path, start_time,
+                                                                                 self.clip_length)
+                                                            for start_time in start_times])
+            start_times = [start_time if output is not None else None
+                           for start_time, output in zip(start_times, outputs)]
+
+        # Only the clips that were actually written get a record.
+        produced = [(clip_path, start_time) for clip_path, start_time in zip(clip_paths, start_times)
+                    if start_time is not None and os.path.exists(clip_path) and os.path.getsize(clip_path) > 0]
+        if len(produced) < len(clip_paths):
+            print(f"!! {len(clip_paths) - len(produced)} of {len(clip_paths)} clips weren't created")
+        clip_paths = [clip_path for clip_path, _ in produced]
+        start_times = [start_time for _, start_time in produced]
+
+        # write all the entries to the db in one transaction
+        video_clip_records = [self.new_video_clip(start_time, self.clip_length) for start_time in start_times]
+        db.session.add_all(video_clip_records)
+        db.session.commit()
+
+        for clip_path, video_clip_record in zip(clip_paths, video_clip_records):
+            print(
+                f"Created database entry ({video_clip_record.id}) for video clip {clip_path} starting @ {video_clip_record.start_time}s")
+
+        return list(zip(clip_paths, video_clip_records))
+
+    def get_source_path(self):
+        """
+        Get the local path of the source video to cut clips from.
+        Sources downloaded to the output filename are moved aside first, so encoding never overwrites them.
         :return:
         """
-        return random.randint(0 + self.skip_intro_time, math.floor(self.video.duration - self.clip_length))
+        source_path = self.video_path if self.video_path is not None else self.output_filename
+        if source_path == self.output_filename:
+            source_path = self.workspace.file(f"source_{self._output_filename}")
+            os.rename(self.output_filename, source_path)
+            self.video_path = source_path
 
-    def upload_file_to_cloud(self, video_clip: VideoClip = None, image: ImageDb = None):
+        return source_path
+
+    def get_start_times(self, count):
+        """
+        Get the start times for multiple clips: the best scoring highlights when enabled, otherwise random.
+        :param count: number of start times
+        :return: sorted list of start times, may be shorter than count when the video runs out of room.
+        """
+        if self.highlights:
+            start_times = self.get_highlight_start_times(count)
+            if len(start_times) > 0:
+                return start_times
+
+            print("~ No highlights found (the source has no audio?), picking random start times instead.")
+
+        return self.get_random_start_times(count)
+
+    def get_start_time(self):
+        """
+        Get the start time for a clip: the best scoring highlight when enabled, otherwise random.
+        :return: start time, or None if there's no room left in the video.
+        """
+        if self.highlights:
+            start_times = self.get_highlight_start_times(1)
+            if len(start_times) > 0:
+                return start_times[0]
+
+            print("~ No highlights found (the source has no audio?), picking a random start time instead.")
+
+        return self.get_random_start_time()
+
+    def get_highlight_start_times(self, count):
+        """
+        Find the best scoring (highlight) windows of the source that don't overlap one another or previously posted clips.
+        :param count: number of start times
+        :return: sorted list of start times, empty if the source couldn't be scored.
+        """
+        detector = HighlightDetector(self.get_source_path(), scene_detection=self.scene_detection)
+        start_times = detector.top_windows(self.clip_length, count,
+                                           free_ranges=self.clip_range_index.free_start_ranges())
+
+        # Reserve the ranges so the following clips don't overlap them.
+        for start_time in start_times:
+            self.clip_range_index.add(start_time, self.clip_length)
+
+        return sorted(start_times)
+
+    def get_random_start_times(self, count):
+        """
+        Generate random start times for multiple clips that don't overlap one another, or previously posted clips.
+        :param count: number of start times to generate
+        :return: sorted list of start times, may be shorter than count when the video runs out of room.
+        """
+        start_times = []
+
+        while len(start_times) < count:
+            start_time = self.clip_range_index.sample_start_time()
+            if start_time is None:
+                break
+
+            # Reserve the range so the following clips don't overlap it.
+            self.clip_range_index.add(start_time, self.clip_length)
+            start_times.append(start_time)
+
+        return sorted(start_times)
+
+    def get_random_start_time(self):
+        """
+        Generate a random start time for the clip, sampled uniformly from the start times
+        (after skip_intro_time) that don't overlap previously uploaded clips.
+        :return: start time, or None if there's no room left in the video.
+        """
+        return self.clip_range_index.sample_start_time()
+
+    def upload_file_to_cloud(self, video_clip: VideoClip = None, image: ImageDb = None, filename=None):
         """
         Uploads the video clip to social media via the API.
+        :param filename: file to upload, defaults to the output filename (or local image)
         :return:
         """
         assert video_clip is not None or image is not None, "No video clip or image provided to upload."
 
         content_type = None
 
-        filename = None
-
         if video_clip is not None:
-            filename = self.output_filename
+            if filename is None:
+                filename = self.output_filename
+
+            # Check the clip fits the platforms before paying for the upload & the post.
+            result = preflight(filename, self.platforms, self.workspace.file(f"fit_{os.path.basename(filename)}"))
+            for platform, reason in result.rejected.items():
+                print(f"!! Not posting to {platform}: {reason}")
+            self.platforms = result.accepted_platforms(self.platforms)
+            if len(self.platforms) == 0:
+                print(f"!! {filename} doesn't fit the limits of any of the platforms, not uploading it.")
+                return None
+            filename = result.path
 
             content_type = mimetypes.guess_type(filename)[0]
 
-        if image is not None:
+        if image is not None and filename is None:
             if self.image_url is not None:
                 filename = self.output_filename
             else:
@@ -385,11 +820,15 @@ class VidBot(object):
         if filename is None:
             raise Exception(f"Could not determine filename")
 
+        # The same bytes uploaded before (e.g. a reposted clip or meme) are reused instead of uploaded again.
+        content_hash = file_sha256(filename)
+        reusable_upload = MediaUpload.find_by_content_hash(content_hash)
+        if reusable_upload is not None:
+            print(f"~ Reusing the upload of the same content: {reusable_upload.access_url}")
+            return reusable_upload.reuse(clip=video_clip if image is None else None, image=image)
+
         # retrieve the information
-        req = requests.get("https://app.ayrshare.com/api/media/uploadUrl",
-                           headers={'Authorization': f'Bearer {self.application_config.AYRSHARE_API_KEY}'},
-                           params={'contentType': content_type,
-                                   'fileName': f"{filename}"})
+        req = self.ayrshare.media_upload_url(content_type, os.path.basename(f"{filename}"))
 
         upload_request_response = req.json()
 
@@ -398,35 +837,50 @@ class VidBot(object):
         if image is not None:
             media_upload = MediaUpload(access_url=upload_request_response['accessUrl'],
                                        content_type=upload_request_response['contentType'],
-                                       upload_url=upload_request_response['uploadUrl'], image=image)
+                                       upload_url=upload_request_response['uploadUrl'], image=image,
+                                       content_hash=content_hash)
         else:
             media_upload = MediaUpload(access_url=upload_request_response['accessUrl'],
                                        content_type=upload_request_response['contentType'],
-                                       upload_url=upload_request_response['uploadUrl'], clip=video_clip)
+                                       upload_url=upload_request_response['uploadUrl'], clip=video_clip,
+                                       content_hash=content_hash)
         media_upload.save(commit=True)
 
         # upload the video
-
-        req = requests.put(upload_request_response['uploadUrl'],
-                           headers={'Content-Type': upload_request_response['contentType']},
-                           data=open(f"{filename}", 'rb'))
-
-        if req.status_code == 200:
+        if upload_file(upload_request_response['uploadUrl'], filename, upload_request_response['contentType']):
+            media_upload.uploaded = True
+            media_upload.save(commit=True)
             return media_upload
 
-        print(f"Upload failed with status code {req.status_code}")
         return None
 
+    @staticmethod
+    def is_video_file(file):
+        return is_video_file(file)
+
+    @staticmethod
+    def is_image_file(file):
+        return is_image_file(file)
+
     def validate_json(self, json_body):
-        req = requests.post("https://app.ayrshare.com/validateJSON", headers={"Content-Type": "text/plain"},
-                            data=json_body)
+        req = self.ayrshare.post("https://app.ayrshare.com/validateJSON", stats_name="POST validateJSON",
+                                 headers={"Content-Type": "text/plain"}, data=json_body)
         print(req.text)
 
+    def compile_keywords(self):
+        """
+        Compile the keywords of the post from its description & the keywords of the online source.
+        :return: list of keywords
+        """
+        return compile_keywords(post_description=self.post_description,
+                                source_keywords=self.source_metadata.keywords if self.source_metadata is not None else None)
+
     def compile_hashtag_string(self):
         _str = ""
-        for keyword in utils.compile_keywords(post_description=self.post_description):
+        for keyword in compile_keywords(post_description=self.post_description) or []:
             _str += f"#{keyword} "
         return _str.replace('##', "#")
+
     def parse_tags(self, string):
         """
         Parse tags from the configuration file on the given input string, replacing the key with the generated value.
@@ -443,150 +897,211 @@ class VidBot(object):
 
         return string
 
-    def post_to_socials(self, media_upload: MediaUpload):
+    @classmethod
+    def for_upload(cls, media_upload: MediaUpload, platforms, post_description=None, post_title=None,
+                   application_config=DefaultConfig()):
         """
-        Send the video clip to TikTok via the API.
-        Does not currently support setting description / hashtags so these will be done via the user when approving the upload inside the official TikTok API.
-
-        :param media_upload:
-        :return:
+        VidBot of a previous upload (its clip's source or its image), to build posts of the upload
+        exactly like the run that made it would.
+        :param media_upload: the upload to post
+        :param platforms: platforms to post to
+        :param post_description: description of the post
+        :param post_title: title of the post, defaults to the title of the clip (or image)
+        :return: VidBot
+        """
+        if media_upload.is_image:
+            image = media_upload.image
+            return cls(image_url=image.url if "http" in image.url else None,
+                       local_image_location=image.url if "http" not in image.url else None,
+                       post_description=post_description, platforms=platforms,
+                       post_title=post_title if post_title is not None else image.title,
+                       application_config=application_config)
+
+        url = media_upload.clip.url
+        return cls(youtube_video_download_link=url if is_youtube_url(url) else None,
+                   tiktok_video_url=url if is_tiktok_url(url) else None,
+                   google_drive_link=url if is_google_drive_url(url) else None,
+                   local_video_clip_location=url if "http" not in url else None,
+                   clip_length=media_upload.clip.duration, post_description=post_description, platforms=platforms,
+                   post_title=post_title if post_title is not None else media_upload.clip.title,
+                   application_config=application_config)
+
+    def build_post_data(self, media_upload: MediaUpload, is_video, is_image=False, date_time: maya.MayaDT = None,
+                        keywords=None):
+        """
+        Build the request body of a post of the upload, a single request for all the platforms.
+        Every platform gets its own text & options, from the PLATFORM_DEFAULTS of the configuration.
+        :param media_upload: upload the post is made with
+        :param is_video: whether the upload is a video
+        :param is_image: whether the upload is an image
+        :param date_time: when the post is scheduled for, posted right away when None
+        :param keywords: tags of the youtube post, defaults to the compiled keywords
+        :return: dict
         """
-
-        date_time = None
-
-        filename = None
-
-        if self.local_image_location is not None:
-            filename = self.local_image_location
-
-        if self.local_video_clip_location is not None:
-            filename = self.local_video_clip_location
-
-        if filename is None and self.output_filename is None:
-            print("Unable to post as no filename is available.")
-            return
-
-        is_video_file = self.is_video_file(self.output_filename if self.output_filename is not None else filename)
-
         platform_defaults = self.application_config.PLATFORM_DEFAULTS
 
-        compiled_keyword_list = self.compile_keywords(post=True)
+        if keywords is None:
+            keywords = self.compile_keywords()
+
+        post_data = {
+            "platforms": self.platforms,
+            "mediaUrls": [media_upload.access_url],
+            "isVideo": is_video,
+            "shortenLinks": False,
+            "requiresApproval": False,
+        }
+        post_texts = {}
 
-        # post to each social platform one by one,
         for platform in self.platforms:
-            post_data = {
-                "post": f"{self.post_description}",
-                "platforms": platform,
-                "mediaUrls": [media_upload.access_url],
-                "isVideo": is_video_file,
-                "shortenLinks": False,
-                "requiresApproval": False,
-            }
+            post_text = f"{self.post_description}"
 
             # Match the platforms we're
             # with the default values for that platform.
             match platform:
                 case "twitter":
                     if 'post' in platform_defaults['twitter'].keys():
-                        post_data['post'] = self.parse_tags(platform_defaults['twitter']['post'])[0:280]
-                    if self.is_image_file(filename):
+                        post_text = self.parse_tags(platform_defaults['twitter']['post'])
+                    # The alt text is a field of the whole request (every platform would get it), it's only
+                    # sent when twitter is the only platform posted to.
+                    if is_image and self.platforms == ["twitter"]:
                         post_data['image_alt_text'] = self.parse_tags(platform_defaults['twitter']['image_alt_text'])
-                    post_data['post'] = post_data['post'][0:280]
+                    post_text = post_text[0:260]
                 case "instagram":
                     if 'post' in platform_defaults['instagram'].keys():
-                        post_data['post'] = self.parse_tags(platform_defaults['instagram']['post'])[0:2200]
-                    if self.is_video_file(filename):
+                        post_text = self.parse_tags(platform_defaults['instagram']['post'])[0:2200]
+                    if is_video:
                         post_data["instagramOptions"] = {
                             "reels": True,
                             "shareReelsFeed": True,
                         }
                 case "youtube":
                     if 'post' in platform_defaults['youtube'].keys():
-                        post_data['post'] = self.parse_tags(platform_defaults['youtube']['post'])
-
-                    thumbnail_url = None
-
-                    if self.youtube_video_download_link is not None:
-                        thumbnail_url = self.yt_vid.thumbnail_url
-
-                    if self.tiktok_video_url is not None:
-                        thumbnail_url = self.tiktok_downloader.thumbnail_url
-
-                    post_data["youTubeOptions"] = {
-                        "title": self.post_title[0:100],
-                        "post": post_data['post'],
-                        "tags": compiled_keyword_list,
-                        "visibility": platform_defaults['youtube']['visibility'] if 'visibility' in platform_defaults[
-                            'youtube'].keys() else "public",
-                        # todo IMPLEMENT THUMBNAIL CUSTOMIZATION
-                        "thumbNail": thumbnail_url,
-                        "madeForKids": False,
-                        "shorts": True,
-                    }
+                        post_text = self.parse_tags(platform_defaults['youtube']['post'])
+
+                    # Youtube only takes videos.
+                    if is_video:
+                        thumbnail_url = None
+                        if self.source_metadata is not None:
+                            thumbnail_url = self.source_metadata.thumbnail_url
+
+                        post_data["youTubeOptions"] = {
+                            "title": self.post_title[0:100],
+                            "post": post_text,
+                            "tags": keywords,
+                            "visibility": platform_defaults['youtube'].get('visibility', "public"),
+                            # todo IMPLEMENT THUMBNAIL CUSTOMIZATION
+                            "thumbNail": thumbnail_url,
+                            "madeForKids": False,
+                            "shorts": True,
+                        }
 
-                    if post_data['youTubeOptions']['thumbNail'] is None:
-                        del post_data['youTubeOptions']['thumbNail']
+                        if post_data['youTubeOptions']['thumbNail'] is None:
+                            del post_data['youTubeOptions']['thumbNail']
                 case "facebook":
                     if 'post' in platform_defaults['facebook'].keys():
-                        post_data['post'] = self.parse_tags(platform_defaults['facebook']['post'])
+                        post_text = self.parse_tags(platform_defaults['facebook']['post'])
 
                     post_data['faceBookOptions'] = {
                         "altText": self.parse_tags(platform_defaults['facebook']['altText']),
                         "mediaCaptions": self.parse_tags(platform_defaults['facebook']['mediaCaptions']),
                     }
 
-                    if is_video_file:
-                        post_data['faceBookOptions']["title"] = self.parse_tags(platform_defaults['facebook']['title']),
+                    if is_video:
+                        post_data['faceBookOptions']["title"] = self.parse_tags(platform_defaults['facebook']['title'])
+
+            post_texts[platform] = post_text
+
+        # The same text everywhere is sent as is, otherwise as the text of each platform (& a default).
+        if len(set(post_texts.values())) == 1:
+            post_data['post'] = next(iter(post_texts.values()))
+        else:
+            post_data['post'] = {"default": f"{self.post_description}", **post_texts}
 
-            # If there's a scheduled date set, process that value.
-            if self.scheduled_date is not None:
+        if date_time is not None:
+            post_data['scheduleDate'] = date_time.iso8601()
+
+        return post_data
+
+    def post_to_socials(self, media_upload: MediaUpload):
+        """
+        Send the video clip to TikTok via the API.
+        Does not currently support setting description / hashtags so these will be done via the user when approving the upload inside the official TikTok API.
+        All the platforms are posted to in a single request.
+
+        :param media_upload:
+        :return: the SocialMediaPost, or None if posting failed
+        """
+
+        date_time = None
+
+        filename = None
+
+        if self.local_image_location is not None:
+            filename = self.local_image_location
+
+        if self.local_video_clip_location is not None:
+            filename = self.local_video_clip_location
+
+        if filename is None and self._output_filename is None:
+            print("Unable to post as no filename is available.")
+            return
+
+        # Only the extension is checked, so the name is enough (the workspace may be gone already).
+        is_video_file = self.is_video_file(self._output_filename if self._output_filename is not None else filename)
+
+        compiled_keyword_list = self.compile_keywords()
+
+        # If there's a scheduled date set, process that value.
+        if self.scheduled_date is not None:
+            try:
+                date_time: maya.MayaDT = maya.when(self.scheduled_date, timezone="UTC")
+            except:
                 try:
-                    date_time: maya.MayaDT = maya.when(self.scheduled_date, timezone="UTC")
+                    date_time: maya.MayaDT = maya.parse(self.scheduled_date, timezone="UTC")
                 except:
-                    try:
-                        date_time: maya.MayaDT = maya.parse(self.scheduled_date, timezone="UTC")
-                    except:
-                        date_time: maya.MayaDT = maya.MayaDT.from_iso8601(self.scheduled_date)
-
-                post_data['scheduleDate'] = date_time.iso8601()
-
-            if platform == "twitter":
-                post_data['post'] = post_data['post'][0:260]
-                print('post emails trimmed to  {}'.format(len(post_data['post'])))
-            # Post the request to AYRShare.
-            resp = requests.post("https://app.ayrshare.com/api/post",
-                                 headers={'Authorization': f'Bearer {self.application_config.AYRSHARE_API_KEY}'},
-                                 json=post_data)
-            if resp.status_code == 200:
-                resp = resp.json()
-                api_id = resp['id']
-
-                if resp['status'] == 'scheduled':
-                    post = SocialMediaPost(api_id=api_id, platforms=platform, media_upload=media_upload,
-                                           post_time=date_time.datetime(
-                                               to_timezone="UTC") if date_time is not None else datetime.datetime.utcnow(),
-                                           hashtags=compiled_keyword_list, )
-                    post.save(commit=True)
-                    print("+ Scheduled on " + platform + " for " + self.scheduled_date)
-
-                elif resp['status'] == 'success':
-                    if 'postIds' in resp.keys():
-                        for entry in resp['postIds']:
-                            if entry['status'] != 'success':
-                                print(f"!! Failed to post to {entry['platform']}")
-                                continue
-
-                            post = SocialMediaPost(api_id=api_id, platforms=entry['platform'],
-                                                   post_url=entry['postUrl'] if 'postUrl' in entry.keys() else None,
-                                                   media_upload=media_upload, post_time=date_time.datetime(
-                                    to_timezone="UTC") if date_time is not None else datetime.datetime.utcnow(),
-                                                   hashtags=compiled_keyword_list)
-                            post.save(commit=True)
-                            print("+ Posted to " + entry['platform'])
-
-            else:
-                print(f"Failed to post to socials with status code {resp.status_code}")
-                print(f"Response: {resp.text}")
+                    date_time: maya.MayaDT = maya.MayaDT.from_iso8601(self.scheduled_date)
+
+        post_data = self.build_post_data(media_upload, is_video_file, is_image=self.is_image_file(filename),
+                                         date_time=date_time, keywords=compiled_keyword_list)
+
+        # Post the request to AYRShare.
+        resp = self.ayrshare.create_post(post_data)
+        try:
+            response = resp.json()
+        except ValueError:
+            response = {}
+
+        # Platforms that failed are reported in the same response as the ones that succeeded.
+        for error in response.get('errors', []):
+            print(f"!! Failed to post to {error.get('platform')}: {error.get('message', error)}")
+
+        api_id = response.get('id')
+        if api_id is None:
+            print(f"Failed to post to socials with status code {resp.status_code}")
+            print(f"Response: {resp.text}")
+            return None
+
+        post_time = date_time.datetime(to_timezone="UTC") if date_time is not None else datetime.datetime.utcnow()
+        published = [entry for entry in response.get('postIds', []) if entry.get('status') == 'success']
+        platforms = self.platforms if response.get('status') == 'scheduled' else \
+            [entry['platform'] for entry in published]
+
+        # The post & where it was published are written in one transaction.
+        post = SocialMediaPost(api_id=api_id, platforms=",".join(platforms), media_upload=media_upload,
+                               post_time=post_time, hashtags=compiled_keyword_list)
+        db.session.add(post)
+        db.session.flush()
+        for entry in published:
+            db.session.add(PublishedSocialMediaPost(platform=entry['platform'], social_media_post=post,
+                                                    post_url=entry.get('postUrl')))
+        db.session.commit()
+
+        if response.get('status') == 'scheduled':
+            print(f"+ Scheduled on {', '.join(platforms)} for {self.scheduled_date}")
+        for entry in published:
+            print("+ Posted to " + entry['platform'])
+
+        return post
 
     def is_slot_ok(self):
         """
@@ -674,11 +1189,59 @@ class VidBot(object):
             if click.prompt("Delete local image?", type=bool, default=False):
                 os.remove(self.local_image_location)
 
-        if self.output_filename is not None and self.no_cleanup is False:
-            os.remove(self.output_filename)
+        self.cleanup_files()
         print("~ Exiting...")
         return
 
+    def prepare_source(self):
+        """
+        Download the source video (if it's online) & convert local files to MP4 when required.
+        :return: path of the source video
+        """
+        self.video_path = self.download_video()
+
+        if self.local_video_clip_location is not None:
+            self.video_path = self.local_video_clip_location
+            if "mp4" not in mimetypes.guess_type(self.local_video_clip_location)[0]:
+                print(f"Converting file to MP4 Format: {self.local_video_clip_location} to {self.output_filename}")
+                ffmpeg_convert_to_mp4(self.local_video_clip_location, targetname=self.output_filename)
+
+                self.video_path = self.output_filename
+
+        return self.video_path
+
+    def preview_start_time(self):
+        """
+        Encode quick, low resolution proxies of candidate clips until one is approved,
+        so rejected candidates don't cost a full quality encode.
+        :return: start time of the approved clip, or None if no clip was approved (or there's no room left).
+        """
+        source_path = self.get_source_path()
+        preview_path = self.workspace.file(f"preview_{self._output_filename}")
+
+        while True:
+            start_time = self.get_start_time()
+            if start_time is None:
+                print(f"All of {self.get_video_url()} has already been clipped! "
+                      f"No room left for a new {self.clip_length}s clip.")
+                return None
+
+            print(f"Encoding preview of {source_path} [{start_time}s - {start_time + self.clip_length}s]")
+            if not ffmpeg_encode_preview(source_path, start_time, start_time + self.clip_length, preview_path):
+                print(f"!! Failed encoding the preview of {start_time}s, encoding the clip without one.")
+                return start_time
+
+            if click.prompt(f"Please preview clip before answering!\nUse this clip ({preview_path})? [Y/N] ",
+                            type=bool, default=True):
+                os.remove(preview_path)
+                return start_time
+
+            if not click.prompt("Preview another clip? [Y/N] ", type=bool, default=True):
+                return None
+
+            # Don't offer the rejected part of the video again.
+            self.clip_range_index.add(start_time, self.clip_length)
+
     def chop_and_post_video(self):
         """
         Perform the entire set of operations:
@@ -688,25 +1251,31 @@ class VidBot(object):
         :return:
         """
 
-        video_path = None
-        self.video_path = self.download_video()
+        # Recreated clips that are still uploaded (or in the clip cache) don't need the source.
+        clip_path, clip_record = self.reuse_video_clip()
+        reviewed = False
+        if clip_record is None:
+            self.prepare_source()
 
-        if self.local_video_clip_location is not None:
-            if "mp4" not in mimetypes.guess_type(self.local_video_clip_location)[0]:
-                print(f"Converting file to MP4 Format: {self.local_video_clip_location} to {self.output_filename}")
-                ffmpeg_convert_to_mp4(self.local_video_clip_location, targetname=self.output_filename)
+            if self.preview and self.subclip_start == -1 and self.clip_length != -1:
+                start_time = self.preview_start_time()
+                if start_time is None:
+                    self.cleanup_files()
+                    return
 
-                self.video_path = self.output_filename
-                self.video = VideoFileClip(self.output_filename)
-                self.audio = self.video.audio
+                clip_path, clip_record = self.create_video_clip(start_time=start_time)
+                reviewed = True
+            else:
+                clip_path, clip_record = self.create_video_clip()
 
-        clip_path, clip_record = None, None
-        clip_path, clip_record = self.create_video_clip()
+        if clip_record is None:
+            self.cleanup_files()
+            return
 
         media_file = None
-        if clip_record.upload is None:
-            upload = click.prompt(
-                f"Please preview clip before answering!\nUpload clip ({self.output_filename}) to cloud? [Y/N] ",
+        if clip_record.upload is None or clip_record.upload.is_expired:
+            upload = reviewed or click.prompt(
+                f"Please preview clip before answering!\nUpload clip ({clip_path}) to cloud? [Y/N] ",
                 type=bool, default=True)
             if not upload:
                 click.echo("Will not using the created clip")
@@ -714,29 +1283,86 @@ class VidBot(object):
                     self.chop_and_post_video()
                     return
                 else:
+                    self.cleanup_files()
                     exit(0)
                 return
-            media_file = self.upload_file_to_cloud(video_clip=clip_record)
+            media_file = self.upload_file_to_cloud(video_clip=clip_record, filename=clip_path)
+            if media_file is None:
+                self.cleanup_files()
+                return
         else:
             media_file = clip_record.upload
             click.echo(f"Reusing existing upload {media_file.access_url}")
 
         if not click.prompt("Proceed with posting socials?", type=bool, default=True):
+            self.cleanup_files()
             return
 
         self.post_to_socials(media_file)
         print(
-            f"Uploaded {'clip' if self.is_image_file(self.output_filename) is False else 'image'} to {','.join(self.platforms) if ',' in self.platforms else self.platforms} & Recorded this in the database!")
+            f"Uploaded {'clip' if self.is_image_file(self._output_filename) is False else 'image'} to {','.join(self.platforms) if ',' in self.platforms else self.platforms} & Recorded this in the database!")
 
         if "tiktok" in self.platforms:
             print("Open your TiKTok app to describe, hashtag & approve the upload.")
 
-        if len(self.created_files) > 0 and self.no_cleanup is False:
-            click.echo("Cleaning up files...")
-            for file in self.created_files:
-                try:
-                    os.remove(file)
-                    print(f"Removed {file}")
-                except:
-                    pass
+        self.cleanup_files()
+        print("Enjoy!")
+
+    def chop_and_post_videos(self, count):
+        """
+        Batch version of chop_and_post_video:
+        1. Download the video (once)
+        2. Cut count clips from it in a single pass
+        3. Upload & post each of the approved clips
+        :param count: number of clips to cut
+        :return:
+        """
+        # The clips can come from anywhere in the video, so it has to be downloaded completely.
+        self.partial_download = False
+        self.prepare_source()
+
+        clips = self.create_video_clips(count)
+        if len(clips) == 0:
+            click.echo(f"All of {self.get_video_url()} has already been clipped! "
+                       f"No room left for a new {self.clip_length}s clip.")
+            self.cleanup_files()
+            return
+
+        for clip_path, clip_record in clips:
+            if not click.prompt(f"Please preview clip before answering!\nUpload clip ({clip_path}) to cloud? [Y/N] ",
+                                type=bool, default=True):
+                click.echo(f"Skipping {clip_path}")
+                continue
+
+            media_file = self.upload_file_to_cloud(video_clip=clip_record, filename=clip_path)
+            if media_file is None:
+                continue
+
+            if not click.prompt("Proceed with posting socials?", type=bool, default=True):
+                continue
+
+            self.post_to_socials(media_file)
+            print(f"Uploaded clip {clip_path} to {','.join(self.platforms)} & Recorded this in the database!")
+
+        if "tiktok" in self.platforms:
+            print("Open your TiKTok app to describe, hashtag & approve the uploads.")
+
+        self.cleanup_files()
         print("Enjoy!")
+
+    def cleanup_files(self):
+        """
+        Remove the workspace holding the files created while downloading & clipping, unless asked not to.
+        Cached sources live outside of the workspace, they're only removed by cache eviction.
+        :return:
+        """
+        if self._workspace is None or not self._workspace.exists:
+            return
+
+        if self.no_cleanup:
+            click.echo(f"Keeping the files of this run in {self._workspace.path}")
+            return
+
+        click.echo("Cleaning up files...")
+        self._workspace.cleanup()
+        print(f"Removed {self._workspace.path}")
@@ -0,0 +1,207 @@
+"""
+Ayrshare API client service module.
+
+Every call to the Ayrshare API goes through a shared client, so connections (& their TLS handshakes)
+are kept alive & reused instead of paying for a new one per request. Requests get timeouts, rate
+limited & failed requests are retried with backoff (honouring Retry-After), and the latency of
+every endpoint is recorded so slow calls show up in the stats.
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = "https://app.ayrshare.com/api"
+
+# (connect, read) timeouts in seconds. Posting waits on the platforms, so reads get a generous timeout.
+TIMEOUT = (5, 120)
+
+# Status codes retried with backoff. Posts are only retried when they were rate limited, as a post
+# that failed with a server error may still have gone out.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RATE_LIMIT_STATUS_CODE = 429
+
+MAX_BACKOFF = 60
+
+
+class EndpointStats(object):
+    """
+    Latency & outcome counts of the requests to a single endpoint.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, error=False):
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if error:
+            self.errors += 1
+
+    @property
+    def average_time(self):
+        return self.total_time / self.requests if self.requests > 0 else 0.0
+
+    def __repr__(self):
+        return f"EndpointStats(name={self.name}, requests={self.requests}, average_time={self.average_time:.3f})"
+
+
+class AyrshareClient(object):
+    """
+    Pooled, instrumented client for the Ayrshare API.
+    """
+
+    def __init__(self, api_key, timeout=TIMEOUT, retries=3, pool_size=10, base_url=API_BASE_URL):
+        """
+        :param api_key: Ayrshare API key
+        :param timeout: (connect, read) timeout in seconds
+        :param retries: how many times a rate limited or failed request is retried
+        :param pool_size: number of connections kept alive
+        :param base_url: url the endpoints are relative to
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.base_url = base_url.rstrip('/')
+
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _endpoint_stats(self, name):
+        with self._stats_lock:
+            if name not in self.stats:
+                self.stats[name] = EndpointStats(name)
+            return self.stats[name]
+
+    @staticmethod
+    def backoff(attempt, response=None):
+        """
+        Seconds to wait before the next attempt: the Retry-After of the response when it has one,
+        exponential backoff with jitter otherwise.
+        """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                return min(int(retry_after), MAX_BACKOFF)
+
+        return min(2 ** attempt, MAX_BACKOFF) * (0.5 + random.random() / 2)
+
+    def request(self, method, endpoint, stats_name=None, idempotent=None, **kwargs):
+        """
+        Send a request to the API.
+        :param method: http method
+        :param endpoint: path relative to the api base url (e.g. media/uploadUrl), or a full url
+        :param stats_name: name the latency is recorded under, defaults to the method & endpoint.
+                           Endpoints with ids in their path should pass a name without them.
+        :param idempotent: whether the request can safely be retried after a server error.
+                           Defaults to True for GET requests only.
+        :return: requests.Response of the last attempt
+        """
+        stats = self._endpoint_stats(stats_name if stats_name is not None else f"{method} {endpoint}")
+        idempotent = idempotent if idempotent is not None else method == 'GET'
+        url = endpoint if endpoint.startswith('http') else f"{self.base_url}/{endpoint.lstrip('/')}"
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                stats.record(time.perf_counter() - start, error=True)
+                # A request that never connected can't have been processed, so it's always safe to retry.
+                if attempt >= self.retries or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                attempt += 1
+                stats.retries += 1
+                print(f"~ {method} {endpoint} failed ({e}), retrying ({attempt}/{self.retries})")
+                time.sleep(self.backoff(attempt))
+                continue
+
+            stats.record(time.perf_counter() - start, error=response.status_code >= 400)
+
+            retryable = response.status_code == RATE_LIMIT_STATUS_CODE or (
+                    idempotent and response.status_code in RETRY_STATUS_CODES)
+            if not retryable or attempt >= self.retries:
+                return response
+
+            attempt += 1
+            stats.retries += 1
+            delay = self.backoff(attempt, response)
+            print(f"~ {method} {endpoint} returned {response.status_code}, retrying in {delay:.1f}s "
+                  f"({attempt}/{self.retries})")
+            time.sleep(delay)
+
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request('POST', endpoint, **kwargs)
+
+    def media_upload_url(self, content_type, filename):
+        """
+        Request a presigned url to upload media to.
+        :return: requests.Response, its json holds accessUrl, uploadUrl & contentType
+        """
+        # Every call hands out a new upload url, so retrying one is harmless.
+        return self.get("media/uploadUrl", params={'contentType': content_type, 'fileName': filename})
+
+    def create_post(self, post_data):
+        """
+        Post (or schedule) to the platforms in post_data.
+        :return: requests.Response
+        """
+        return self.post("post", json=post_data)
+
+    def history(self, post_id=None):
+        """
+        Get the post history, or the history of a single post.
+        :return: requests.Response
+        """
+        if post_id is None:
+            return self.get("history")
+        return self.get(f"history/{post_id}", stats_name="GET history/:id")
+
+    def print_stats(self):
+        if len(self.stats) == 0:
+            return
+
+        print("~ Ayrshare API latency")
+        print(f"  {'endpoint':<24} {'requests':>8} {'errors':>6} {'retries':>7} {'avg':>7} {'max':>7}")
+        for stats in sorted(self.stats.values(), key=lambda s: s.name):
+            print(f"  {stats.name:<24} {stats.requests:>8} {stats.errors:>6} {stats.retries:>7} "
+                  f"{stats.average_time:>6.2f}s {stats.max_time:>6.2f}s")
+
+
+# Clients created during this process, keyed by their api key.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key=None):
+    """
+    Get the shared client for the api key, so every caller uses the same connection pool.
+    :param api_key: defaults to AYRSHARE_API_KEY
+    :return: AyrshareClient
+    """
+    if api_key is None:
+        from bot.webapp.config import Config
+        api_key = Config.AYRSHARE_API_KEY
+
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = AyrshareClient(api_key)
+        return _clients[api_key]
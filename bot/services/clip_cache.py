@@ -0,0 +1,132 @@
+"""
+Clip cache service module.
+
+Keeps encoded clips on disk so recreating a clip (redo_clip) doesn't download & encode the same
+cut again. Clips are stored under the hash of what produced them: the canonical source, the start
+time, the duration & the encoder settings. When the cache outgrows its size cap, the least
+recently used clips are removed.
+"""
+import hashlib
+import os
+import shutil
+
+
+def clip_cache_key(source_id, start_time, duration, encoder_settings):
+    """
+    Key of a clip in the cache.
+    :param source_id: canonical id of the source
+    :param start_time: start of the clip in seconds
+    :param duration: length of the clip in seconds
+    :param encoder_settings: string describing how the clip was encoded
+    :return: hex digest
+    """
+    key = f"{source_id}|{int(start_time)}|{int(duration)}|{encoder_settings}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ClipCache(object):
+    """
+    Size bounded, least recently used cache of encoded clips.
+    """
+
+    def __init__(self, cache_dir=None, max_size=None):
+        """
+        :param cache_dir: directory the clips are stored in, defaults to <MEDIA_CACHE_DIR>/clips
+        :param max_size: size cap in bytes, defaults to CLIP_CACHE_MAX_SIZE. 0 disables the cache.
+        """
+        from bot.webapp.config import Config
+
+        self.cache_dir = os.path.expanduser(cache_dir if cache_dir is not None else os.path.join(
+            Config.MEDIA_CACHE_DIR, "clips"))
+        self.max_size = max_size if max_size is not None else Config.CLIP_CACHE_MAX_SIZE
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def path(self, key, extension=".mp4"):
+        return os.path.join(self.cache_dir, f"{key}{extension}")
+
+    def get(self, key, extension=".mp4"):
+        """
+        Get the cached clip, marking it as recently used.
+        :param key: see clip_cache_key, None for clips that can't be cached
+        :return: path of the cached clip, or None if it isn't cached.
+        """
+        if not self.enabled or key is None:
+            return None
+
+        path = self.path(key, extension)
+        if not os.path.exists(path):
+            return None
+
+        # The modification time doubles as the last access time for the eviction.
+        os.utime(path)
+        return path
+
+    def put(self, key, file_path, extension=".mp4"):
+        """
+        Copy an encoded clip into the cache.
+        :param key: see clip_cache_key, None for clips that can't be cached
+        :param file_path: the encoded clip, it's left in place.
+        :return: path of the cached clip, None if the cache is disabled.
+        """
+        if not self.enabled or key is None or file_path is None or not os.path.exists(file_path):
+            return None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        path = self.path(key, extension)
+        # Copied under a temporary name first, so a half written clip is never served.
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, path)
+
+        self.evict(keep=path)
+        return path
+
+    def fetch(self, key, target_path, extension=".mp4"):
+        """
+        Copy the cached clip to target_path.
+        :return: True if the clip was cached (& copied)
+        """
+        path = self.get(key, extension)
+        if path is None:
+            return False
+
+        shutil.copyfile(path, target_path)
+        return True
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used clips until the cache fits in its size cap.
+        :param keep: path that must not be evicted (the clip just added)
+        :return: number of clips evicted
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            evicted += 1
+
+        if evicted > 0:
+            print(f"~ Evicted {evicted} clips from the clip cache")
+        return evicted
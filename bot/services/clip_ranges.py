@@ -0,0 +1,122 @@
+"""
+Clip range service module.
+
+Keeps track of which parts of a source video have already been clipped, so new clips can be
+placed directly into the uncovered gaps instead of guessing random start times & retrying.
+"""
+import bisect
+import math
+import random
+
+from sqlalchemy import or_
+
+from bot.webapp.models import VideoClip, MediaUpload
+
+
+class ClipRangeIndex(object):
+    """
+    Sorted, merged list of the [start, end) ranges of a source that are already used by clips.
+    """
+
+    def __init__(self, duration, clip_length, skip_intro_time=0, ranges=None):
+        """
+        :param duration: duration of the source video in seconds
+        :param clip_length: length of the clips that will be cut from it
+        :param skip_intro_time: nothing starts before this many seconds
+        :param ranges: (start_time, duration) tuples of existing clips
+        """
+        self.duration = duration
+        self.clip_length = clip_length
+        self.skip_intro_time = skip_intro_time
+        self.starts = []
+        self.ends = []
+
+        for start_time, length in ranges or []:
+            self.add(start_time, length)
+
+    @classmethod
+    def for_source(cls, source_id, duration, clip_length, skip_intro_time=0, fingerprint=None):
+        """
+        Load the ranges of every uploaded clip of the source in a single (indexed) query.
+        :param source_id: canonical id of the source the clips were cut from
+        :param fingerprint: content fingerprint of the source, also matches clips of the same video from other sources
+        :return: ClipRangeIndex
+        """
+        source_filter = VideoClip.source_id == source_id
+        if fingerprint is not None:
+            source_filter = or_(source_filter, VideoClip.fingerprint == fingerprint)
+
+        ranges = VideoClip.query.join(MediaUpload, MediaUpload.clip_id == VideoClip.id) \
+            .filter(source_filter) \
+            .with_entities(VideoClip.start_time, VideoClip.duration).all()
+
+        return cls(duration, clip_length, skip_intro_time=skip_intro_time, ranges=ranges)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start_time, length):
+        """
+        Mark [start_time, start_time + length) as used, merging it with any range it touches.
+        """
+        start, end = start_time, start_time + length
+
+        # Ranges that overlap or touch the new one are merged into it.
+        first = bisect.bisect_left(self.ends, start)
+        last = bisect.bisect_right(self.starts, end)
+
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+    def overlaps(self, start_time, length=None):
+        """
+        Check whether a clip starting at start_time overlaps any used range.
+        :param start_time: start time in seconds
+        :param length: length of the clip, defaults to the clip length of the index
+        :return:
+        """
+        end = start_time + (self.clip_length if length is None else length)
+        index = bisect.bisect_right(self.ends, start_time)
+        return index < len(self.starts) and self.starts[index] < end
+
+    def free_start_ranges(self):
+        """
+        Get the (inclusive) ranges of whole-second start times a new clip can use without overlapping.
+        :return: list of (earliest start, latest start) tuples
+        """
+        free = []
+        gap_start = self.skip_intro_time
+
+        for start, end in zip(self.starts + [self.duration], self.ends + [self.duration]):
+            earliest = math.ceil(gap_start)
+            latest = math.floor(min(start, self.duration) - self.clip_length)
+            if latest >= earliest:
+                free.append((earliest, latest))
+            gap_start = max(gap_start, end)
+
+        return free
+
+    def is_exhausted(self):
+        return len(self.free_start_ranges()) == 0
+
+    def sample_start_time(self):
+        """
+        Pick a random start time, uniformly over every start that doesn't overlap a used range.
+        :return: start time in seconds, or None when there's no room left in the source.
+        """
+        free = self.free_start_ranges()
+        if len(free) == 0:
+            return None
+
+        sizes = [latest - earliest + 1 for earliest, latest in free]
+        offset = random.randrange(sum(sizes))
+        for (earliest, latest), size in zip(free, sizes):
+            if offset < size:
+                return earliest + offset
+            offset -= size
+
+        return None
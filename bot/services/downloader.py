@@ -0,0 +1,188 @@
+"""
+Downloader service module.
+
+Streams remote files to disk in chunks through a pooled session, so memory use stays flat no matter
+how large the file is. Data is written to a ``.part`` file that's resumed with a Range request when
+the connection drops, and only moved to its final name once its length has been verified.
+"""
+import hashlib
+import os
+import re
+from urllib.parse import urlsplit, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 * 1024
+
+# Shared by every download, so connections to the same host are kept alive & reused.
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=10))
+session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+
+class DownloadError(Exception):
+    """
+    Raised when a download fails (bad status code, length mismatch or out of retries).
+    """
+    pass
+
+
+def print_progress(downloaded, total):
+    """
+    Default progress callback, prints the progress of the download on a single line.
+    :param downloaded: bytes downloaded so far
+    :param total: total size in bytes, None if unknown
+    """
+    if total:
+        print(f"\r~ Downloaded {downloaded / 1024 / 1024:.1f} / {total / 1024 / 1024:.1f} MB "
+              f"({downloaded / total * 100:.0f}%)", end="" if downloaded < total else "\n")
+    else:
+        print(f"\r~ Downloaded {downloaded / 1024 / 1024:.1f} MB", end="")
+
+
+def get_response_filename(response, url):
+    """
+    Get the filename of a download from the Content-Disposition header, falling back to the url path.
+    """
+    disposition = response.headers.get('Content-Disposition', '')
+    match = re.search(r"filename\*=UTF-8''([^;]+)", disposition) or re.search(r'filename="?([^";]+)"?', disposition)
+    if match:
+        return os.path.basename(unquote(match.group(1)))
+
+    filename = os.path.basename(urlsplit(url).path)
+    return filename if filename else "download"
+
+
+def is_attachment(response):
+    """
+    Check whether the response is a file download rather than a page, e.g. the virus scan warning or
+    quota page Google Drive answers large files with (status 200, but no file).
+    """
+    content_type = response.headers.get('Content-Type', '')
+    return 'Content-Disposition' in response.headers and not content_type.startswith('text/html')
+
+
+class Downloader(object):
+    """
+    Streaming, resumable downloads to disk.
+    """
+
+    def __init__(self, retries=3, timeout=30, chunk_size=CHUNK_SIZE, progress_callback=None):
+        """
+        :param retries: how many times an interrupted download is resumed before giving up
+        :param timeout: connect / read timeout in seconds
+        :param chunk_size: bytes read from the connection & written to disk at a time
+        :param progress_callback: called with (bytes downloaded, total bytes or None) after every chunk
+        """
+        self.retries = retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+
+    def download(self, url, output_path=None, headers=None, output_dir=None, require_attachment=False):
+        """
+        Download url to output_path.
+        :param url: url of the file
+        :param output_path: where the file is saved. If None, the name given by the server is used.
+        :param headers: extra request headers
+        :param output_dir: directory the file is saved in when no output_path is given, defaults to the current directory.
+        :param require_attachment: only accept a file download (a Content-Disposition that isn't an html page).
+                                   For urls that answer with a page (e.g. a warning or quota page) instead of failing.
+        :return: path of the downloaded file
+        """
+        output_dir = output_dir if output_dir is not None else os.getcwd()
+        # Keyed by the url, so a part left behind by a download of another url is never resumed.
+        url_key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        part_path = f"{output_path}.{url_key}.part" if output_path is not None else \
+            os.path.join(output_dir, f".{url_key}.part")
+
+        attempt = 0
+        while True:
+            try:
+                response_filename = self._download_part(url, part_path, headers, require_attachment)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise DownloadError(f"Download of {url} failed after {self.retries} retries: {e}")
+                print(f"\n~ Download of {url} interrupted ({e}), resuming ({attempt}/{self.retries})")
+
+        if output_path is None:
+            output_path = os.path.join(output_dir, response_filename)
+
+        os.replace(part_path, output_path)
+        return output_path
+
+    def _download_part(self, url, part_path, headers=None, require_attachment=False):
+        """
+        Download (or resume downloading) url into part_path.
+        :return: filename suggested by the server
+        """
+        request_headers = {'Accept-Encoding': 'identity'}
+        if headers is not None:
+            request_headers.update(headers)
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > 0:
+            request_headers['Range'] = f"bytes={offset}-"
+
+        with session.get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # The part file is already complete.
+                return get_response_filename(response, url)
+
+            if response.status_code not in (200, 206):
+                raise DownloadError(f"Download of {url} failed with status code {response.status_code}")
+
+            if require_attachment and not is_attachment(response):
+                raise DownloadError(f"Download of {url} answered with a page instead of the file "
+                                    f"({response.headers.get('Content-Type', 'unknown content type')})")
+
+            if response.status_code == 200:
+                # Range not supported (or nothing to resume), start over.
+                offset = 0
+                total = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+            else:
+                content_range = response.headers.get('Content-Range', '')
+                total = int(content_range.split('/')[-1]) if content_range.split('/')[-1].isdigit() else None
+
+            downloaded = offset
+            with open(part_path, 'ab' if offset > 0 else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    if self.progress_callback is not None:
+                        self.progress_callback(downloaded, total)
+
+            if total is not None and downloaded != total:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Received {downloaded} of {total} bytes")
+
+            return get_response_filename(response, url)
+
+
+def google_drive_file_id(url):
+    """
+    Get the file id of a Google Drive share link.
+    :param url: share link (e.g. https://drive.google.com/file/d/<id>/view?usp=sharing)
+    :return: file id, or None if there's none in the link
+    """
+    match = re.search(r"/d/([\w-]+)", url) or re.search(r"[?&]id=([\w-]+)", url)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def google_drive_download_url(url):
+    """
+    Get the direct download url of a Google Drive share link.
+    :param url: share link (e.g. https://drive.google.com/file/d/<id>/view?usp=sharing)
+    :return: direct download url, or None if no file id could be found in the link
+    """
+    file_id = google_drive_file_id(url)
+    if file_id is None:
+        return None
+
+    # confirm=t skips the virus scan warning page served for large files.
+    return f"https://drive.google.com/uc?export=download&confirm=t&id={file_id}"
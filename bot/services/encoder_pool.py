@@ -0,0 +1,105 @@
+"""
+Encoder pool service module.
+
+Runs clip encodes concurrently in a pool of worker processes. Each worker's ffmpeg is given
+its share of the cores, so running several encodes at once doesn't oversubscribe the machine.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bot.utils import ffmpeg_encode_subclip
+from bot.webapp.database import db
+from bot.webapp.models import VideoClip
+
+
+class ClipJob(object):
+    """
+    A single clip to encode: ``duration`` seconds of ``source`` starting at ``start_time``, written to ``output``.
+    """
+
+    def __init__(self, source, start_time, duration, output, url=None, title=None, source_id=None, fingerprint=None,
+                 audio_filter=None):
+        """
+        :param source: local path of the source video
+        :param start_time: start of the clip in seconds
+        :param duration: length of the clip in seconds
+        :param output: path the clip is written to
+        :param url: url recorded on the VideoClip, defaults to the source path
+        :param title: title recorded on the VideoClip
+        :param source_id: canonical source id recorded on the VideoClip
+        :param fingerprint: content fingerprint of the source recorded on the VideoClip
+        :param audio_filter: ffmpeg audio filter applied while encoding, e.g. loudness normalization
+        """
+        self.source = source
+        self.start_time = start_time
+        self.duration = duration
+        self.output = output
+        self.url = url if url is not None else source
+        self.title = title
+        self.source_id = source_id
+        self.fingerprint = fingerprint
+        self.audio_filter = audio_filter
+
+    def __repr__(self):
+        return f"ClipJob(source={self.source}, start_time={self.start_time}, duration={self.duration}, output={self.output})"
+
+
+def _encode_job(job: ClipJob, threads):
+    """
+    Encode a single job. Runs inside a worker process.
+    :return: the job & whether the encode succeeded
+    """
+    success = ffmpeg_encode_subclip(job.source, job.start_time, job.start_time + job.duration, job.output,
+                                    threads=threads, audio_filter=job.audio_filter)
+    return job, success and os.path.exists(job.output) and os.path.getsize(job.output) > 0
+
+
+class EncoderPool(object):
+    """
+    Encodes a list of ClipJobs concurrently, recording a VideoClip for each successful encode.
+    """
+
+    def __init__(self, workers=None, threads_per_worker=None):
+        """
+        :param workers: number of concurrent encodes, defaults to a quarter of the cores (at least 1)
+        :param threads_per_worker: ffmpeg threads per encode, defaults to splitting the cores evenly over the workers
+        """
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers if workers is not None else max(1, cpu_count // 4)
+        self.threads_per_worker = threads_per_worker if threads_per_worker is not None else max(
+            1, cpu_count // self.workers)
+
+    def run(self, jobs: list[ClipJob], record=True):
+        """
+        Encode all the jobs, at most `workers` at a time.
+        :param jobs: clips to encode
+        :param record: save a VideoClip for every successful encode (in a single transaction)
+        :return: list of (job, VideoClip) tuples for the successful encodes, in the order of the jobs
+        """
+        if len(jobs) == 0:
+            return []
+
+        print(f"Encoding {len(jobs)} clips with {self.workers} workers ({self.threads_per_worker} threads each)")
+
+        succeeded = set()
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+            futures = {executor.submit(_encode_job, job, self.threads_per_worker): index
+                       for index, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                job, success = future.result()
+                if not success:
+                    print(f"!! Failed encoding {job.output} from {job.source}")
+                    continue
+
+                print(f"+ Encoded {job.output}")
+                succeeded.add(futures[future])
+
+        finished = [job for index, job in enumerate(jobs) if index in succeeded]
+
+        records = [VideoClip(url=job.url, title=job.title, start_time=job.start_time, duration=job.duration,
+                             source_id=job.source_id, fingerprint=job.fingerprint) for job in finished]
+        if record and len(records) > 0:
+            db.session.add_all(records)
+            db.session.commit()
+
+        return list(zip(finished, records))
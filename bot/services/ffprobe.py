@@ -0,0 +1,322 @@
+"""
+ffprobe service module.
+
+Probes media files for stream information, caching the results per source file so repeated
+clipping of the same source doesn't pay for the probe more than once. Files in the scratch workspace
+of a run are never probed again after it, so their probes are only kept in memory. Every kind of
+cached data is capped at MEDIA_CACHE_MAX_ENTRIES files, the least recently used are evicted.
+"""
+import bisect
+import hashlib
+import json
+import os
+import subprocess as sp
+
+
+class KeyframeIndex(object):
+    """
+    Sorted list of the keyframe (IDR) timestamps of a source's video stream.
+    Built once per source with ffprobe & cached on disk alongside its size / mtime.
+    """
+
+    def __init__(self, source_path, keyframes=None):
+        self.source_path = source_path
+        self.keyframes = sorted(keyframes) if keyframes is not None else []
+
+    def __len__(self):
+        return len(self.keyframes)
+
+    def previous(self, time):
+        """
+        Get the last keyframe at or before the given time.
+        :param time: time in seconds
+        :return: keyframe time (seconds) or None if there isn't one.
+        """
+        index = bisect.bisect_right(self.keyframes, time)
+        if index == 0:
+            return None
+        return self.keyframes[index - 1]
+
+    def next(self, time):
+        """
+        Get the first keyframe at or after the given time.
+        :param time: time in seconds
+        :return: keyframe time (seconds) or None if there isn't one.
+        """
+        index = bisect.bisect_left(self.keyframes, time)
+        if index == len(self.keyframes):
+            return None
+        return self.keyframes[index]
+
+    def nearest(self, time):
+        """
+        Get the keyframe closest to the given time.
+        :param time: time in seconds
+        :return: keyframe time (seconds) or None if the index is empty.
+        """
+        candidates = [k for k in (self.previous(time), self.next(time)) if k is not None]
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda k: abs(k - time))
+
+    def is_keyframe(self, time, tolerance=0.05):
+        nearest = self.nearest(time)
+        return nearest is not None and abs(nearest - time) <= tolerance
+
+
+# Keyframe indexes loaded during this process, keyed by the source fingerprint.
+_keyframe_indexes = {}
+
+
+def get_cache_dir(kind):
+    """
+    Get (and create) the directory that holds cached probe data of the given kind.
+    :param kind: sub directory name, e.g. keyframes
+    :return:
+    """
+    from bot.webapp.config import Config
+
+    path = os.path.join(os.path.expanduser(Config.MEDIA_CACHE_DIR), kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_cache_file(cache_file):
+    """
+    Read json data from the cache, marking the entry as recently used.
+    :return: the data, or None if it isn't cached
+    """
+    try:
+        with open(cache_file, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    touch_cache_file(cache_file)
+    return data
+
+
+def touch_cache_file(cache_file):
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+
+
+def write_cache_file(cache_file, data):
+    """
+    Write json data to the cache, atomically so concurrent runs never read a half written file.
+    """
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_file, cache_file)
+    evict_cache_files(os.path.dirname(cache_file), keep=cache_file)
+
+
+def evict_cache_files(cache_dir, max_entries=None, keep=None):
+    """
+    Remove the least recently used entries of a cache directory until it holds at most max_entries.
+    :param max_entries: defaults to MEDIA_CACHE_MAX_ENTRIES
+    :param keep: path that must not be evicted (the entry just written)
+    :return: number of entries evicted
+    """
+    if max_entries is None:
+        from bot.webapp.config import Config
+        max_entries = Config.MEDIA_CACHE_MAX_ENTRIES
+
+    entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(cache_dir)
+               if entry.is_file() and ".tmp" not in entry.name and entry.path != keep]
+    if keep is not None:
+        max_entries -= 1
+
+    evicted = 0
+    for _, path in sorted(entries)[:max(0, len(entries) - max_entries)]:
+        try:
+            os.remove(path)
+            evicted += 1
+        except FileNotFoundError:
+            pass
+
+    return evicted
+
+
+def is_scratch_file(path):
+    """
+    Check whether the file is inside the scratch workspace of a run, see bot.services.workspace.
+    """
+    from bot.services.workspace import is_workspace_path
+
+    return is_workspace_path(path)
+
+
+def source_fingerprint(path):
+    """
+    Cheap identity of a local file (path, size & mtime) used to key cached probe data.
+    :param path:
+    :return:
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def probe_keyframes(path):
+    """
+    Read the packet timestamps of the first video stream, keeping only the keyframes.
+    Reads packets only (no decoding) so this is quick even on multi-hour sources.
+    :param path:
+    :return: list of keyframe timestamps in seconds
+    """
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ]
+
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
+    if process.returncode != 0:
+        print(f"~ ffprobe failed reading keyframes of {path}: {process.stderr.strip()}")
+        return []
+
+    keyframes = []
+    for line in process.stdout.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or 'K' not in parts[1]:
+            continue
+        try:
+            keyframes.append(float(parts[0]))
+        except ValueError:
+            continue
+
+    return keyframes
+
+
+def get_keyframe_index(path):
+    """
+    Get the keyframe index for the source, probing it only if it isn't already cached.
+    :param path: local path of the source video
+    :return: KeyframeIndex
+    """
+    fingerprint = source_fingerprint(path)
+
+    if fingerprint in _keyframe_indexes:
+        return _keyframe_indexes[fingerprint]
+
+    persistent = not is_scratch_file(path)
+    cache_file = os.path.join(get_cache_dir("keyframes"), f"{fingerprint}.json")
+    keyframes = read_cache_file(cache_file) if persistent else None
+    if keyframes is not None:
+        index = KeyframeIndex(path, keyframes)
+        _keyframe_indexes[fingerprint] = index
+        return index
+
+    index = KeyframeIndex(path, probe_keyframes(path))
+
+    # Don't cache failed probes, they'll be retried next time.
+    if persistent and len(index) > 0:
+        write_cache_file(cache_file, index.keyframes)
+
+    _keyframe_indexes[fingerprint] = index
+    return index
+
+
+# Stream / format probes loaded during this process, keyed by the source fingerprint.
+_probes = {}
+
+
+def probe(path):
+    """
+    Probe the container format & streams of a local media file, caching the result per file.
+    :param path:
+    :return: ffprobe json output (dict with 'format' & 'streams') or None if probing failed.
+    """
+    fingerprint = source_fingerprint(path)
+
+    if fingerprint in _probes:
+        return _probes[fingerprint]
+
+    persistent = not is_scratch_file(path)
+    cache_file = os.path.join(get_cache_dir("probes"), f"{fingerprint}.json")
+    result = read_cache_file(cache_file) if persistent else None
+    if result is not None:
+        _probes[fingerprint] = result
+        return result
+
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_format',
+        '-show_streams',
+        '-of', 'json',
+        path
+    ]
+
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
+    if process.returncode != 0:
+        print(f"~ ffprobe failed on {path}: {process.stderr.strip()}")
+        return None
+
+    result = json.loads(process.stdout)
+    if persistent:
+        write_cache_file(cache_file, result)
+
+    _probes[fingerprint] = result
+    return result
+
+
+def get_duration(path):
+    """
+    Get the duration of a local media file in seconds.
+    :param path:
+    :return: duration (float) or None if it couldn't be determined.
+    """
+    result = probe(path)
+    if result is None:
+        return None
+
+    try:
+        return float(result['format']['duration'])
+    except (KeyError, ValueError):
+        pass
+
+    for stream in result.get('streams', []):
+        if 'duration' in stream:
+            return float(stream['duration'])
+
+    return None
+
+
+def has_audio(path):
+    """
+    Check whether the media file has at least one audio stream.
+    :param path:
+    :return:
+    """
+    result = probe(path)
+    if result is None:
+        return False
+
+    return any(stream.get('codec_type') == 'audio' for stream in result.get('streams', []))
+
+
+def get_stream(path, codec_type):
+    """
+    Get the first stream of the given type from the media file's probe.
+    :param path:
+    :param codec_type: video or audio
+    :return: ffprobe stream dict, or None if there's no such stream (or probing failed).
+    """
+    result = probe(path)
+    if result is None:
+        return None
+
+    for stream in result.get('streams', []):
+        # Cover art is reported as a video stream, it's not the video track.
+        if stream.get('codec_type') == codec_type and stream.get('disposition', {}).get('attached_pic', 0) == 0:
+            return stream
+
+    return None
@@ -0,0 +1,88 @@
+"""
+Content fingerprint service module.
+
+Identifies a source by what's in it rather than where it came from: its duration plus the
+average hashes of a few frames sampled across it. The same video re-uploaded elsewhere (or
+downloaded from a different link) gets the same fingerprint, so its clips are still found
+by the duplicate check. Fingerprints are cached per file like the other probe data.
+"""
+import hashlib
+import os
+import subprocess as sp
+
+from bot.services.ffprobe import get_cache_dir, get_duration, read_cache_file, source_fingerprint, write_cache_file
+
+# Number of frames hashed, spread evenly over the video.
+FINGERPRINT_SAMPLES = 5
+
+# Frames are scaled down to HASH_SIZE x HASH_SIZE gray pixels before hashing.
+HASH_SIZE = 8
+
+# Fingerprints computed during this process, keyed by the source fingerprint.
+_content_fingerprints = {}
+
+
+def frame_hash(path, time):
+    """
+    Average hash of the frame at the given time: one bit per pixel of the scaled down frame,
+    set when the pixel is brighter than the mean.
+    :param path:
+    :param time: time of the frame in seconds
+    :return: hex digest, or None if the frame couldn't be read
+    """
+    command = [
+        'ffmpeg',
+        '-v', 'error',
+        '-ss', f"{time:.3f}",
+        '-i', path,
+        '-frames:v', '1',
+        '-vf', f"scale={HASH_SIZE}:{HASH_SIZE}:flags=area,format=gray",
+        '-f', 'rawvideo',
+        '-'
+    ]
+
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+    pixels = process.stdout
+    if process.returncode != 0 or len(pixels) != HASH_SIZE * HASH_SIZE:
+        return None
+
+    mean = sum(pixels) / len(pixels)
+    bits = 0
+    for pixel in pixels:
+        bits = (bits << 1) | (1 if pixel > mean else 0)
+
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def content_fingerprint(path, samples=FINGERPRINT_SAMPLES):
+    """
+    Fingerprint the content of a local video, see the module docstring.
+    :param path: local path of the video
+    :param samples: number of frames to hash
+    :return: sha256 hex digest, or None if the video couldn't be read
+    """
+    fingerprint = source_fingerprint(path)
+    if fingerprint in _content_fingerprints:
+        return _content_fingerprints[fingerprint]
+
+    cache_file = os.path.join(get_cache_dir("fingerprints"), f"{fingerprint}.json")
+    cached = read_cache_file(cache_file)
+    if cached is not None:
+        _content_fingerprints[fingerprint] = cached
+        return cached
+
+    duration = get_duration(path)
+    if duration is None or duration <= 0:
+        return None
+
+    hashes = [frame_hash(path, duration * (index + 1) / (samples + 1)) for index in range(samples)]
+    if None in hashes:
+        print(f"~ Unable to fingerprint {path}, couldn't read all of the sampled frames.")
+        return None
+
+    key = f"{int(round(duration))}:{','.join(hashes)}"
+    result = hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    write_cache_file(cache_file, result)
+    _content_fingerprints[fingerprint] = result
+    return result
@@ -0,0 +1,238 @@
+"""
+Highlight detection service module.
+
+Scores every clip-length window of a source so clips can start on its liveliest parts instead of
+at random (and land on dead air). The audio is decoded once, downsampled to mono, and reduced to
+per-hop features with NumPy: RMS energy, onset strength (rises in log energy) and, optionally, the
+ffmpeg scene change score of the video. The feature arrays are cached per source file.
+"""
+import os
+import re
+import subprocess as sp
+import tempfile
+
+import numpy as np
+
+from bot.services.ffprobe import evict_cache_files, get_cache_dir, source_fingerprint, touch_cache_file
+
+# Audio is decoded at this sample rate (mono), plenty for loudness & onsets.
+SAMPLE_RATE = 8000
+
+# Seconds covered by each feature value.
+HOP = 0.1
+
+# Weights of the (normalized) features in the window score.
+RMS_WEIGHT = 0.5
+ONSET_WEIGHT = 0.3
+SCENE_WEIGHT = 0.2
+
+
+def decode_audio(path, sample_rate=SAMPLE_RATE):
+    """
+    Decode the audio of the file to mono float samples.
+    :param path:
+    :param sample_rate:
+    :return: numpy float32 array of samples in [-1, 1], empty if the file has no (readable) audio.
+    """
+    command = [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', path,
+        '-vn',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 's16le',
+        '-'
+    ]
+
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+    if process.returncode != 0:
+        print(f"~ Unable to decode the audio of {path}: {process.stderr.decode(errors='ignore').strip()}")
+        return np.zeros(0, dtype=np.float32)
+
+    return np.frombuffer(process.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def audio_features(samples, sample_rate=SAMPLE_RATE, hop=HOP):
+    """
+    Reduce the samples to per-hop RMS energy & onset strength.
+    :param samples: mono samples
+    :return: (rms, onset) numpy arrays, one value per hop
+    """
+    hop_size = int(sample_rate * hop)
+    frame_count = len(samples) // hop_size
+    if frame_count == 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+    frames = samples[:frame_count * hop_size].reshape(frame_count, hop_size)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+
+    # Onsets show up as sudden rises of the (log) energy.
+    log_energy = np.log(rms + 1e-4)
+    onset = np.maximum(np.diff(log_energy, prepend=log_energy[0]), 0)
+
+    return rms.astype(np.float32), onset.astype(np.float32)
+
+
+def scene_scores(path, frame_count, hop=HOP):
+    """
+    Per-hop scene change scores of the video (the highest score of the frames in each hop), from ffmpeg's scene filter.
+    Decodes the whole video (scaled down), so it's a lot slower than the audio features.
+    :param path:
+    :param frame_count: number of hops to return
+    :return: numpy array of scores in [0, 1]
+    """
+    scores = np.zeros(frame_count, dtype=np.float32)
+
+    with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
+        metadata_file = f.name
+
+    try:
+        command = [
+            'ffmpeg',
+            '-v', 'error',
+            '-i', path,
+            '-an',
+            '-vf', f"scale=160:-2,select='gte(scene,0)',metadata=print:file={metadata_file}",
+            '-f', 'null',
+            '-'
+        ]
+        process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+        if process.returncode != 0:
+            print(f"~ Unable to detect the scene changes of {path}")
+            return scores
+
+        with open(metadata_file, 'r') as f:
+            metadata = f.read()
+    finally:
+        os.remove(metadata_file)
+
+    times = [float(t) for t in re.findall(r"pts_time:([\d.]+)", metadata)]
+    values = [float(v) for v in re.findall(r"lavfi\.scene_score=([\d.]+)", metadata)]
+    if len(times) == 0 or len(times) != len(values):
+        return scores
+
+    indexes = np.minimum((np.array(times) / hop).astype(np.int64), frame_count - 1)
+    np.maximum.at(scores, indexes, np.array(values, dtype=np.float32))
+    return scores
+
+
+def _normalize(values):
+    """
+    Scale the values to zero mean & unit variance (all zeros if they're constant).
+    """
+    std = values.std()
+    if std == 0:
+        return np.zeros_like(values)
+    return (values - values.mean()) / std
+
+
+class HighlightDetector(object):
+    """
+    Finds the liveliest clip-length windows of a local source.
+    """
+
+    def __init__(self, path, scene_detection=False, hop=HOP):
+        """
+        :param path: local path of the source
+        :param scene_detection: include the ffmpeg scene change scores (slow, decodes the video)
+        :param hop: seconds covered by each feature value
+        """
+        self.path = str(path)
+        self.scene_detection = scene_detection
+        self.hop = hop
+        self._features = None
+
+    def features(self):
+        """
+        Get the feature arrays of the source, computing them only if they aren't cached.
+        :return: dict of rms, onset & scene (only with scene detection) arrays
+        """
+        if self._features is not None:
+            return self._features
+
+        cache_file = os.path.join(get_cache_dir("highlights"), f"{source_fingerprint(self.path)}_{self.hop}.npz")
+        features = {}
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                features = {key: cached[key] for key in cached.files}
+            touch_cache_file(cache_file)
+
+        missing = 'rms' not in features or (self.scene_detection and 'scene' not in features)
+        if 'rms' not in features:
+            features['rms'], features['onset'] = audio_features(decode_audio(self.path), hop=self.hop)
+
+        if self.scene_detection and 'scene' not in features:
+            features['scene'] = scene_scores(self.path, len(features['rms']), hop=self.hop)
+
+        if missing and len(features['rms']) > 0:
+            temp_file = f"{cache_file}.{os.getpid()}.tmp.npz"
+            np.savez(temp_file, **features)
+            os.replace(temp_file, cache_file)
+            evict_cache_files(os.path.dirname(cache_file), keep=cache_file)
+
+        self._features = features
+        return self._features
+
+    def score_windows(self, clip_length):
+        """
+        Score every window of clip_length seconds that starts on a whole second.
+        :param clip_length: length of the windows in seconds
+        :return: (start times, scores) numpy arrays
+        """
+        features = self.features()
+        frame_count = len(features['rms'])
+        window = int(round(clip_length / self.hop))
+        step = int(round(1 / self.hop))
+        if frame_count < window or window == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # Onset density: hops whose onset strength stands out from the rest of the source.
+        onset = features['onset']
+        onsets = (onset > onset.mean() + onset.std()).astype(np.float32)
+
+        weighted = [(RMS_WEIGHT, features['rms']), (ONSET_WEIGHT, onsets)]
+        if self.scene_detection and 'scene' in features:
+            weighted.append((SCENE_WEIGHT, features['scene']))
+
+        starts = np.arange(0, frame_count - window + 1, step)
+        scores = np.zeros(len(starts), dtype=np.float64)
+        for weight, values in weighted:
+            # Window sums from the cumulative sum, no loop over the windows.
+            cumulative = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+            window_sums = cumulative[starts + window] - cumulative[starts]
+            scores += weight * _normalize(window_sums)
+
+        return starts // step, scores
+
+    def top_windows(self, clip_length, count, free_ranges=None):
+        """
+        Get the start times of the best scoring windows that don't overlap one another.
+        :param clip_length: length of the clips in seconds
+        :param count: number of windows
+        :param free_ranges: (earliest, latest) start time ranges the windows must start in, e.g.
+            ClipRangeIndex.free_start_ranges(). Defaults to anywhere in the source.
+        :return: list of start times (seconds) from the best window down, may be shorter than count.
+        """
+        start_times, scores = self.score_windows(clip_length)
+        if len(start_times) == 0:
+            return []
+
+        if free_ranges is not None:
+            allowed = np.zeros(len(start_times), dtype=bool)
+            for earliest, latest in free_ranges:
+                allowed |= (start_times >= earliest) & (start_times <= latest)
+            scores = np.where(allowed, scores, -np.inf)
+
+        chosen = []
+        while len(chosen) < count:
+            best = int(np.argmax(scores))
+            if scores[best] == -np.inf:
+                break
+
+            start_time = int(start_times[best])
+            chosen.append(start_time)
+            # Windows overlapping the chosen one are out.
+            scores[np.abs(start_times - start_time) < clip_length] = -np.inf
+
+        return chosen
@@ -0,0 +1,123 @@
+"""
+Loudness normalization service module.
+
+Brings clips from different sources to the same (EBU R128) loudness with ffmpeg's loudnorm filter.
+loudnorm is only accurate with two passes: one measuring the audio & one applying the measured
+values. The measuring pass only decodes the audio of the clip's window, and its result is cached per
+source & window, so (re)encoding a clip costs a single encode pass with the measured parameters.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import subprocess as sp
+
+from bot.services.ffprobe import get_cache_dir, has_audio, read_cache_file, source_fingerprint, write_cache_file
+
+# Maximum true peak (dBTP) & loudness range (LU) of the normalized audio.
+TRUE_PEAK = -1.5
+LOUDNESS_RANGE = 11
+
+# Values of the measuring pass that are fed to the encoding pass.
+MEASUREMENT_KEYS = ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')
+
+# Measurements loaded during this process, keyed by their cache key.
+_measurements = {}
+
+
+def loudnorm_options(target):
+    return f"I={target}:TP={TRUE_PEAK}:LRA={LOUDNESS_RANGE}"
+
+
+def measure_loudness(path, start, duration, target):
+    """
+    Run loudnorm's measuring pass over the audio of the window.
+    :param path: local path of the source
+    :param start: start of the window in seconds
+    :param duration: length of the window in seconds
+    :param target: integrated loudness target (LUFS)
+    :return: dict of the measured values (see MEASUREMENT_KEYS), None if the audio couldn't be measured.
+    """
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        '-ss', "%0.3f" % start,
+        '-i', path,
+        '-t', "%0.3f" % duration,
+        '-map', '0:a:0',
+        '-af', f"loudnorm={loudnorm_options(target)}:print_format=json",
+        '-f', 'null',
+        '-'
+    ]
+
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+    output = process.stderr.decode(errors='ignore')
+    # loudnorm prints its json summary last on stderr.
+    match = re.search(r"\{[^{}]*\"input_i\"[^{}]*\}\s*$", output)
+    if process.returncode != 0 or match is None:
+        print(f"~ Unable to measure the loudness of {path} [{start}s - {start + duration}s]")
+        return None
+
+    values = json.loads(match.group(0))
+    return {key: values[key] for key in MEASUREMENT_KEYS}
+
+
+def get_loudness(path, start, duration, target, source_key=None):
+    """
+    Get the loudness measurement of the window, measuring it only if it isn't already cached.
+    :param path: local path of the source
+    :param start: start of the window in seconds
+    :param duration: length of the window in seconds
+    :param target: integrated loudness target (LUFS)
+    :param source_key: stable id of the source (e.g. its canonical source id), so the measurement is reused
+                       whichever file it's downloaded to. Defaults to the fingerprint of the file.
+    :return: dict of the measured values, None if the source has no (measurable) audio.
+    """
+    if not has_audio(path):
+        return None
+
+    if source_key is None:
+        source_key = source_fingerprint(path)
+
+    key = hashlib.sha1(f"{source_key}|{start:.3f}|{duration:.3f}|{loudnorm_options(target)}".encode("utf-8")) \
+        .hexdigest()
+    if key in _measurements:
+        return _measurements[key]
+
+    cache_file = os.path.join(get_cache_dir("loudness"), f"{key}.json")
+    cached = read_cache_file(cache_file)
+    if cached is not None:
+        _measurements[key] = cached
+        return cached
+
+    measurement = measure_loudness(path, start, duration, target)
+    # Don't cache failed measurements, they'll be retried next time.
+    if measurement is not None:
+        write_cache_file(cache_file, measurement)
+
+    _measurements[key] = measurement
+    return measurement
+
+
+def loudnorm_filter(measurement, target):
+    """
+    Build the loudnorm filter of the encoding pass from the measured values.
+    :param measurement: see get_loudness
+    :param target: integrated loudness target (LUFS)
+    :return: audio filter string, None if the window is silent (nothing to normalize).
+    """
+    if measurement is None:
+        return None
+
+    try:
+        values = {key: float(measurement[key]) for key in MEASUREMENT_KEYS}
+    except (KeyError, ValueError):
+        return None
+
+    if not all(math.isfinite(value) for value in values.values()):
+        return None
+
+    return f"loudnorm={loudnorm_options(target)}:measured_I={values['input_i']}:measured_TP={values['input_tp']}" \
+           f":measured_LRA={values['input_lra']}:measured_thresh={values['input_thresh']}" \
+           f":offset={values['target_offset']}:linear=true"
@@ -0,0 +1,370 @@
+"""
+Partial download service module.
+
+Downloads only the part of a remote MP4 needed to cut a clip. The container index (moov box) is
+read with HTTP Range requests, the byte ranges holding the samples of the clip window are looked
+up in it, and only those ranges are fetched.
+
+The result is written as a sparse local copy of the remote file: every byte that was fetched is
+stored at its original offset & everything else is left as a hole. The index still describes the
+whole video, so ffmpeg can seek into the downloaded window like it would in the full file.
+"""
+import bisect
+import struct
+
+import requests
+
+# Top level boxes smaller than this are always copied completely (ftyp, free, moov, ...).
+SMALL_BOX_SIZE = 1024 * 1024
+
+# Byte ranges closer together than this are fetched with a single request.
+MERGE_GAP = 512 * 1024
+
+
+class PartialDownloadError(Exception):
+    """
+    Raised when the remote file can't be partially downloaded (no Range support, not an MP4, ...)
+    """
+    pass
+
+
+class Mp4Track(object):
+    """
+    Sample table of a single track, enough to map a time window to byte ranges.
+    """
+
+    def __init__(self, handler, timescale, sample_times, sample_offsets, sample_sizes, sync_samples):
+        self.handler = handler
+        self.timescale = timescale
+        self.sample_times = sample_times  # decode time of each sample (in timescale units)
+        self.sample_offsets = sample_offsets
+        self.sample_sizes = sample_sizes
+        self.sync_samples = sync_samples  # 0 based indexes of the keyframes, None when every sample is one
+
+    @property
+    def is_video(self):
+        return self.handler == b'vide'
+
+    def sample_range(self, start_time, end_time):
+        """
+        Get the (first, last) indexes of the samples that have to be read to decode [start_time, end_time].
+        For video tracks the first sample is moved back to the keyframe decoding has to start from.
+        :param start_time: seconds
+        :param end_time: seconds
+        :return:
+        """
+        if len(self.sample_times) == 0:
+            return None
+
+        first = max(0, bisect.bisect_right(self.sample_times, start_time * self.timescale) - 1)
+        last = min(len(self.sample_times) - 1, bisect.bisect_left(self.sample_times, end_time * self.timescale))
+
+        if self.sync_samples is not None and len(self.sync_samples) > 0:
+            keyframe = bisect.bisect_right(self.sync_samples, first) - 1
+            first = self.sync_samples[max(0, keyframe)]
+
+        return first, last
+
+    def byte_range(self, start_time, end_time):
+        """
+        Get the (first byte, last byte) of the file holding the samples of [start_time, end_time].
+        """
+        samples = self.sample_range(start_time, end_time)
+        if samples is None:
+            return None
+
+        first, last = samples
+        offsets = self.sample_offsets[first:last + 1]
+        ends = [offset + size for offset, size in zip(offsets, self.sample_sizes[first:last + 1])]
+        return min(offsets), max(ends) - 1
+
+
+def _iter_boxes(data, offset=0, end=None):
+    """
+    Iterate the boxes in data[offset:end].
+    :return: generator of (type, payload start, box end)
+    """
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+
+        if size < header:
+            break
+
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _find_box(data, box_type, offset, end):
+    for child_type, start, child_end in _iter_boxes(data, offset, end):
+        if child_type == box_type:
+            return start, child_end
+    return None
+
+
+def _parse_track(data, start, end):
+    """
+    Parse the sample table of a trak box.
+    :return: Mp4Track or None if the track is missing tables.
+    """
+    mdia = _find_box(data, b'mdia', start, end)
+    if mdia is None:
+        return None
+
+    hdlr = _find_box(data, b'hdlr', *mdia)
+    mdhd = _find_box(data, b'mdhd', *mdia)
+    minf = _find_box(data, b'minf', *mdia)
+    if hdlr is None or mdhd is None or minf is None:
+        return None
+
+    handler = data[hdlr[0] + 8:hdlr[0] + 12]
+
+    version = data[mdhd[0]]
+    if version == 1:
+        timescale = struct.unpack('>I', data[mdhd[0] + 20:mdhd[0] + 24])[0]
+    else:
+        timescale = struct.unpack('>I', data[mdhd[0] + 12:mdhd[0] + 16])[0]
+
+    stbl = _find_box(data, b'stbl', *minf)
+    if stbl is None:
+        return None
+
+    tables = {box_type: (box_start, box_end) for box_type, box_start, box_end in _iter_boxes(data, *stbl)}
+    if b'stts' not in tables or b'stsc' not in tables or b'stsz' not in tables:
+        return None
+
+    # sample sizes
+    stsz = tables[b'stsz'][0]
+    sample_size, sample_count = struct.unpack('>II', data[stsz + 4:stsz + 12])
+    if sample_size == 0:
+        sample_sizes = list(struct.unpack(f'>{sample_count}I', data[stsz + 12:stsz + 12 + 4 * sample_count]))
+    else:
+        sample_sizes = [sample_size] * sample_count
+
+    # sample decode times
+    stts = tables[b'stts'][0]
+    entry_count = struct.unpack('>I', data[stts + 4:stts + 8])[0]
+    sample_times = []
+    time = 0
+    for index in range(entry_count):
+        count, delta = struct.unpack('>II', data[stts + 8 + 8 * index:stts + 16 + 8 * index])
+        for _ in range(count):
+            sample_times.append(time)
+            time += delta
+
+    # chunk offsets
+    if b'stco' in tables:
+        stco = tables[b'stco'][0]
+        chunk_count = struct.unpack('>I', data[stco + 4:stco + 8])[0]
+        chunk_offsets = struct.unpack(f'>{chunk_count}I', data[stco + 8:stco + 8 + 4 * chunk_count])
+    elif b'co64' in tables:
+        co64 = tables[b'co64'][0]
+        chunk_count = struct.unpack('>I', data[co64 + 4:co64 + 8])[0]
+        chunk_offsets = struct.unpack(f'>{chunk_count}Q', data[co64 + 8:co64 + 8 + 8 * chunk_count])
+    else:
+        return None
+
+    # samples per chunk, run length encoded by first chunk
+    stsc = tables[b'stsc'][0]
+    entry_count = struct.unpack('>I', data[stsc + 4:stsc + 8])[0]
+    runs = [struct.unpack('>III', data[stsc + 8 + 12 * index:stsc + 20 + 12 * index])[:2]
+            for index in range(entry_count)]
+
+    sample_offsets = []
+    sample = 0
+    for run_index, (first_chunk, samples_per_chunk) in enumerate(runs):
+        last_chunk = runs[run_index + 1][0] - 1 if run_index + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(samples_per_chunk):
+                if sample >= sample_count:
+                    break
+                sample_offsets.append(offset)
+                offset += sample_sizes[sample]
+                sample += 1
+
+    sync_samples = None
+    if b'stss' in tables:
+        stss = tables[b'stss'][0]
+        sync_count = struct.unpack('>I', data[stss + 4:stss + 8])[0]
+        sync_samples = [number - 1 for number in
+                        struct.unpack(f'>{sync_count}I', data[stss + 8:stss + 8 + 4 * sync_count])]
+
+    count = min(len(sample_times), len(sample_offsets), len(sample_sizes))
+    return Mp4Track(handler, timescale, sample_times[:count], sample_offsets[:count], sample_sizes[:count],
+                    sync_samples)
+
+
+def parse_moov(moov):
+    """
+    Parse the tracks out of a complete moov box (including its header).
+    :param moov: bytes of the moov box
+    :return: list of Mp4Track
+    """
+    tracks = []
+    moov_box = next(_iter_boxes(moov), None)
+    if moov_box is None or moov_box[0] != b'moov':
+        raise PartialDownloadError("Not a moov box")
+
+    for box_type, start, end in _iter_boxes(moov, moov_box[1], moov_box[2]):
+        if box_type != b'trak':
+            continue
+        track = _parse_track(moov, start, end)
+        if track is not None:
+            tracks.append(track)
+
+    return tracks
+
+
+def merge_ranges(ranges, gap=MERGE_GAP):
+    """
+    Merge (first byte, last byte) ranges that overlap or are less than gap bytes apart.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if len(merged) > 0 and first <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class PartialDownloader(object):
+    """
+    Fetches the clip window of a remote MP4 into a sparse local file.
+    """
+
+    def __init__(self, url, session: requests.Session = None, timeout=30):
+        self.url = url
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        self.total_size = None
+        # (type, offset, size, header size) of the top level boxes read so far.
+        self.boxes = []
+        self.fetched = []
+
+    def fetch_range(self, first, last):
+        """
+        Fetch bytes [first, last] of the remote file.
+        """
+        response = self.session.get(self.url, headers={'Range': f'bytes={first}-{last}'}, timeout=self.timeout)
+        if response.status_code != 206:
+            raise PartialDownloadError(f"Range requests are not supported by the server (HTTP {response.status_code})")
+
+        if self.total_size is None and 'Content-Range' in response.headers:
+            self.total_size = int(response.headers['Content-Range'].split('/')[-1])
+
+        self.fetched.append((first, response.content))
+        return response.content
+
+    def read_index(self):
+        """
+        Walk the top level boxes of the remote file (reading only their headers) & fetch the moov box.
+        :return: bytes of the moov box
+        """
+        moov = None
+        offset = 0
+        self.fetch_range(0, 15)
+        header = self.fetched.pop()[1]
+
+        while self.total_size is None or offset < self.total_size:
+            if len(header) < 8:
+                break
+
+            size, box_type = struct.unpack('>I4s', header[:8])
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', header[8:16])[0]
+                header_size = 16
+            elif size == 0:
+                size = self.total_size - offset
+
+            if size < header_size:
+                raise PartialDownloadError(f"Invalid box @ {offset}, is the file an MP4?")
+
+            self.boxes.append((box_type, offset, size, header_size))
+
+            if box_type == b'moov':
+                moov = self.fetch_range(offset, offset + size - 1)
+            elif box_type != b'mdat' and size <= SMALL_BOX_SIZE:
+                self.fetch_range(offset, offset + size - 1)
+            else:
+                self.fetched.append((offset, header[:header_size]))
+
+            offset += size
+            if offset >= self.total_size:
+                break
+            header = self.fetch_range(offset, min(offset + 15, self.total_size - 1))
+            self.fetched.pop()
+
+        if moov is None:
+            raise PartialDownloadError("No moov box found in the remote file")
+
+        return moov
+
+    def download(self, start_time, duration, output_path, padding=1.0):
+        """
+        Download the parts of the remote file needed for [start_time, start_time + duration].
+        :param start_time: start of the clip in seconds
+        :param duration: length of the clip in seconds
+        :param output_path: where the sparse copy is written
+        :param padding: extra seconds fetched on either side of the window
+        :return: number of bytes fetched
+        """
+        tracks = parse_moov(self.read_index())
+        if len(tracks) == 0:
+            raise PartialDownloadError("No tracks found in the remote file")
+
+        ranges = [track.byte_range(max(0, start_time - padding), start_time + duration + padding)
+                  for track in tracks]
+        ranges = merge_ranges([byte_range for byte_range in ranges if byte_range is not None])
+
+        fetched_bytes = 0
+        with open(output_path, 'wb') as f:
+            f.truncate(self.total_size)
+            for offset, content in self.fetched:
+                f.seek(offset)
+                f.write(content)
+                fetched_bytes += len(content)
+
+            for first, last in ranges:
+                print(f"~ Fetching bytes {first}-{last} of {self.total_size}")
+                fetched_bytes += self.stream_range(first, last, f)
+
+        return fetched_bytes
+
+    def stream_range(self, first, last, f, chunk_size=1024 * 1024):
+        """
+        Stream bytes [first, last] of the remote file into the same offsets of the open file f.
+        :return: number of bytes written
+        """
+        written = 0
+        with self.session.get(self.url, headers={'Range': f'bytes={first}-{last}'}, timeout=self.timeout,
+                              stream=True) as response:
+            if response.status_code != 206:
+                raise PartialDownloadError(
+                    f"Range requests are not supported by the server (HTTP {response.status_code})")
+
+            f.seek(first)
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+
+        return written
+
+
+def download_clip_window(url, start_time, duration, output_path, session: requests.Session = None):
+    """
+    Download only the part of the remote MP4 at url needed to cut the clip [start_time, start_time + duration].
+    :return: output_path
+    """
+    downloader = PartialDownloader(url, session=session)
+    fetched_bytes = downloader.download(start_time, duration, output_path)
+    print(f"Downloaded {fetched_bytes} of {downloader.total_size} bytes to {output_path}")
+    return output_path
@@ -0,0 +1,194 @@
+"""
+Pipeline service module.
+
+Runs items through a chain of stages connected by bounded queues, so the stages of different
+items overlap: while one source encodes, the next one downloads and the previous one uploads.
+Every stage has its own number of worker threads, and its own timing stats (time spent working,
+waiting for input & waiting on the next stage), printed once the pipeline is drained.
+"""
+import queue
+import threading
+import time
+import traceback
+
+# Marks the end of the items on a queue, one per worker of the stage reading it.
+_DONE = object()
+
+
+class StageStats(object):
+    """
+    Timing stats of a single stage, summed over its workers.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.input_wait_time = 0.0
+        self.output_wait_time = 0.0
+        self.max_time = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy_time, outcome):
+        with self._lock:
+            self.busy_time += busy_time
+            self.max_time = max(self.max_time, busy_time)
+            if outcome == 'processed':
+                self.processed += 1
+            elif outcome == 'dropped':
+                self.dropped += 1
+            else:
+                self.failed += 1
+
+    def record_wait(self, input_wait_time=0.0, output_wait_time=0.0):
+        with self._lock:
+            self.input_wait_time += input_wait_time
+            self.output_wait_time += output_wait_time
+
+    @property
+    def items(self):
+        return self.processed + self.dropped + self.failed
+
+    @property
+    def average_time(self):
+        return self.busy_time / self.items if self.items > 0 else 0.0
+
+    def utilization(self, wall_time):
+        """
+        Share of the workers' time spent working, out of the pipeline's wall time.
+        """
+        if wall_time <= 0:
+            return 0.0
+        return self.busy_time / (wall_time * self.workers)
+
+    def __repr__(self):
+        return f"StageStats(name={self.name}, items={self.items}, busy_time={self.busy_time:.1f})"
+
+
+class Stage(object):
+    """
+    A step of the pipeline: handler is called with every item, its return value is passed on to the next stage.
+    Returning None drops the item, exceptions are printed & drop the item as well.
+    """
+
+    def __init__(self, name, handler, workers=1, on_drop=None):
+        """
+        :param name: name shown in the stats
+        :param handler: callable(item) returning the item for the next stage, or None
+        :param workers: number of items handled concurrently
+        :param on_drop: callable(item) called with items the handler dropped or failed on (e.g. to clean them up)
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.on_drop = on_drop
+
+
+class Pipeline(object):
+    """
+    Runs items through the stages, each stage feeding the next through a bounded queue.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size=1, context=None):
+        """
+        :param stages: stages in the order items go through them
+        :param queue_size: number of items waiting between two stages. A full queue blocks the stage feeding it,
+                           so a slow stage holds back the ones before it instead of piling up work (& disk).
+        :param context: callable returning a context manager every worker thread runs in, e.g. app.app_context
+        """
+        assert len(stages) > 0, "A pipeline needs at least one stage."
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.context = context
+        self.stats = [StageStats(stage.name, stage.workers) for stage in stages]
+        self.wall_time = 0.0
+
+    def _worker(self, stage, stats, input_queue, output_queue, results, results_lock):
+        while True:
+            wait_start = time.perf_counter()
+            item = input_queue.get()
+            stats.record_wait(input_wait_time=time.perf_counter() - wait_start)
+            if item is _DONE:
+                return
+
+            start = time.perf_counter()
+            try:
+                result = stage.handler(item)
+                outcome = 'processed' if result is not None else 'dropped'
+            except Exception:
+                print(f"!! {stage.name} failed on {item}:\n{traceback.format_exc()}")
+                result = None
+                outcome = 'failed'
+            stats.record(time.perf_counter() - start, outcome)
+
+            if result is None:
+                if stage.on_drop is not None:
+                    try:
+                        stage.on_drop(item)
+                    except Exception:
+                        print(f"!! Cleaning up {item} after {stage.name} failed:\n{traceback.format_exc()}")
+                continue
+
+            if output_queue is None:
+                with results_lock:
+                    results.append(result)
+                continue
+
+            wait_start = time.perf_counter()
+            output_queue.put(result)
+            stats.record_wait(output_wait_time=time.perf_counter() - wait_start)
+
+    def _run_worker(self, *args):
+        if self.context is None:
+            self._worker(*args)
+            return
+
+        with self.context():
+            self._worker(*args)
+
+    def run(self, items):
+        """
+        Run the items through every stage.
+        :param items: iterable of items for the first stage, consumed as the first stage has room for them.
+        :return: list of the results of the last stage (in the order they completed)
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+        results_lock = threading.Lock()
+
+        start = time.perf_counter()
+        stage_threads = []
+        for index, (stage, stats) in enumerate(zip(self.stages, self.stats)):
+            output_queue = queues[index + 1] if index + 1 < len(queues) else None
+            threads = [threading.Thread(target=self._run_worker, name=f"{stage.name}-{number}", daemon=True,
+                                        args=(stage, stats, queues[index], output_queue, results, results_lock))
+                       for number in range(stage.workers)]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        for item in items:
+            queues[0].put(item)
+
+        # Drain the stages in order: once every worker of a stage is done, nothing more reaches the next one.
+        for index, (stage, threads) in enumerate(zip(self.stages, stage_threads)):
+            for _ in threads:
+                queues[index].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        self.wall_time = time.perf_counter() - start
+        return results
+
+    def print_stats(self):
+        print(f"~ Pipeline finished in {self.wall_time:.1f}s")
+        print(f"  {'stage':<10} {'workers':>7} {'done':>5} {'dropped':>7} {'failed':>6} {'busy':>8} "
+              f"{'avg':>7} {'max':>7} {'starved':>8} {'blocked':>8} {'util':>5}")
+        for stats in self.stats:
+            print(f"  {stats.name:<10} {stats.workers:>7} {stats.processed:>5} {stats.dropped:>7} {stats.failed:>6} "
+                  f"{stats.busy_time:>7.1f}s {stats.average_time:>6.1f}s {stats.max_time:>6.1f}s "
+                  f"{stats.input_wait_time:>7.1f}s {stats.output_wait_time:>7.1f}s "
+                  f"{stats.utilization(self.wall_time):>5.0%}")
@@ -0,0 +1,291 @@
+"""
+Posting engine service module.
+
+Posts many uploads (or one upload to many profiles) at the same time instead of one request after the
+other. The posts run on an asyncio event loop: a semaphore bounds how many requests are in flight and
+a token bucket keeps the request rate under the API's rate limit. The requests themselves go through
+the shared, pooled Ayrshare client in a thread pool, so they keep its keep-alive connections, retries
+& latency stats. Results are written back to the database in batches, a transaction per batch instead
+of one per post.
+"""
+import asyncio
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import current_app
+
+from bot.services.ayrshare import get_client
+from bot.utils import get_maya_time
+from bot.webapp.database import db
+from bot.webapp.models import MediaUpload, SocialMediaPost, PublishedSocialMediaPost
+
+# Requests in flight at the same time.
+DEFAULT_CONCURRENCY = 8
+
+# Requests per second allowed by the token bucket.
+DEFAULT_RATE = 4.0
+
+# Results written to the database per transaction.
+DEFAULT_BATCH_SIZE = 25
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter for coroutines: holds up to ``capacity`` tokens, refilled at ``rate`` tokens per
+    second. Every request takes a token, waiting for the bucket to refill when it's empty.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: tokens added per second
+        :param capacity: most tokens the bucket holds (the burst size). Defaults to 1, spacing the requests evenly:
+                         a full bucket lets capacity requests through on top of the rate, which can trip the
+                         API's own per second limit.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else 1.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.waited = 0.0
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """
+        Take a token, waiting until one is available. Waiters are served in order.
+        """
+        # Created here so the lock belongs to the running event loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._refill()
+
+            self.tokens -= 1
+
+
+class PostJob(object):
+    """
+    A single post: an upload posted (or scheduled) to a list of platforms.
+    """
+
+    def __init__(self, media_upload: MediaUpload, platforms, schedule=None, description=None, title=None,
+                 hashtags=None, profile_keys=None, post_data=None):
+        """
+        :param media_upload: upload the post is made with, only optional when post_data is given & the
+                             post isn't recorded
+        :param platforms: list of platforms to post to
+        :param schedule: when to post, anything maya can parse. Posts right away when None.
+        :param description: text of the post
+        :param title: title of the post on youtube & facebook, defaults to the title of the clip
+        :param hashtags: hashtags recorded on the SocialMediaPost (& used as youtube tags), defaults to the keywords
+                         a run would compile
+        :param profile_keys: Ayrshare profile keys to post to, instead of the profile of the api key
+        :param post_data: the request body to send as is, instead of building it from the arguments above
+        """
+        self.media_upload = media_upload
+        self.media_upload_id = media_upload.id if media_upload is not None else None
+        self.platforms = platforms
+        self.schedule = get_maya_time(schedule) if schedule is not None else None
+        self.description = description
+        self.title = title if title is not None or media_upload is None or not media_upload.is_video \
+            else media_upload.clip.title
+        self.hashtags = hashtags if hashtags is not None else []
+        self.profile_keys = profile_keys
+        # Built here, on the thread that owns the database session, the request threads don't touch the models.
+        self.post_data = post_data if post_data is not None else self.build_post_data()
+
+    def build_post_data(self):
+        """
+        Build the request body with VidBot's builder, so the upload is posted exactly like a run would post it.
+        :return: dict
+        """
+        from bot import VidBot
+
+        vidbot = VidBot.for_upload(self.media_upload, self.platforms,
+                                   post_description=self.description if self.description is not None else "",
+                                   post_title=self.title)
+        if len(self.hashtags) == 0:
+            self.hashtags = vidbot.compile_keywords() or []
+
+        post_data = vidbot.build_post_data(self.media_upload, self.media_upload.is_video,
+                                           is_image=self.media_upload.is_image, date_time=self.schedule,
+                                           keywords=self.hashtags)
+
+        if self.profile_keys is not None:
+            post_data["profileKeys"] = self.profile_keys
+
+        return post_data
+
+    @property
+    def post_time(self):
+        return self.schedule.datetime(to_timezone="UTC") if self.schedule is not None else datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return f"PostJob(media_upload_id={self.media_upload_id}, platforms={self.platforms})"
+
+
+class PostResult(object):
+    """
+    The outcome of a PostJob.
+    """
+
+    def __init__(self, job: PostJob, status_code=None, response=None, error=None, elapsed=0.0):
+        """
+        :param job: the job that was posted
+        :param status_code: http status code of the response, None if no response was received
+        :param response: json of the response
+        :param error: why the request failed, if it didn't get a response
+        :param elapsed: seconds from sending the request (after the rate limiter) to its response
+        """
+        self.job = job
+        self.status_code = status_code
+        self.response = response if response is not None else {}
+        self.error = error
+        self.elapsed = elapsed
+        self.post = None
+
+    @property
+    def api_id(self):
+        return self.response.get('id')
+
+    @property
+    def succeeded(self):
+        return self.api_id is not None
+
+    @property
+    def scheduled(self):
+        return self.response.get('status') == 'scheduled'
+
+    @property
+    def published(self):
+        """
+        Entries of the platforms the post went out on.
+        """
+        return [entry for entry in self.response.get('postIds', []) if entry.get('status') == 'success']
+
+    @property
+    def platforms(self):
+        return self.job.platforms if self.scheduled else [entry['platform'] for entry in self.published]
+
+    def __repr__(self):
+        return f"PostResult(job={self.job}, status_code={self.status_code}, api_id={self.api_id})"
+
+
+class PostingEngine(object):
+    """
+    Posts a list of PostJobs concurrently, recording a SocialMediaPost for every successful post.
+    """
+
+    def __init__(self, client=None, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param client: AyrshareClient the posts are sent with, defaults to the shared client of the app's api key
+        :param concurrency: most requests in flight at the same time
+        :param rate: most requests started per second
+        :param burst: most requests started at once after being idle, defaults to 1
+        :param batch_size: number of results written to the database per transaction
+        """
+        self.client = client if client is not None else get_client(current_app.config.get("AYRSHARE_API_KEY"))
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.batch_size = batch_size
+        self.rate_limiter = None
+
+    def run(self, jobs: list[PostJob], record=True):
+        """
+        Post all the jobs, at most `concurrency` at a time.
+        :param jobs: posts to make
+        :param record: save a SocialMediaPost (& where it was published) for every successful post
+        :return: list of PostResults, in the order of the jobs
+        """
+        if len(jobs) == 0:
+            return []
+
+        print(f"Posting {len(jobs)} posts, {self.concurrency} at a time (at most {self.rate:g} per second)")
+        return asyncio.run(self._run(jobs, record))
+
+    async def _run(self, jobs, record):
+        self.rate_limiter = TokenBucket(self.rate, self.burst)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="posting") as executor:
+            tasks = [asyncio.create_task(self._post(job, semaphore, executor)) for job in jobs]
+
+            pending = []
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                if result.succeeded:
+                    print(f"+ Posted {result.job} to {', '.join(result.platforms)} ({result.elapsed:.2f}s)")
+                else:
+                    print(f"!! Failed posting {result.job}: {result.error or result.status_code}")
+
+                for error in result.response.get('errors', []):
+                    print(f"!! Failed to post {result.job} to {error.get('platform')}: "
+                          f"{error.get('message', error)}")
+
+                pending.append(result)
+                if record and len(pending) >= self.batch_size:
+                    self.record(pending)
+                    pending = []
+
+            if record and len(pending) > 0:
+                self.record(pending)
+
+        return [task.result() for task in tasks]
+
+    async def _post(self, job: PostJob, semaphore, executor):
+        async with semaphore:
+            await self.rate_limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                response = await asyncio.get_running_loop().run_in_executor(
+                    executor, self.client.create_post, job.post_data)
+            except requests.RequestException as e:
+                return PostResult(job, error=e, elapsed=time.perf_counter() - start)
+
+            elapsed = time.perf_counter() - start
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+
+            return PostResult(job, status_code=response.status_code, response=body if isinstance(body, dict) else {},
+                              error=None if body else response.text, elapsed=elapsed)
+
+    @staticmethod
+    def record(results: list[PostResult]):
+        """
+        Save the successful results & where they were published, in a single transaction.
+        Runs on the event loop's thread, the thread that owns the database session.
+        """
+        succeeded = [result for result in results if result.succeeded]
+        if len(succeeded) == 0:
+            return
+
+        for result in succeeded:
+            result.post = SocialMediaPost(api_id=result.api_id, platforms=",".join(result.platforms),
+                                          media_upload=result.job.media_upload, post_time=result.job.post_time,
+                                          hashtags=result.job.hashtags, title=result.job.title,
+                                          description=result.job.description)
+        db.session.add_all([result.post for result in succeeded])
+        db.session.flush()
+
+        db.session.add_all([PublishedSocialMediaPost(platform=entry['platform'], social_media_post=result.post,
+                                                     post_url=entry.get('postUrl'))
+                            for result in succeeded for entry in result.published])
+        db.session.commit()
+        print(f"~ Recorded {len(succeeded)} posts")
@@ -0,0 +1,155 @@
+"""
+Preflight service module.
+
+Checks a clip against the limits of the platforms it's about to be posted to (PLATFORM_LIMITS)
+before it's uploaded, so rejections don't cost an upload & a post request. Clips that are too big,
+too high bitrate or too high resolution are re-encoded (two-pass) to fit. Durations can't be fixed
+by re-encoding, so platforms whose duration limits the clip is outside of are reported as rejected.
+"""
+from bot.services.ffprobe import probe, get_stream
+from bot.utils import ffmpeg_encode_to_fit
+
+# Headroom left under the size limit, as the two-pass encode's size is only approximately on target.
+SIZE_MARGIN = 0.95
+
+AUDIO_BITRATE = 128000
+
+
+def get_limits(platforms, table=None):
+    """
+    Merge the limits of the platforms into the strictest set.
+    :param platforms: platform names
+    :param table: limits per platform, defaults to PLATFORM_LIMITS
+    :return: dict of limits
+    """
+    if table is None:
+        from bot.webapp.config import Config
+        table = Config.PLATFORM_LIMITS
+
+    limits = {}
+    for platform in platforms:
+        for key, value in table.get(platform, {}).items():
+            if key not in limits:
+                limits[key] = value
+            elif key.startswith('min_'):
+                limits[key] = max(limits[key], value)
+            else:
+                limits[key] = min(limits[key], value)
+
+    return limits
+
+
+def get_media_info(path):
+    """
+    Get the properties of the file the limits apply to, from its (cached) probe.
+    :return: dict with duration, size, bitrate & dimension (longest side), None if the file couldn't be probed.
+    """
+    result = probe(path)
+    if result is None:
+        return None
+
+    media_format = result.get('format', {})
+    video_stream = get_stream(path, 'video') or {}
+
+    duration = float(media_format.get('duration', 0) or 0)
+    size = int(media_format.get('size', 0) or 0)
+    bitrate = int(media_format.get('bit_rate', 0) or 0)
+    if bitrate == 0 and duration > 0:
+        bitrate = int(size * 8 / duration)
+
+    return {
+        'duration': duration,
+        'size': size,
+        'bitrate': bitrate,
+        'dimension': max(int(video_stream.get('width', 0) or 0), int(video_stream.get('height', 0) or 0)),
+    }
+
+
+def check_limits(info, limits):
+    """
+    Check the media info against the limits.
+    :return: dict of the violated limit names & a description of the violation
+    """
+    violations = {}
+
+    if 'min_duration' in limits and info['duration'] < limits['min_duration']:
+        violations['min_duration'] = f"{info['duration']:.1f}s is shorter than {limits['min_duration']}s"
+    if 'max_duration' in limits and info['duration'] > limits['max_duration']:
+        violations['max_duration'] = f"{info['duration']:.1f}s is longer than {limits['max_duration']}s"
+    if 'max_size' in limits and info['size'] > limits['max_size']:
+        violations['max_size'] = f"{info['size'] / 1024 / 1024:.1f}MB is over {limits['max_size'] / 1024 / 1024:.0f}MB"
+    if 'max_bitrate' in limits and info['bitrate'] > limits['max_bitrate']:
+        violations['max_bitrate'] = f"{info['bitrate'] / 1000:.0f}kbps is over {limits['max_bitrate'] / 1000:.0f}kbps"
+    if 'max_dimension' in limits and info['dimension'] > limits['max_dimension']:
+        violations['max_dimension'] = f"{info['dimension']}px is over {limits['max_dimension']}px"
+
+    return violations
+
+
+class PreflightResult(object):
+    """
+    Outcome of a preflight: the file to upload & the platforms that would reject it.
+    """
+
+    def __init__(self, path, rejected=None, reencoded=False):
+        """
+        :param path: file to upload (the re-encoded file if the original didn't fit)
+        :param rejected: dict of the platforms that would still reject the file & why
+        :param reencoded: whether the file was re-encoded to fit
+        """
+        self.path = path
+        self.rejected = rejected if rejected is not None else {}
+        self.reencoded = reencoded
+
+    def accepted_platforms(self, platforms):
+        return [platform for platform in platforms if platform not in self.rejected]
+
+
+def preflight(path, platforms, fit_path, table=None):
+    """
+    Check the clip against the limits of the platforms, re-encoding it to fit when it's too big.
+    :param path: clip to check
+    :param platforms: platforms the clip will be posted to
+    :param fit_path: where the re-encoded clip is written, if one is needed
+    :param table: limits per platform, defaults to PLATFORM_LIMITS
+    :return: PreflightResult
+    """
+    info = get_media_info(path)
+    if info is None:
+        print(f"~ Unable to probe {path}, skipping the preflight checks.")
+        return PreflightResult(path)
+
+    # Duration limits can't be fixed by re-encoding, those platforms are out.
+    rejected = {}
+    for platform in platforms:
+        violations = check_limits(info, get_limits([platform], table=table))
+        for key in ('min_duration', 'max_duration'):
+            if key in violations:
+                rejected[platform] = violations[key]
+
+    accepted = [platform for platform in platforms if platform not in rejected]
+    limits = get_limits(accepted, table=table)
+    violations = check_limits(info, limits)
+    if len(violations) == 0 or len(accepted) == 0:
+        return PreflightResult(path, rejected=rejected)
+
+    print(f"~ {path} doesn't fit the limits of {', '.join(accepted)}: {'; '.join(violations.values())}")
+
+    video_bitrate = info['bitrate'] - AUDIO_BITRATE
+    if 'max_bitrate' in limits:
+        video_bitrate = min(video_bitrate, limits['max_bitrate'] - AUDIO_BITRATE)
+    if 'max_size' in limits and info['duration'] > 0:
+        video_bitrate = min(video_bitrate, limits['max_size'] * 8 * SIZE_MARGIN / info['duration'] - AUDIO_BITRATE)
+
+    print(f"~ Re-encoding {path} to fit ({video_bitrate / 1000:.0f}kbps video)")
+    if not ffmpeg_encode_to_fit(path, fit_path, max(video_bitrate, 100000), max_dimension=limits.get('max_dimension'),
+                                audio_bitrate=AUDIO_BITRATE):
+        print(f"!! Failed re-encoding {path}, every platform would reject it.")
+        return PreflightResult(path, rejected={platform: "doesn't fit the platform limits" for platform in platforms})
+
+    fit_violations = check_limits(get_media_info(fit_path) or info, limits)
+    if len(fit_violations) > 0:
+        print(f"!! Re-encoded clip still doesn't fit: {'; '.join(fit_violations.values())}")
+        rejected.update({platform: '; '.join(fit_violations.values()) for platform in accepted})
+
+    return PreflightResult(fit_path, rejected=rejected, reencoded=True)
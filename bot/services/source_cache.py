@@ -0,0 +1,171 @@
+"""
+Source cache service module.
+
+Keeps downloaded source media on disk so following runs (and redo_clip) on the same source don't
+download it again. Files are stored by the sha256 of their content & indexed by their normalized
+source url in the cached_sources table. When the cache outgrows its size cap, the least recently
+used sources are evicted.
+"""
+import datetime
+import hashlib
+import os
+import shutil
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from bot.webapp.database import db
+from bot.webapp.models import CachedSource
+
+
+def normalize_source_url(url):
+    """
+    Normalize a source url so trivially different spellings of it share a cache entry.
+    Lowercases the scheme & host, sorts the query parameters and drops the fragment.
+    :param url:
+    :return:
+    """
+    parts = urlsplit(str(url).strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Hash the content of a file without loading it into memory.
+    :param path:
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SourceCache(object):
+    """
+    Content addressed, size bounded cache of downloaded source media.
+    """
+
+    def __init__(self, cache_dir=None, max_size=None):
+        """
+        :param cache_dir: directory the media is stored in, defaults to <MEDIA_CACHE_DIR>/sources
+        :param max_size: size cap in bytes, defaults to SOURCE_CACHE_MAX_SIZE. 0 disables the cache.
+        """
+        from bot.webapp.config import Config
+
+        self.cache_dir = os.path.expanduser(cache_dir if cache_dir is not None else os.path.join(
+            Config.MEDIA_CACHE_DIR, "sources"))
+        self.max_size = max_size if max_size is not None else Config.SOURCE_CACHE_MAX_SIZE
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def is_cached_path(self, path):
+        """
+        Check whether the path is a file inside the cache (which must never be cleaned up by a run).
+        """
+        if path is None:
+            return False
+        return os.path.abspath(str(path)).startswith(os.path.abspath(self.cache_dir) + os.sep)
+
+    def get(self, url):
+        """
+        Get the cached file of the source, marking it as recently used.
+        :param url: source url
+        :return: path of the cached file, or None if the source isn't cached.
+        """
+        if not self.enabled or url is None:
+            return None
+
+        entry = CachedSource.query.filter_by(url=normalize_source_url(url)).first()
+        if entry is None:
+            return None
+
+        if not os.path.exists(entry.path):
+            entry.delete(commit=True)
+            return None
+
+        entry.last_accessed = datetime.datetime.utcnow()
+        entry.save(commit=True)
+        return entry.path
+
+    def put(self, url, file_path):
+        """
+        Move a downloaded file into the cache & record it for the source url.
+        :param url: source url the file was downloaded from
+        :param file_path: downloaded file, it's moved (not copied) into the cache.
+        :return: path of the cached file (file_path unchanged if the cache is disabled)
+        """
+        if not self.enabled or url is None or file_path is None or not os.path.exists(file_path):
+            return file_path
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        content_hash = file_sha256(file_path)
+        extension = os.path.splitext(str(file_path))[1]
+        cached_path = os.path.join(self.cache_dir, f"{content_hash}{extension}")
+
+        if os.path.exists(cached_path):
+            os.remove(file_path)
+        else:
+            # Moved under a temporary name first, as concurrent runs may be caching the same source.
+            temp_path = f"{cached_path}.{os.getpid()}.tmp"
+            shutil.move(file_path, temp_path)
+            os.replace(temp_path, cached_path)
+
+        normalized_url = normalize_source_url(url)
+        entry = CachedSource.query.filter_by(url=normalized_url).first()
+        if entry is None:
+            entry = CachedSource(url=normalized_url, content_hash=content_hash, path=cached_path,
+                                 size=os.path.getsize(cached_path))
+        else:
+            entry.content_hash = content_hash
+            entry.path = cached_path
+            entry.size = os.path.getsize(cached_path)
+            entry.last_accessed = datetime.datetime.utcnow()
+        entry.save(commit=True)
+
+        print(f"~ Cached {url} as {cached_path}")
+        self.evict(keep=entry)
+        return cached_path
+
+    def total_size(self):
+        """
+        Size (bytes) of the files in the cache. Files shared by several urls are counted once.
+        """
+        sizes = {}
+        for path, size in CachedSource.query.with_entities(CachedSource.path, CachedSource.size).all():
+            sizes[path] = size
+        return sum(sizes.values())
+
+    def evict(self, keep: CachedSource = None):
+        """
+        Remove the least recently used sources until the cache fits in its size cap.
+        :param keep: entry that must not be evicted (the one just added)
+        :return: number of entries evicted
+        """
+        total_size = self.total_size()
+        if total_size <= self.max_size:
+            return 0
+
+        evicted = 0
+        for entry in CachedSource.query.order_by(CachedSource.last_accessed.asc()).all():
+            if total_size <= self.max_size:
+                break
+
+            if keep is not None and entry.path == keep.path:
+                continue
+
+            shared = CachedSource.query.filter(CachedSource.path == entry.path, CachedSource.id != entry.id).count()
+            if shared == 0:
+                total_size -= entry.size
+                if os.path.exists(entry.path):
+                    os.remove(entry.path)
+
+            print(f"~ Evicted {entry.url} from the source cache")
+            db.session.delete(entry)
+            evicted += 1
+
+        db.session.commit()
+        return evicted
@@ -0,0 +1,252 @@
+"""
+Source metadata service module.
+
+Title, description, duration, keywords & thumbnail of an online source are only fetched the first
+time a pipeline stage asks for them. They're memoized per source for the rest of the process & stored
+in the source_metadata table (keyed by the canonical id of the source) for SOURCE_METADATA_TTL
+seconds, so reposting from a known source needs no metadata requests at all.
+"""
+import datetime
+import os
+import re
+
+import requests
+from pytube import YouTube
+from pytube.cli import on_progress
+
+from bot.services.downloader import session, google_drive_file_id, google_drive_download_url, \
+    get_response_filename, is_attachment
+from bot.services.source_cache import normalize_source_url
+from bot.services.tiktok import TikTokDownloader
+from bot.webapp.models import CachedSourceMetadata
+
+# Metadata of the sources used during this process, keyed by the canonical source id.
+_source_metadata = {}
+
+METADATA_FIELDS = ('title', 'description', 'duration', 'keywords', 'thumbnail_url')
+
+# Short share links (vm.tiktok.com/<code>, tiktok.com/t/<code>) redirect to the url of the video.
+TIKTOK_SHORT_URL = re.compile(r"(?:vm|vt)\.tiktok\.com/|tiktok\.com/t/")
+
+# Short links resolved during this process, keyed by the short link.
+_resolved_short_urls = {}
+
+
+def is_youtube_url(url):
+    return url is not None and ("youtube" in str(url) or "youtu.be" in str(url))
+
+
+def is_tiktok_url(url):
+    return url is not None and "tiktok" in str(url)
+
+
+def is_google_drive_url(url):
+    return url is not None and "drive.google.com" in str(url)
+
+
+def resolve_tiktok_short_url(url, timeout=10):
+    """
+    Follow the redirect of a TikTok short share link to the url of the video.
+    :param url: short link
+    :return: the url of the video, or the short link itself if it couldn't be resolved
+    """
+    if url not in _resolved_short_urls:
+        try:
+            response = session.head(url, allow_redirects=True, timeout=timeout)
+            _resolved_short_urls[url] = response.url
+        except requests.RequestException as e:
+            print(f"!! Couldn't resolve the TikTok short link {url}: {e}")
+            return url
+
+    return _resolved_short_urls[url]
+
+
+def canonical_source_id(url):
+    """
+    Get the id identifying the source independently of how its url is spelled,
+    e.g. youtube:<video id>, tiktok:<video id> or gdrive:<file id>. Other urls are normalized.
+    TikTok short share links are resolved to the video they redirect to first.
+    :param url:
+    :return:
+    """
+    url = str(url)
+
+    if is_youtube_url(url):
+        match = re.search(r"(?:v=|/)([0-9A-Za-z_-]{11})", url)
+        if match is not None:
+            return f"youtube:{match.group(1)}"
+
+    if is_tiktok_url(url):
+        if TIKTOK_SHORT_URL.search(url) is not None:
+            url = resolve_tiktok_short_url(url)
+        match = re.search(r"/video/(\d+)", url)
+        if match is not None:
+            return f"tiktok:{match.group(1)}"
+
+    if is_google_drive_url(url):
+        file_id = google_drive_file_id(url)
+        if file_id is not None:
+            return f"gdrive:{file_id}"
+
+    return normalize_source_url(url)
+
+
+class SourceMetadata(object):
+    """
+    Lazily loaded, cached metadata of a YouTube, TikTok or Google Drive source.
+    Other sources have no metadata (every value is None).
+    """
+
+    def __init__(self, url, ttl=None):
+        """
+        :param url: url of the source
+        :param ttl: seconds the stored metadata is used for before it's fetched again, defaults to SOURCE_METADATA_TTL
+        """
+        from bot.webapp.config import Config
+
+        self.url = url
+        self.source_id = canonical_source_id(url)
+        self.ttl = ttl if ttl is not None else Config.SOURCE_METADATA_TTL
+        self._youtube: YouTube = None
+        self._tiktok: TikTokDownloader = None
+        self._values: dict = None
+
+    @property
+    def youtube(self):
+        """
+        pytube YouTube object of the source, None if it isn't a youtube video.
+        """
+        if self._youtube is None and is_youtube_url(self.url):
+            self._youtube = YouTube(self.url, on_progress_callback=on_progress)
+        return self._youtube
+
+    @property
+    def tiktok(self):
+        """
+        TikTokDownloader of the source, None if it isn't a tiktok video.
+        """
+        if self._tiktok is None and is_tiktok_url(self.url):
+            self._tiktok = TikTokDownloader(self.url)
+        return self._tiktok
+
+    def fetch(self):
+        """
+        Fetch the metadata from the source itself.
+        :return: dict of the metadata fields, None if the source has no metadata.
+        """
+        if self.youtube is not None:
+            return {
+                'title': self.youtube.title,
+                'description': self.youtube.description,
+                'duration': self.youtube.length,
+                'keywords': list(self.youtube.keywords),
+                'thumbnail_url': self.youtube.thumbnail_url,
+            }
+
+        if self.tiktok is not None:
+            return {
+                'title': self.tiktok.title,
+                'description': self.tiktok.title,
+                'duration': None,
+                'keywords': list(self.tiktok.hashtags),
+                'thumbnail_url': self.tiktok.thumbnail_url,
+            }
+
+        if is_google_drive_url(self.url) and google_drive_download_url(self.url) is not None:
+            # Only the headers are read, for the name of the file.
+            download_url = google_drive_download_url(self.url)
+            with session.get(download_url, stream=True, timeout=30) as response:
+                if response.status_code != 200 or not is_attachment(response):
+                    return None
+                filename = get_response_filename(response, download_url)
+            return {
+                'title': os.path.splitext(filename)[0],
+                'description': None,
+                'duration': None,
+                'keywords': [],
+                'thumbnail_url': None,
+            }
+
+        return None
+
+    def load(self):
+        """
+        Get the metadata: memoized, else stored (if it hasn't expired), else fetched from the source & stored.
+        :return: dict of the metadata fields (all None if the source has no metadata)
+        """
+        if self._values is not None:
+            return self._values
+
+        record = CachedSourceMetadata.query.filter_by(source_id=self.source_id).first()
+        if record is not None and not record.is_expired(self.ttl):
+            self._values = {field: getattr(record, field) for field in METADATA_FIELDS}
+            return self._values
+
+        values = self.fetch()
+        if values is None:
+            self._values = {field: None for field in METADATA_FIELDS}
+            return self._values
+
+        if record is None:
+            record = CachedSourceMetadata(source_id=self.source_id, url=self.url, **values)
+        else:
+            for field, value in values.items():
+                setattr(record, field, value)
+            record.url = self.url
+            record.fetched_at = datetime.datetime.utcnow()
+        record.save(commit=True)
+
+        self._values = values
+        return self._values
+
+    def invalidate(self):
+        """
+        Forget the memoized & stored metadata, so it's fetched from the source the next time it's needed.
+        """
+        self._values = None
+        record = CachedSourceMetadata.query.filter_by(source_id=self.source_id).first()
+        if record is not None:
+            record.delete(commit=True)
+
+    @property
+    def title(self):
+        return self.load()['title']
+
+    @property
+    def description(self):
+        return self.load()['description']
+
+    @property
+    def duration(self):
+        """
+        Duration (seconds) reported by the source.
+        """
+        return self.load()['duration']
+
+    @property
+    def keywords(self):
+        return self.load()['keywords']
+
+    @property
+    def thumbnail_url(self):
+        return self.load()['thumbnail_url']
+
+
+def get_source_metadata(url):
+    """
+    Get the (memoized) metadata of the source.
+    :param url: url of the source
+    :return: SourceMetadata
+    """
+    source_id = canonical_source_id(url)
+    if source_id not in _source_metadata:
+        _source_metadata[source_id] = SourceMetadata(url)
+    return _source_metadata[source_id]
+
+
+def invalidate_source_metadata(url):
+    """
+    Forget the cached metadata of the source.
+    :param url: url of the source
+    """
+    get_source_metadata(url).invalidate()
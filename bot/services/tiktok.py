@@ -2,6 +2,8 @@ import os
 
 import requests
 
+from bot.services.downloader import Downloader, print_progress
+
 API_BASE_URL = "https://api.douyin.wtf/api?url="
 
 
@@ -10,8 +12,16 @@ class TikTokDownloader(object):
         self.tiktok_url = tiktok_url
         self.output_filename = output_filename
         self.watermark = False
+        self._data = None
 
-        self.data = requests.get(f"{API_BASE_URL}{self.tiktok_url}").json()
+    @property
+    def data(self):
+        """
+        Video info from the API, requested the first time it's needed.
+        """
+        if self._data is None:
+            self._data = requests.get(f"{API_BASE_URL}{self.tiktok_url}").json()
+        return self._data
 
     @property
     def hashtags(self):
@@ -21,9 +31,9 @@ class TikTokDownloader(object):
         if os.path.exists(self.output_filename):
             os.remove(self.output_filename)
             print("~ Removed old download {}".format(self.output_filename))
-        with open(f"{self.output_filename}", "wb") as f:
-            f.write(requests.get(
-                self.data["nwm_video_url"] if self.watermark is False else self.data['wm_video_url']).content)
+        Downloader(progress_callback=print_progress).download(
+            self.data["nwm_video_url"] if self.watermark is False else self.data['wm_video_url'],
+            self.output_filename)
 
     @property
     def title(self):
@@ -0,0 +1,375 @@
+"""
+Uploader service module.
+
+Uploads files to the media url handed out by the posting API. Large files are sent as a multipart
+upload (the S3 protocol: start an upload, PUT its parts, complete it with the list of parts) when the
+storage backend supports it: the parts are sent concurrently, a failed part is retried on its own and an
+interrupted upload resumes from the parts the backend already has. Backends that refuse to start a
+multipart upload, like a url presigned for a single PUT, get the file streamed from disk in one PUT
+(never loaded into memory), retried with backoff by starting the PUT over.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+
+from bot.services.downloader import session
+
+# Bytes read from disk (& reported to the progress callback) at a time.
+CHUNK_SIZE = 1024 * 1024
+
+# Files this large (or larger) are sent as a multipart upload when the backend supports it.
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+
+# Size of every part of a multipart upload but the last (S3 needs at least 5MB).
+PART_SIZE = 8 * 1024 * 1024
+
+# Parts sent at the same time.
+PART_WORKERS = 4
+
+# Status codes worth retrying, anything else is final.
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class UploadError(Exception):
+    """
+    Raised when an upload fails (rejected by the server or out of retries).
+    """
+    pass
+
+
+class MultipartUnsupported(UploadError):
+    """
+    Raised when the backend refuses to start a multipart upload.
+    """
+    pass
+
+
+def print_upload_progress(uploaded, total):
+    """
+    Default progress callback, prints the progress of the upload on a single line.
+    """
+    print(f"\r~ Uploaded {uploaded / 1024 / 1024:.1f} / {total / 1024 / 1024:.1f} MB "
+          f"({uploaded / total * 100 if total else 100:.0f}%)", end="" if uploaded < total else "\n")
+
+
+def with_query(url, **params):
+    """
+    Add query parameters to the url, keeping the ones it has (e.g. its signature).
+    A parameter with a value of None is added without one, e.g. ?uploads
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query = urlencode(query + [(key, value) for key, value in params.items() if value is not None])
+    for key, value in params.items():
+        if value is None:
+            query = f"{query}&{key}" if query else key
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
+
+
+def xml_values(text, tag):
+    """
+    Values of every element with the tag in an S3 xml response, whatever its namespace.
+    Empty when the response isn't xml.
+    """
+    return [element.text for element in xml_elements(text, tag)]
+
+
+def xml_elements(text, tag):
+    """
+    Every element with the tag in an S3 xml response, whatever its namespace.
+    """
+    try:
+        root = ElementTree.fromstring(text)
+    except ElementTree.ParseError:
+        return []
+    return [element for element in root.iter() if element.tag.split('}')[-1] == tag]
+
+
+class UploadProgress(object):
+    """
+    Bytes uploaded so far, shared by the parts sent at the same time.
+    The callback is called every `interval` bytes (& once the upload is done), not on every read of the body.
+    """
+
+    def __init__(self, total, callback=None, interval=CHUNK_SIZE):
+        self.total = total
+        self.uploaded = 0
+        self.reported = 0
+        self.callback = callback
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.uploaded += size
+            if self.callback is not None and size != 0 and \
+                    (abs(self.uploaded - self.reported) >= self.interval or self.uploaded >= self.total):
+                self.reported = self.uploaded
+                self.callback(self.uploaded, self.total)
+
+
+class UploadBody(object):
+    """
+    File-like request body reading (a range of) the file in chunks & reporting the progress.
+    Has a length, so it's sent with a Content-Length instead of chunked transfer encoding.
+    """
+
+    def __init__(self, path, progress: UploadProgress, chunk_size=CHUNK_SIZE, offset=0, length=None):
+        """
+        :param progress: progress the bytes read are added to, shared by the parts of a multipart upload
+        :param offset: first byte of the file sent
+        :param length: bytes sent, the rest of the file by default
+        """
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.total = length if length is not None else os.path.getsize(path) - offset
+        self.sent = 0
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def __len__(self):
+        return self.total
+
+    def read(self, size=-1):
+        size = self.chunk_size if size is None or size < 0 else min(size, self.chunk_size)
+        data = self.file.read(min(size, self.total - self.sent))
+        self.sent += len(data)
+        self.progress.add(len(data))
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class Uploader(object):
+    """
+    Multipart (or single streamed PUT) uploads, retried with backoff.
+    """
+
+    def __init__(self, retries=3, timeout=60, chunk_size=CHUNK_SIZE, progress_callback=None,
+                 multipart_threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE, workers=PART_WORKERS):
+        """
+        :param retries: how many times a failed upload (or part) is retried before giving up
+        :param timeout: connect / read timeout in seconds
+        :param chunk_size: bytes read from disk at a time
+        :param progress_callback: called with (bytes uploaded, total bytes) as the file is sent
+        :param multipart_threshold: files this large are sent as a multipart upload, None to always use a single PUT
+        :param part_size: bytes per part of a multipart upload
+        :param workers: parts sent at the same time
+        """
+        self.retries = retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.workers = workers
+
+    def upload(self, url, path, content_type):
+        """
+        Upload the file to the media url, as a multipart upload when it's large & the backend supports it.
+        :param url: presigned upload url
+        :param path: local file
+        :param content_type: mime type the url was signed for
+        :return: path
+        """
+        if self.multipart_threshold is not None and os.path.getsize(path) >= self.multipart_threshold:
+            try:
+                return self.upload_multipart(url, path, content_type)
+            except MultipartUnsupported as e:
+                print(f"~ {e}, uploading {path} in a single request")
+
+        return self.upload_single(url, path, content_type)
+
+    def upload_single(self, url, path, content_type):
+        """
+        Stream the file to the url in a single PUT, started over when it fails.
+        :return: path
+        """
+        attempt = 0
+        while True:
+            body = UploadBody(path, UploadProgress(os.path.getsize(path), self.progress_callback),
+                              chunk_size=self.chunk_size)
+            try:
+                response = session.put(url, data=body, timeout=self.timeout,
+                                       headers={'Content-Type': content_type, 'Content-Length': str(len(body))})
+                if response.status_code in (200, 201):
+                    return path
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise UploadError(f"Upload of {path} failed with status code {response.status_code}")
+                error = f"status code {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                body.close()
+
+            attempt = self._backoff(attempt, f"Upload of {path}", error)
+
+    def upload_multipart(self, url, path, content_type):
+        """
+        Send the file as a multipart upload, its parts concurrently. The upload id is saved next to the file
+        until the upload completes, so an interrupted upload resumes with the parts the backend is missing.
+        :return: path
+        :raises MultipartUnsupported: if the backend refuses to start a multipart upload
+        """
+        size = os.path.getsize(path)
+        state_path = f"{path}.{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.upload"
+
+        upload_id, parts = None, {}
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            if state.get('size') == size and state.get('part_size') == self.part_size:
+                upload_id = state['upload_id']
+                parts = self.list_parts(url, upload_id)
+
+        if upload_id is None or parts is None:
+            upload_id, parts = self.start_multipart(url, path, content_type), {}
+            with open(state_path, 'w') as f:
+                json.dump({'upload_id': upload_id, 'size': size, 'part_size': self.part_size}, f)
+        elif len(parts) > 0:
+            print(f"~ Resuming the upload of {path}, {len(parts)} parts were already uploaded")
+
+        ranges = {number: (offset, min(self.part_size, size - offset))
+                  for number, offset in enumerate(range(0, size, self.part_size), start=1)}
+        progress = UploadProgress(size, self.progress_callback)
+        progress.add(sum(ranges[number][1] for number in parts if number in ranges))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload") as executor:
+            futures = {number: executor.submit(self.upload_part, url, upload_id, path, number, offset, length,
+                                               progress)
+                       for number, (offset, length) in ranges.items() if number not in parts}
+            # Waits for every part, the ones that succeeded are kept for the next attempt.
+            errors = []
+            for number, future in futures.items():
+                try:
+                    parts[number] = future.result()
+                except UploadError as e:
+                    errors.append(e)
+
+        if len(errors) > 0:
+            raise UploadError(f"Upload of {path} failed, {len(errors)} parts weren't uploaded "
+                              f"(run it again to resume): {errors[0]}")
+
+        self.complete_multipart(url, upload_id, path, [(number, parts[number]) for number in sorted(ranges)])
+        os.remove(state_path)
+        return path
+
+    def start_multipart(self, url, path, content_type):
+        """
+        :return: the id of the new multipart upload
+        :raises MultipartUnsupported: if the backend refuses to start one
+        """
+        try:
+            response = session.post(with_query(url, uploads=None), timeout=self.timeout,
+                                    headers={'Content-Type': content_type})
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise MultipartUnsupported(f"Couldn't start a multipart upload of {path}: {e}")
+
+        upload_ids = xml_values(response.text, 'UploadId') if response.status_code == 200 else []
+        if len(upload_ids) == 0:
+            raise MultipartUnsupported(f"The backend refused a multipart upload of {path} "
+                                       f"(status code {response.status_code})")
+        return upload_ids[0]
+
+    def list_parts(self, url, upload_id):
+        """
+        :return: {part number: etag} of the parts the backend has, None if it doesn't know the upload (anymore)
+        """
+        try:
+            response = session.get(with_query(url, uploadId=upload_id), timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            return None
+        if response.status_code != 200:
+            return None
+
+        parts = {}
+        for part in xml_elements(response.text, 'Part'):
+            values = {child.tag.split('}')[-1]: child.text for child in part}
+            parts[int(values['PartNumber'])] = values['ETag']
+        return parts
+
+    def upload_part(self, url, upload_id, path, number, offset, length, progress: UploadProgress):
+        """
+        PUT a part, retried on its own with backoff.
+        :return: the etag of the part
+        """
+        attempt = 0
+        while True:
+            body = UploadBody(path, progress, chunk_size=self.chunk_size, offset=offset, length=length)
+            try:
+                response = session.put(with_query(url, partNumber=str(number), uploadId=upload_id), data=body,
+                                       timeout=self.timeout, headers={'Content-Length': str(length)})
+                if response.status_code in (200, 201) and response.headers.get('ETag') is not None:
+                    return response.headers['ETag']
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise UploadError(f"Part {number} failed with status code {response.status_code}")
+                error = f"status code {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                body.close()
+
+            # The bytes of the failed attempt are sent again.
+            progress.add(-body.sent)
+            attempt = self._backoff(attempt, f"Part {number} of {path}", error)
+
+    def complete_multipart(self, url, upload_id, path, parts):
+        """
+        Assemble the uploaded parts into the file, retried with backoff.
+        :param parts: list of (part number, etag), in order
+        """
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts) + \
+               "</CompleteMultipartUpload>"
+
+        attempt = 0
+        while True:
+            try:
+                response = session.post(with_query(url, uploadId=upload_id), data=body.encode('utf-8'),
+                                        timeout=self.timeout, headers={'Content-Type': 'application/xml'})
+                # S3 reports some failures with a 200 & an error document.
+                if response.status_code == 200 and "<Error>" not in response.text:
+                    return
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise UploadError(f"Completing the upload of {path} failed with status code "
+                                      f"{response.status_code}")
+                error = f"status code {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            attempt = self._backoff(attempt, f"Completing the upload of {path}", error)
+
+    def _backoff(self, attempt, what, error):
+        """
+        Wait before the next attempt, raising once out of retries.
+        :return: the number of the next attempt
+        """
+        attempt += 1
+        if attempt > self.retries:
+            raise UploadError(f"{what} failed after {self.retries} retries: {error}")
+
+        print(f"\n~ {what} failed ({error}), retrying ({attempt}/{self.retries})")
+        time.sleep(min(2 ** attempt, 30))
+        return attempt
+
+
+def upload_file(url, path, content_type, progress=True):
+    """
+    Upload a file with the default Uploader settings.
+    :return: True if the upload succeeded
+    """
+    try:
+        Uploader(progress_callback=print_upload_progress if progress else None).upload(url, path, content_type)
+    except UploadError as e:
+        print(f"!! {e}")
+        return False
+
+    return True
@@ -0,0 +1,101 @@
+"""
+Workspace service module.
+
+Every run gets its own scratch directory for downloads, intermediate & output files, so several
+jobs can run side by side on one host without overwriting each other's files. The workspace is
+created on tmpfs (/dev/shm) when there's enough room on it & the run doesn't download its source
+into it, and is removed as a whole when the run is done.
+"""
+import os
+import shutil
+import tempfile
+
+TMPFS_PATH = "/dev/shm"
+
+# Name prefix of the workspace directories.
+WORKSPACE_PREFIX = "vidbot-"
+
+
+def get_workspace_root(downloads=False):
+    """
+    Get the directory workspaces are created in: WORKSPACE_DIR when configured, otherwise tmpfs
+    if it's available & has at least WORKSPACE_TMPFS_MIN_FREE bytes free, otherwise the system temp dir.
+    :param downloads: whether the run downloads its source into the workspace. Downloads can be several GB
+                      & tmpfs is backed by memory, so those workspaces are always created on disk.
+    :return:
+    """
+    from bot.webapp.config import Config
+
+    if Config.WORKSPACE_DIR is not None:
+        root = os.path.expanduser(Config.WORKSPACE_DIR)
+        os.makedirs(root, exist_ok=True)
+        return root
+
+    if not downloads and os.path.isdir(TMPFS_PATH) and os.access(TMPFS_PATH, os.W_OK):
+        if shutil.disk_usage(TMPFS_PATH).free >= Config.WORKSPACE_TMPFS_MIN_FREE:
+            return TMPFS_PATH
+
+    return tempfile.gettempdir()
+
+
+def is_workspace_path(path):
+    """
+    Check whether the path is inside a workspace, wherever it was created.
+    """
+    from bot.webapp.config import Config
+
+    roots = [TMPFS_PATH, tempfile.gettempdir()]
+    if Config.WORKSPACE_DIR is not None:
+        roots.append(os.path.expanduser(Config.WORKSPACE_DIR))
+
+    path = os.path.abspath(path)
+    return any(path.startswith(os.path.join(os.path.abspath(root), WORKSPACE_PREFIX)) for root in roots)
+
+
+class Workspace(object):
+    """
+    Private scratch directory of a single run.
+    """
+
+    def __init__(self, root=None, prefix=WORKSPACE_PREFIX, downloads=False):
+        """
+        :param root: directory the workspace is created in, see get_workspace_root for the default.
+        :param prefix: prefix of the workspace directory name
+        :param downloads: whether the source is downloaded into the workspace, see get_workspace_root
+        """
+        self.root = root if root is not None else get_workspace_root(downloads=downloads)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+
+    def __repr__(self):
+        return f"Workspace({self.path})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    @property
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def file(self, filename):
+        """
+        Get the path of a file inside the workspace.
+        :param filename: name of the file, any directories in it are dropped.
+        :return:
+        """
+        return os.path.join(self.path, os.path.basename(str(filename)))
+
+    def cleanup(self):
+        """
+        Remove the workspace & everything in it.
+        The directory is renamed first, so it disappears in a single step even if removing its files is interrupted.
+        :return:
+        """
+        if not self.exists:
+            return
+
+        trash_path = f"{self.path}.trash"
+        os.rename(self.path, trash_path)
+        shutil.rmtree(trash_path, ignore_errors=True)
@@ -1,16 +1,20 @@
 # function to print all the hashtags in a text
 import mimetypes
 import os
-import shutil
 import subprocess as sp
 from itertools import islice
 
 import maya
-import requests
 from pytube import YouTube
 
+from bot.webapp.database import db
 from bot.webapp.models import VideoClip, ImageDb, MediaUpload, SocialMediaPost, PublishedSocialMediaPost
+from bot.services.ayrshare import get_client
+from bot.services.downloader import Downloader, DownloadError
+from bot.services.ffprobe import get_keyframe_index, has_audio, get_stream
+from bot.services.source_cache import file_sha256
 from bot.services.tiktok import TikTokDownloader
+from bot.services.uploader import upload_file
 
 from flask import current_app, make_response
 
@@ -28,13 +32,14 @@ def get_maya_time(time):
 
 
 def compile_keywords(post_description: str = None, youtube_video: YouTube = None, tiktok_video: TikTokDownloader = None,
-                     character_limit=400):
+                     character_limit=400, source_keywords: list = None):
     """
     Compile the keywords (hashtags) for this vid. Uses the provided description, and any online source if available.
+    :param source_keywords: keywords of the online source, when they're already known (instead of the video objects)
     :return:
     """
 
-    if post_description is None and youtube_video is None and tiktok_video is None:
+    if post_description is None and youtube_video is None and tiktok_video is None and source_keywords is None:
         return None
 
     keywords = []
@@ -64,6 +69,13 @@ def compile_keywords(post_description: str = None, youtube_video: YouTube = None
             keywords.append(keyword)
             keyword_length += len(keyword)
 
+    for keyword in source_keywords or []:
+        if keyword_length >= character_limit or len(keyword) + keyword_length >= character_limit:
+            break
+
+        keywords.append(keyword.replace("#", ""))
+        keyword_length += len(keyword)
+
     keywords = list(set(keywords))
     return keywords
 
@@ -98,8 +110,7 @@ def get_post_history(last_days=30, last_records=None,status=None):
     Gets the post history for the user (via ayrshare).
     :return:
     """
-    resp = requests.get('https:/app.ayrshare.com/api/history',
-                        headers={'Authorization': f'Bearer {current_app.config.get("AYRSHARE_API_KEY")}'}).text
+    return get_client(current_app.config.get("AYRSHARE_API_KEY")).history().json()
 
 
 def post_to_social(platforms: list, social_media_post: SocialMediaPost, thumbnail=None, tags=None,
@@ -163,9 +174,7 @@ def post_to_social(platforms: list, social_media_post: SocialMediaPost, thumbnai
     if date_time is not None:
         post_data["scheduleDate"] = date_time.iso8601()
 
-    resp = requests.post("https://app.ayrshare.com/api/post",
-                         headers={'Authorization': f'Bearer {current_app.config.get("AYRSHARE_API_KEY")}'},
-                         json=post_data)
+    resp = get_client(current_app.config.get("AYRSHARE_API_KEY")).create_post(post_data)
 
     status_code = resp.status_code
     response_text = resp.text
@@ -181,6 +190,7 @@ def post_to_social(platforms: list, social_media_post: SocialMediaPost, thumbnai
         # todo implement check for data about post urls from ayrshare api when this is retrieved on UI somewhere
         return True, api_id, status_code, f"Successfully scheduled for {date_time.slang_time()} to {', '.join(platforms)}"
     elif resp['status'] == 'success':
+        # Where the post was published is written in one transaction.
         post_ids = resp['postIds']
         for post in post_ids:
             published_data = PublishedSocialMediaPost(platform=post['platform'],
@@ -188,7 +198,7 @@ def post_to_social(platforms: list, social_media_post: SocialMediaPost, thumbnai
                                                       post_url=post['postUrl'])
 
             social_media_post.published_data.append(published_data)
-            published_data.save(commit=True)
+        db.session.commit()
 
         return True, api_id, status_code, f"Successfully posted to {', '.join(platforms)}"
 
@@ -216,11 +226,15 @@ def upload_file_to_cloud(local_file_path, video_clip: VideoClip = None, image: I
     if content_type is None:
         raise Exception(f"Could not determine content type for file")
 
+    # The same bytes uploaded before (e.g. a reposted clip or meme) are reused instead of uploaded again.
+    content_hash = file_sha256(local_file_path)
+    reusable_upload = MediaUpload.find_by_content_hash(content_hash)
+    if reusable_upload is not None:
+        print(f"~ Reusing the upload of the same content: {reusable_upload.access_url}")
+        return reusable_upload.reuse(clip=video_clip if image is None else None, image=image)
+
     # retrieve the information
-    req = requests.get("https://app.ayrshare.com/api/media/uploadUrl",
-                       headers={'Authorization': f'Bearer {current_app.config.get("AYRSHARE_API_KEY")}'},
-                       params={'contentType': content_type,
-                               'fileName': f"{local_file_path}"})
+    req = get_client(current_app.config.get("AYRSHARE_API_KEY")).media_upload_url(content_type, f"{local_file_path}")
 
     upload_request_response = req.json()
 
@@ -229,23 +243,21 @@ def upload_file_to_cloud(local_file_path, video_clip: VideoClip = None, image: I
     if image is not None:
         media_upload = MediaUpload(access_url=upload_request_response['accessUrl'],
                                    content_type=upload_request_response['contentType'],
-                                   upload_url=upload_request_response['uploadUrl'], image=image)
+                                   upload_url=upload_request_response['uploadUrl'], image=image,
+                                   content_hash=content_hash)
     else:
         media_upload = MediaUpload(access_url=upload_request_response['accessUrl'],
                                    content_type=upload_request_response['contentType'],
-                                   upload_url=upload_request_response['uploadUrl'], clip=video_clip)
+                                   upload_url=upload_request_response['uploadUrl'], clip=video_clip,
+                                   content_hash=content_hash)
     media_upload.save(commit=True)
 
     # upload the video
-
-    req = requests.put(upload_request_response['uploadUrl'],
-                       headers={'Content-Type': upload_request_response['contentType']},
-                       data=open(f"{local_file_path}", 'rb'))
-
-    if req.status_code == 200:
+    if upload_file(upload_request_response['uploadUrl'], local_file_path, upload_request_response['contentType']):
+        media_upload.uploaded = True
+        media_upload.save(commit=True)
         return media_upload
 
-    print(f"Upload failed with status code {req.status_code}")
     return None
 
 
@@ -254,12 +266,10 @@ def download_image(image_url, output_filename):
     Downloads the image from the URL
     :return:
     """
-    r = requests.get(image_url, stream=True)
-    if r.status_code == 200:
-        with open(output_filename, 'wb') as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
-            return output_filename
+    try:
+        return Downloader().download(image_url, output_filename)
+    except DownloadError as e:
+        print(f"!! {e}")
 
     return None
 
@@ -286,68 +296,444 @@ def extract_hashtags(text):
     return hashtag_list
 
 
+# Conversion modes of ffmpeg_convert_to_mp4, cheapest first.
+MP4_REMUX = "remux"
+MP4_AUDIO_TRANSCODE = "audio"
+MP4_TRANSCODE = "transcode"
+
+# Video codecs / pixel formats that play everywhere once they're in an mp4 container.
+MP4_VIDEO_CODECS = ('h264',)
+MP4_PIXEL_FORMATS = ('yuv420p', 'yuvj420p')
+MP4_AUDIO_CODECS = ('aac',)
+
+
+def get_mp4_conversion_mode(filename):
+    """
+    Choose how to convert the file to mp4 from the codecs of its streams (probes are cached per file):
+    H.264 & AAC are remuxed, H.264 with other audio only has its audio transcoded, anything else is fully transcoded.
+    :param filename:
+    :return: MP4_REMUX, MP4_AUDIO_TRANSCODE or MP4_TRANSCODE
+    """
+    video_stream = get_stream(filename, 'video')
+    if video_stream is None:
+        return MP4_TRANSCODE
+
+    if video_stream.get('codec_name') not in MP4_VIDEO_CODECS or \
+            video_stream.get('pix_fmt') not in MP4_PIXEL_FORMATS:
+        return MP4_TRANSCODE
+
+    audio_stream = get_stream(filename, 'audio')
+    if audio_stream is not None and audio_stream.get('codec_name') not in MP4_AUDIO_CODECS:
+        return MP4_AUDIO_TRANSCODE
+
+    return MP4_REMUX
+
+
 def ffmpeg_convert_to_mp4(filename, targetname=None):
+    """
+    Convert the file to an mp4 (with faststart), doing as little work as the source's codecs allow.
+    See get_mp4_conversion_mode.
+    :param filename:
+    :param targetname:
+    :return: the conversion mode used
+    """
+    mode = get_mp4_conversion_mode(filename)
+
+    if mode == MP4_REMUX:
+        codec_args = ['-c:v', 'copy', '-c:a', 'copy']
+    elif mode == MP4_AUDIO_TRANSCODE:
+        codec_args = ['-c:v', 'copy', '-c:a', 'aac']
+    else:
+        codec_args = ['-c:v', 'libx264', '-c:a', 'aac', '-vf', 'format=yuv420p']
+
     command = [
         'ffmpeg',
         '-i', filename,
-        '-c:v', 'libx264',
-        '-c:a', 'aac',
-        '-vf', 'format=yuv420p',
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        *codec_args,
         '-movflags', '+faststart',
         '-y', targetname
     ]
 
-    # command = ['ffmpeg',
-    #            '-y',  # approve output file overwite
-    #            '-i', f"clip_{self.output_filename}",
-    #            '-i', f"tempaudio.m4a",
-    #            '-c:v', 'copy',
-    #            '-c:a', 'aac',  # to convert mp3 to aac
-    #            '-shortest',
-    #            f"{self.output_filename}"]
-
+    print(f"~ Converting {filename} to mp4 ({mode})")
     process = sp.Popen(command, stdout=sp.PIPE, stderr=sp.PIPE)
-    process.wait()
+    process.communicate()
+
+    return mode
+
+
+# loudnorm resamples to 192kHz, normalized audio is encoded at this rate instead.
+NORMALIZED_SAMPLE_RATE = 48000
+
 
+# x264 profile names of the profiles ffprobe reports for H.264 streams.
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+}
 
-def ffmpeg_extract_subclip(filename, t1, t2, targetname=None):
+
+def splice_encoder_args(filename):
+    """
+    Encoder arguments for a head segment that can be concat copied onto a stream copy of ``filename``:
+    the same codecs, profile, level, pixel format, resolution & audio format as the source's streams.
+    :return: list of ffmpeg arguments, or None if the source can't be spliced (not H.264 / AAC).
+    """
+    video_stream = get_stream(filename, 'video')
+    if video_stream is None or video_stream.get('codec_name') not in MP4_VIDEO_CODECS or \
+            video_stream.get('profile') not in X264_PROFILES:
+        return None
+
+    args = ['-c:v', 'libx264', '-profile:v', X264_PROFILES[video_stream['profile']],
+            '-pix_fmt', video_stream.get('pix_fmt', 'yuv420p')]
+    if video_stream.get('level', 0) > 0:
+        args += ['-level:v', "%0.1f" % (video_stream['level'] / 10)]
+    if video_stream.get('width') and video_stream.get('height'):
+        args += ['-s', f"{video_stream['width']}x{video_stream['height']}"]
+    if video_stream.get('r_frame_rate') not in (None, '0/0'):
+        args += ['-r', video_stream['r_frame_rate']]
+
+    audio_stream = get_stream(filename, 'audio')
+    if audio_stream is not None:
+        if audio_stream.get('codec_name') not in MP4_AUDIO_CODECS:
+            return None
+        args += ['-c:a', 'aac']
+        if audio_stream.get('sample_rate'):
+            args += ['-ar', str(audio_stream['sample_rate'])]
+        if audio_stream.get('channels'):
+            args += ['-ac', str(audio_stream['channels'])]
+
+    return args
+
+
+def ffmpeg_extract_subclip(filename, t1, t2, targetname=None, accurate=False):
     """ Makes a new video file playing video file ``filename`` between
-        the times ``t1`` and ``t2``. """
+        the times ``t1`` and ``t2``.
+
+        The source is input-seeked (``-ss`` before ``-i``) and stream copied, so nothing is decoded.
+        Stream copies can only start on a keyframe, so by default ``t1`` is snapped to the nearest
+        keyframe of the source. With ``accurate`` the short GOP between ``t1`` and the next keyframe
+        is re-encoded with the source's codec parameters instead & joined to the stream copied remainder.
+        Sources that can't be joined that way (not H.264 / AAC) are fully re-encoded.
+        The intermediate files are written next to ``targetname``.
+
+        :return: the start time (seconds) the clip actually begins at, None if ffmpeg failed.
+        """
     name, ext = os.path.splitext(filename)
     if not targetname:
         T1, T2 = [int(1000 * t) for t in [t1, t2]]
-        targetname = "%sSUB%d_%d.%s" % (name, T1, T2, ext)
+        targetname = "%sSUB%d_%d%s" % (name, T1, T2, ext)
+
+    keyframes = get_keyframe_index(filename)
+    duration = t2 - t1
+
+    def produced(success, start):
+        if not success or not os.path.exists(targetname) or os.path.getsize(targetname) == 0:
+            print(f"!! ffmpeg failed cutting {filename} [{t1}s - {t2}s] to {targetname}")
+            return None
+        return start
+
+    if len(keyframes) == 0:
+        print(f"~ No keyframes found for {filename}, cutting @ {t1}s without snapping.")
+        return produced(_ffmpeg_stream_copy(filename, t1, duration, targetname), t1)
+
+    if not accurate or keyframes.is_keyframe(t1):
+        start = keyframes.nearest(t1)
+        return produced(_ffmpeg_stream_copy(filename, start, duration, targetname), start)
+
+    next_keyframe = keyframes.next(t1)
+    encoder_args = splice_encoder_args(filename)
+    if next_keyframe is None or next_keyframe >= t2 or encoder_args is None:
+        # The whole clip sits inside a single GOP (re-encoding all of it is just as cheap),
+        # or the source's codecs can't be spliced onto a stream copy.
+        return produced(_ffmpeg_encode_segment(filename, t1, duration, targetname), t1)
 
-    # Convert & Subclip.
+    target_name = os.path.splitext(targetname)[0]
+    head = f"{target_name}_head.ts"
+    tail = f"{target_name}_tail.ts"
+    concat_list = f"{target_name}_concat.txt"
+
+    try:
+        head_command = [
+            'ffmpeg',
+            '-ss', "%0.3f" % t1,
+            '-i', filename,
+            '-t', "%0.3f" % (next_keyframe - t1),
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            *encoder_args,
+            '-f', 'mpegts',
+            '-y', head
+        ]
+        if sp.run(head_command, stdout=sp.PIPE, stderr=sp.PIPE).returncode != 0 or \
+                not _ffmpeg_stream_copy(filename, next_keyframe, t2 - next_keyframe, tail, container="mpegts"):
+            return produced(False, t1)
+
+        with open(concat_list, 'w') as f:
+            for part in (head, tail):
+                f.write(f"file '{os.path.abspath(part)}'\n")
+
+        command = [
+            'ffmpeg',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', concat_list,
+            '-c', 'copy',
+            '-movflags', '+faststart',
+            '-y', targetname
+        ]
+        return produced(sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE).returncode == 0, t1)
+    finally:
+        for part in (head, tail, concat_list):
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def ffmpeg_encode_subclip(filename, t1, t2, targetname, threads=None, audio_filter=None):
+    """ Encodes the part of ``filename`` between the times ``t1`` and ``t2`` into ``targetname``
+        in a single libx264 / aac pass. Video & audio are cut & muxed by the same ffmpeg run,
+        so there are no intermediate files to write or remux.
+
+        :param threads: limit the threads ffmpeg uses, defaults to all cores.
+        :param audio_filter: ffmpeg audio filter applied while encoding, e.g. loudness normalization.
+        :return: True if ffmpeg succeeded. """
+    return _ffmpeg_encode_segment(filename, t1, t2 - t1, targetname, threads=threads, audio_filter=audio_filter)
+
+
+def ffmpeg_merge_streams(video_filename, audio_filename, targetname):
+    """ Muxes the video of ``video_filename`` & the audio of ``audio_filename`` into ``targetname``
+        with stream copy, e.g. for separately downloaded adaptive (DASH) streams.
+
+        :return: True if ffmpeg succeeded. """
     command = [
         'ffmpeg',
+        '-i', video_filename,
+        '-i', audio_filename,
+        '-map', '0:v:0',
+        '-map', '1:a:0',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        '-y', targetname
+    ]
+
+    return sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE).returncode == 0
+
+
+def ffmpeg_encode_preview(filename, t1, t2, targetname, height=360):
+    """ Encodes a quick, low resolution proxy of the part of ``filename`` between ``t1`` and ``t2``
+        for reviewing a clip before its full quality encode (ultrafast preset, scaled down to ``height``).
+
+        :return: True if ffmpeg succeeded. """
+    command = [
+        'ffmpeg',
+        '-ss', "%0.3f" % t1,
         '-i', filename,
-        '-c:v', 'copy',
-        '-c:a', 'copu',
+        '-t', "%0.3f" % (t2 - t1),
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c:v', 'libx264',
+        '-preset', 'ultrafast',
+        '-crf', '30',
+        '-vf', f"scale=-2:{height},format=yuv420p",
+        '-c:a', 'aac',
+        '-b:a', '64k',
         '-movflags', '+faststart',
-        '-ss', "%0.2f" % t1,
-        "-t", "%0.2f" % (t2 - t1),
         '-y', targetname
     ]
 
-    # command = ['ffmpeg',
-    #            '-y',  # approve output file overwite
-    #            '-i', f"clip_{self.output_filename}",
-    #            '-i', f"tempaudio.m4a",
-    #            '-c:v', 'copy',
-    #            '-c:a', 'aac',  # to convert mp3 to aac
-    #            '-shortest',
-    #            f"{self.output_filename}"]
+    return sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE).returncode == 0
+
+
+def ffmpeg_encode_to_fit(filename, targetname, video_bitrate, max_dimension=None, audio_bitrate=128000):
+    """ Re-encodes ``filename`` at an average video bitrate of ``video_bitrate`` (bits/s) with a two-pass
+        libx264 encode, so the output lands on the target size. The first pass only analyses the video.
+
+        :param max_dimension: scale the video down so its longest side fits in this many pixels.
+        :return: True if ffmpeg succeeded. """
+    video_filter = 'format=yuv420p'
+    if max_dimension is not None:
+        video_filter = f"scale='min({max_dimension},iw)':'min({max_dimension},ih)':force_original_aspect_ratio=decrease," \
+                       f"scale=trunc(iw/2)*2:trunc(ih/2)*2,{video_filter}"
+
+    passlogfile = f"{targetname}.passlog"
+    common = ['-c:v', 'libx264', '-b:v', str(int(video_bitrate)), '-vf', video_filter, '-passlogfile', passlogfile]
+
+    first_pass = ['ffmpeg', '-y', '-i', filename, '-map', '0:v:0', *common, '-pass', '1', '-an', '-f', 'null', os.devnull]
+    second_pass = ['ffmpeg', '-y', '-i', filename, '-map', '0:v:0', '-map', '0:a:0?', *common, '-pass', '2',
+                   '-c:a', 'aac', '-b:a', str(int(audio_bitrate)), '-movflags', '+faststart', targetname]
+
+    try:
+        if sp.run(first_pass, stdout=sp.PIPE, stderr=sp.PIPE).returncode != 0:
+            return False
+        return sp.run(second_pass, stdout=sp.PIPE, stderr=sp.PIPE).returncode == 0
+    finally:
+        for suffix in ('-0.log', '-0.log.mbtree'):
+            if os.path.exists(passlogfile + suffix):
+                os.remove(passlogfile + suffix)
+
+
+def ffmpeg_encode_subclips(filename, ranges, targetnames, audio_filters=None):
+    """ Encodes several parts of ``filename`` in one ffmpeg run; the source is decoded once and split
+        into a trim / atrim branch per range, each encoded to its own libx264 / aac output.
+
+        :param ranges: list of (t1, t2) tuples in seconds.
+        :param targetnames: output file for each range.
+        :param audio_filters: ffmpeg audio filter (or None) applied to each range, e.g. loudness normalization.
+        :return: the output of each range, None for every range when ffmpeg failed (the partial outputs are removed).
+        """
+    assert len(ranges) == len(targetnames), "Each range requires an output file."
+    if audio_filters is None:
+        audio_filters = [None] * len(ranges)
+
+    # Seek to the first range so nothing before it is decoded.
+    offset = min(t1 for t1, _ in ranges)
+    last_end = max(t2 for _, t2 in ranges)
+    audio = has_audio(filename)
+
+    filters = [f"[0:v]split={len(ranges)}" + "".join(f"[vin{i}]" for i in range(len(ranges)))]
+    if audio:
+        filters.append(f"[0:a]asplit={len(ranges)}" + "".join(f"[ain{i}]" for i in range(len(ranges))))
+
+    for i, (t1, t2) in enumerate(ranges):
+        filters.append(f"[vin{i}]trim=start={t1 - offset:0.3f}:end={t2 - offset:0.3f},"
+                       f"setpts=PTS-STARTPTS,format=yuv420p[v{i}]")
+        if audio:
+            audio_filter = f",{audio_filters[i]}" if audio_filters[i] is not None else ""
+            filters.append(f"[ain{i}]atrim=start={t1 - offset:0.3f}:end={t2 - offset:0.3f},"
+                           f"asetpts=PTS-STARTPTS{audio_filter}[a{i}]")
+
+    command = [
+        'ffmpeg',
+        '-ss', "%0.3f" % offset,
+        '-i', filename,
+        '-t', "%0.3f" % (last_end - offset),
+        '-filter_complex', ";".join(filters),
+    ]
+
+    for i, targetname in enumerate(targetnames):
+        command += ['-map', f"[v{i}]"]
+        if audio:
+            command += ['-map', f"[a{i}]", '-c:a', 'aac']
+            if audio_filters[i] is not None:
+                command += ['-ar', str(NORMALIZED_SAMPLE_RATE)]
+        command += ['-c:v', 'libx264', '-movflags', '+faststart', '-y', targetname]
+
+    if sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE).returncode != 0:
+        # A failed (or killed) run leaves truncated outputs behind, without their moov atom.
+        print(f"!! ffmpeg failed encoding {len(ranges)} clips from {filename}")
+        for targetname in targetnames:
+            if os.path.exists(targetname):
+                os.remove(targetname)
+        return [None] * len(targetnames)
+
+    return targetnames
+
+
+def ffmpeg_extract_subclips(filename, ranges, targetnames):
+    """ Stream copies several parts of ``filename``, each with its own input-seeked ffmpeg run so
+        nothing before a clip is read. Like ``ffmpeg_extract_subclip`` every start is snapped to the
+        nearest keyframe of the source, or to the next one when the nearest would overlap the previous clip.
+
+        :param ranges: list of (t1, t2) tuples in seconds, must not overlap.
+        :param targetnames: output file for each range.
+        :return: the start time (seconds) each clip actually begins at, None for the clips that
+                 weren't produced (ffmpeg failed, or there's no keyframe to start on without overlapping).
+        """
+    assert len(ranges) == len(targetnames), "Each range requires an output file."
+
+    keyframes = get_keyframe_index(filename)
+    starts = [None] * len(ranges)
+    previous_end = None
+    for index in sorted(range(len(ranges)), key=lambda i: ranges[i][0]):
+        t1, t2 = ranges[index]
+        start = t1
+        if len(keyframes) > 0:
+            start = keyframes.nearest(t1)
+            if previous_end is not None and start < previous_end:
+                start = keyframes.next(previous_end)
+            if start is None or start >= t2:
+                print(f"!! No keyframe to start [{t1}s - {t2}s] of {filename} on without overlapping the previous clip")
+                continue
+
+        if not _ffmpeg_stream_copy(filename, start, t2 - t1, targetnames[index]) or \
+                not os.path.exists(targetnames[index]) or os.path.getsize(targetnames[index]) == 0:
+            print(f"!! ffmpeg failed cutting {filename} [{t1}s - {t2}s] to {targetnames[index]}")
+            continue
+
+        starts[index] = start
+        previous_end = start + t2 - t1
+
+    return starts
+
+
+def _ffmpeg_stream_copy(filename, start, duration, targetname, container=None):
+    """
+    Input-seek to ``start`` and stream copy ``duration`` seconds of the source.
+    :return: True if ffmpeg succeeded.
+    """
+    command = [
+        'ffmpeg',
+        '-ss', "%0.3f" % start,
+        '-i', filename,
+        '-t', "%0.3f" % duration,
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c', 'copy',
+        '-avoid_negative_ts', 'make_zero',
+    ]
+
+    if container is not None:
+        command += ['-f', container]
+    else:
+        command += ['-movflags', '+faststart']
+
+    command += ['-y', targetname]
+
+    return sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE).returncode == 0
+
+
+def _ffmpeg_encode_segment(filename, start, duration, targetname, container=None, threads=None, audio_filter=None):
+    """
+    Input-seek to ``start`` and re-encode ``duration`` seconds of the source with libx264 / aac.
+    :param threads: threads of the decoder & of the encoder, defaults to all cores for each.
+    :param audio_filter: ffmpeg audio filter applied while encoding
+    :return: True if ffmpeg succeeded.
+    """
+    command = ['ffmpeg']
+
+    # Before -i it caps the decoder (& the filters), after it the encoder.
+    if threads is not None:
+        command += ['-filter_threads', str(threads), '-threads', str(threads)]
+
+    command += [
+        '-ss', "%0.3f" % start,
+        '-i', filename,
+        '-t', "%0.3f" % duration,
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c:v', 'libx264',
+        '-c:a', 'aac',
+        '-vf', 'format=yuv420p',
+    ]
+
+    if audio_filter is not None:
+        command += ['-af', audio_filter, '-ar', str(NORMALIZED_SAMPLE_RATE)]
+
+    if threads is not None:
+        command += ['-threads', str(threads)]
+
+    if container is not None:
+        command += ['-f', container]
+    else:
+        command += ['-movflags', '+faststart']
+
+    command += ['-y', targetname]
+
+    return sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE).returncode == 0
 
-    process = sp.Popen(command, stdout=sp.PIPE, stderr=sp.PIPE)
-    process.wait()
-    #
-    # cmd = [get_setting("FFMPEG_BINARY"), "-y",
-    #        "-i", filename,
-    #        "-ss", "%0.2f" % t1,
-    #        "-map", "0", "-vcodec", "h264", "-acodec", "aac", targetname]
-
-    # subprocess_call(cmd)
 
 def add_headers(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -1,11 +1,11 @@
 import json
 import pprint
 
-import requests
 from flask import Blueprint, current_app, jsonify, request
 from flask_cors import cross_origin
 
 from bot import utils
+from bot.services.ayrshare import get_client
 from bot.webapp.blueprints.reddit_feed_importer import build_cors_preflight_response
 
 post_calendar = Blueprint('post_calendar', __name__, url_prefix='/scheduled-posts')
@@ -16,8 +16,7 @@ post_calendar = Blueprint('post_calendar', __name__, url_prefix='/scheduled-post
 def index():
     if request.method == "OPTIONS":
         return build_cors_preflight_response()
-    resp = requests.get('https://app.ayrshare.com/api/history',
-                        headers={'Authorization': f'Bearer {current_app.config.get("AYRSHARE_API_KEY")}'})
+    resp = get_client(current_app.config.get("AYRSHARE_API_KEY")).history()
 
     print(resp)
     _post_history = json.loads(resp.text)
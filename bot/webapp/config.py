@@ -16,8 +16,8 @@ class Config(object):
     CORS_HEADERS = "Content-Type"
 
     TAGS = [
-        ('[ytdesc]', lambda vidbot: vidbot.yt_vid.description),
-        ('[yttitle]', lambda vidbot: vidbot.yt_vid.title),
+        ('[ytdesc]', lambda vidbot: vidbot.source_metadata.description),
+        ('[yttitle]', lambda vidbot: vidbot.source_metadata.title),
     ]
 
     MAIL_SERVER = 'smtp.sendgrid.net'
@@ -45,6 +45,46 @@ class Config(object):
     REDDIT_CLIENT_ID = ""
     REDDIT_CLIENT_SECRET = ""
 
+    # Where probe results & other cached media data are stored.
+    MEDIA_CACHE_DIR = "~/.vidbot/cache"
+
+    # Most entries kept for each kind of cached media data (probes, keyframes, loudness, ...).
+    MEDIA_CACHE_MAX_ENTRIES = 5000
+
+    # Size cap (bytes) of the downloaded source media kept in the cache. 0 disables caching sources.
+    SOURCE_CACHE_MAX_SIZE = 20 * 1024 * 1024 * 1024
+
+    # Size cap (bytes) of the encoded clips kept for recreating them. 0 disables caching clips.
+    CLIP_CACHE_MAX_SIZE = 5 * 1024 * 1024 * 1024
+
+    # Where the per run workspaces are created. None uses tmpfs when it has WORKSPACE_TMPFS_MIN_FREE
+    # bytes free (& the run doesn't download its source), otherwise the system temp directory.
+    WORKSPACE_DIR = None
+    WORKSPACE_TMPFS_MIN_FREE = 4 * 1024 * 1024 * 1024
+
+    # Seconds the cached title, description, keywords & thumbnail of a source are used before they're fetched again.
+    SOURCE_METADATA_TTL = 7 * 24 * 60 * 60
+
+    # Integrated loudness (LUFS) the audio of encoded clips is normalized to. None disables the normalization.
+    # Stream copied clips (--ffmpeg) keep the loudness of their source.
+    CLIP_LOUDNESS_TARGET = -14.0
+
+    # Fingerprint the content of downloaded sources, so clips of the same video from another link count as duplicates.
+    CLIP_CONTENT_FINGERPRINT = True
+
+    # Limits videos must fit in to be accepted by each platform (checked before uploading).
+    # Durations in seconds, sizes in bytes, bitrates in bits/s & dimensions (longest side) in pixels.
+    PLATFORM_LIMITS = {
+        'tiktok': {'min_duration': 3, 'max_duration': 600, 'max_size': 287 * 1024 * 1024, 'max_dimension': 4096},
+        'instagram': {'min_duration': 3, 'max_duration': 900, 'max_size': 300 * 1024 * 1024,
+                      'max_bitrate': 25 * 1000 * 1000, 'max_dimension': 1920},
+        'youtube': {'max_duration': 180, 'max_dimension': 3840},
+        'twitter': {'min_duration': 0.5, 'max_duration': 140, 'max_size': 512 * 1024 * 1024,
+                    'max_bitrate': 25 * 1000 * 1000, 'max_dimension': 1920},
+        'facebook': {'min_duration': 1, 'max_duration': 14400, 'max_size': 4 * 1024 * 1024 * 1024,
+                     'max_dimension': 4096},
+    }
+
 
 class DefaultConfig(Config):
     """
@@ -57,16 +97,16 @@ class DefaultConfig(Config):
     TAGS = [
         ('[bio]', '🎶 Music Link in Bio 🔗'),
         ('[ytchannel]', 'https://www.youtube.com/channel/UC1HBD9-ZHbEe1cN8Pa2BL_g'),
-        ('[ytvid]', lambda vidbot: vidbot.yt_vid.url),
+        ('[ytvid]', lambda vidbot: vidbot.youtube_video_download_link),
         ('[skreet]', 'skreet.ca'),
         ('[viddesc]',
          lambda
-             vidbot: vidbot.yt_vid.description if vidbot.youtube_video_download_link is not None else vidbot.tiktok_downloader.title if vidbot.tiktok_downloader is not None else ""),
+             vidbot: vidbot.source_metadata.description or "" if vidbot.source_metadata is not None else ""),
         ('[title]',
-         lambda vidbot: vidbot.yt_vid.title if vidbot.youtube_video_download_link is not None else vidbot.post_title),
+         lambda vidbot: vidbot.source_metadata.title if vidbot.youtube_video_download_link is not None else vidbot.post_title),
         ('[keywords]', lambda vidbot: vidbot.compile_keywords()),
         ('[hashtags]', lambda vidbot: vidbot.compile_hashtag_string()),
-        ('[ytthumbnail]', lambda vidbot: vidbot.yt_vid.thumbnail_url),
+        ('[ytthumbnail]', lambda vidbot: vidbot.source_metadata.thumbnail_url),
         ('[desc]', lambda vidbot: vidbot.post_description),
         ('[reddit-post-title]', lambda vidbot: vidbot.reddit_post.title if vidbot.reddit_post is not None else "")
     ]
@@ -190,12 +190,62 @@ class VideoClip(SurrogatePK, TimeMixin, SqlModel):
     __tablename__ = "video_clips"
 
     url = db.Column(db.String(255), nullable=False)
+    # Canonical id of the source (e.g. youtube:<video id>) so differently spelled urls of it match.
+    source_id = db.Column(db.String(255), nullable=True, index=True)
+    # Fingerprint of the source's content (duration & sampled frames), matches re-uploads of the same video.
+    fingerprint = db.Column(db.String(64), nullable=True, index=True)
     title = db.Column(db.Text, nullable=False)
     start_time = db.Column(db.Integer, nullable=False)
     duration = db.Column(db.Integer, nullable=False)
 
-    def __init__(self, url, title, start_time, duration):
-        super().__init__(url=url, title=title, start_time=start_time, duration=duration)
+    def __init__(self, url, title, start_time, duration, source_id=None, fingerprint=None):
+        super().__init__(url=url, title=title, start_time=start_time, duration=duration, source_id=source_id,
+                         fingerprint=fingerprint)
+
+
+class CachedSource(SurrogatePK, TimeMixin, SqlModel):
+    """
+    Source media (downloaded by the bot) kept in the local source cache.
+    Files are stored by the hash of their content, so several urls can share the same file.
+    """
+    __tablename__ = "cached_sources"
+
+    url = db.Column(db.Text, nullable=False, unique=True, index=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    path = db.Column(db.Text, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    last_accessed = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, url, content_hash, path, size):
+        super().__init__(url=url, content_hash=content_hash, path=path, size=size,
+                         last_accessed=datetime.datetime.utcnow())
+
+
+class CachedSourceMetadata(SurrogatePK, TimeMixin, SqlModel):
+    """
+    Metadata of an online source (youtube / tiktok video), cached so it isn't fetched again on every run.
+    """
+    __tablename__ = "source_metadata"
+
+    source_id = db.Column(db.String(255), nullable=False, unique=True, index=True)
+    url = db.Column(db.Text, nullable=False)
+    title = db.Column(db.Text, nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    duration = db.Column(db.Float, nullable=True)
+    keywords = db.Column(db.JSON, nullable=True)
+    thumbnail_url = db.Column(db.Text, nullable=True)
+    fetched_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, source_id, url, title=None, description=None, duration=None, keywords=None,
+                 thumbnail_url=None):
+        super().__init__(source_id=source_id, url=url, title=title, description=description, duration=duration,
+                         keywords=keywords, thumbnail_url=thumbnail_url, fetched_at=datetime.datetime.utcnow())
+
+    def is_expired(self, ttl):
+        """
+        Check whether the metadata was fetched more than ttl seconds ago.
+        """
+        return self.fetched_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
 
 
 class MediaUpload(SurrogatePK, TimeMixin, SqlModel):
@@ -204,9 +254,17 @@ class MediaUpload(SurrogatePK, TimeMixin, SqlModel):
     """
     __tablename__ = "media_uploads"
 
+    # How long the API keeps uploaded media.
+    LIFETIME = datetime.timedelta(days=30)
+
+    # Uploads are only reused while they have at least this long left, so scheduled posts don't outlive them.
+    REUSE_MARGIN = datetime.timedelta(days=1)
+
     access_url = db.Column(db.Text, nullable=False)
     content_type = db.Column(db.Text, nullable=False)
     upload_url = db.Column(db.Text, nullable=False)
+    # sha256 of the uploaded file, so the same bytes are never uploaded twice.
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
 
     uploaded = db.Column(db.Boolean, default=False)
 
@@ -216,14 +274,46 @@ class MediaUpload(SurrogatePK, TimeMixin, SqlModel):
     image = db.relationship("ImageDb", backref=backref("upload", uselist=False), uselist=False)
     image_id = db.Column(db.Integer, db.ForeignKey('images.id'), nullable=True)
 
-    def __init__(self, access_url, content_type, upload_url, clip=None, image=None):
+    def __init__(self, access_url, content_type, upload_url, clip=None, image=None, content_hash=None):
         super().__init__(access_url=access_url, content_type=content_type, upload_url=upload_url, uploaded=False,
                          clip=clip, clip_id=clip.id if clip is not None else None, image=image,
-                         image_id=image.id if image is not None else None)
+                         image_id=image.id if image is not None else None, content_hash=content_hash)
 
     @hybrid_property
     def is_expired(self):
-        return datetime.datetime.utcnow() >= self.created_at + datetime.timedelta(days=30)
+        return datetime.datetime.utcnow() >= self.created_at + MediaUpload.LIFETIME
+
+    @staticmethod
+    def find_by_content_hash(content_hash):
+        """
+        Find a completed upload of the same content that hasn't expired (and won't for a while).
+        :param content_hash: sha256 of the file
+        :return: MediaUpload or None
+        """
+        if content_hash is None:
+            return None
+
+        created_after = datetime.datetime.utcnow() - (MediaUpload.LIFETIME - MediaUpload.REUSE_MARGIN)
+        return MediaUpload.query.filter_by(content_hash=content_hash, uploaded=True) \
+            .filter(MediaUpload.created_at > created_after) \
+            .order_by(MediaUpload.id.desc()).first()
+
+    def reuse(self, clip=None, image=None):
+        """
+        Record the uploaded media for another clip or image: a new upload of the same access url, tied to
+        the new record, so its posts describe it instead of the record the media was first uploaded for.
+        Keeps the creation time of this upload, the media still expires when this upload does.
+        :return: MediaUpload
+        """
+        media_upload = MediaUpload(access_url=self.access_url, content_type=self.content_type,
+                                   upload_url=self.upload_url, clip=clip, image=image, content_hash=self.content_hash)
+        media_upload.uploaded = True
+        media_upload.save(commit=False)
+        db.session.flush()
+        # Set after the insert, which stamps the current time.
+        media_upload.created_at = self.created_at
+        db.session.commit()
+        return media_upload
 
     @hybrid_property
     def is_video(self):
@@ -7,6 +7,10 @@ from bot.webapp.models import MailMessage
 from cli_commands import chop, image, upload_schedule
 from cli_commands.email_templates import add_email_template_command, view_email_templates_command, \
     delete_email_template_command
+from cli_commands.batch import batch
+from cli_commands.benchmark_posting import benchmark_posting
+from cli_commands.check_partial_download import check_partial_download
+from cli_commands.check_upload import check_upload
 from cli_commands.clips import view_clips
 from cli_commands.gui import gui
 from cli_commands.history import history
@@ -14,7 +18,9 @@ from cli_commands.images import images
 from cli_commands.import_csv_file import import_csv_file_command, scan_and_parse_csv_files
 from cli_commands.mail_send import mail_send
 from cli_commands.post_info import post_info
+from cli_commands.post_uploads import post_uploads
 from cli_commands.redo_clip import redo_clip
+from cli_commands.refresh_metadata import refresh_metadata
 from cli_commands.tiktok_download import tiktok_download
 
 from bot.webapp import create_app, mail
@@ -41,7 +47,8 @@ flask_app = create_app(config)
 @click.option('--length', '-l', "clip_length", default=-1, help="Length of the clip in seconds")
 @click.option('--skip', '-s', "skip_intro_time", default=0, help="Skip the first x seconds of the video")
 @click.option('--output', '-o', "output_filename", default=f"output.mp4",
-              help="Output path for the video clip", prompt="Filename for your clip")
+              help="Filename of the video clip, created in the workspace of the run (kept with --no-cleanup)",
+              prompt="Filename for your clip")
 @click.option("--description", "-d", "description", default=None, help="Description for the post.")
 @click.option('--force', '-f', "skip_duplicate_check", is_flag=True, default=False,
               help="Force the post of the video, skipping duplicate cuts.")
@@ -51,10 +58,26 @@ flask_app = create_app(config)
 @click.option('--title', "title", required=False, help="Provide this if you're giving the clip a new title.")
 @click.option('--start', '-st', 'start_time', required=False, default=-1,
               help="Start time of the clip (default random start time)")
-@click.option('--ffmpeg', '-fm', 'ffmpeg', required=False, default=False, help="Use ffmpeg to cut the video",
-              is_flag=True)
+@click.option('--ffmpeg', '-fm', 'ffmpeg', required=False, default=False,
+              help="Stream copy the clip (fast, keyframe aligned) instead of re-encoding it", is_flag=True)
+@click.option('--accurate-cut', '-ac', 'ffmpeg_accurate_cut', required=False, default=False, is_flag=True,
+              help="With --ffmpeg, re-encode up to the first keyframe instead of snapping the start to a keyframe")
 @click.option('--no-cleanup', '-nc', 'no_cleanup', required=False, is_flag=True, default=False,
               help="Do not cleanup the files")
+@click.option('--count', '-n', 'count', required=False, default=1,
+              help="Number of (non-overlapping) clips to cut from the video in one pass")
+@click.option('--workers', '-w', 'encoder_workers', required=False, default=1,
+              help="With --count, encode this many clips concurrently (ffmpeg threads are split between them)")
+@click.option('--partial', '-pd', 'partial_download', required=False, is_flag=True, default=False,
+              help="Only download the part of the youtube video the clip is cut from (HTTP Range requests)")
+@click.option('--highlights', '-hl', 'highlights', required=False, is_flag=True, default=False,
+              help="Start clips on the liveliest parts of the video (loudness & onsets) instead of at random")
+@click.option('--scenes', 'scene_detection', required=False, is_flag=True, default=False,
+              help="With --highlights, also score the video on scene changes (slower, decodes the whole video)")
+@click.option('--preview', '-pv', 'preview', required=False, is_flag=True, default=False,
+              help="Review quick low resolution previews of the clip, the full quality encode only runs once one is approved")
+@click.option('--adaptive', '-ad', 'adaptive', required=False, is_flag=True, default=False,
+              help="Download the best quality youtube video & audio streams in parallel & merge them (above 720p)")
 def chop_video(youtube_video_download_link: str = None, tiktok_video_link=None, google_drive_link=None,
                local_video_path=None,
                clip_length=33,
@@ -62,7 +85,10 @@ def chop_video(youtube_video_download_link: str = None, tiktok_video_link=None,
                output_filename: str = None,
                description: str = None,
                start_time: int = None,
-               skip_duplicate_check=False, schedule=None, platforms=None, title=None, ffmpeg=False, no_cleanup=True):
+               skip_duplicate_check=False, schedule=None, platforms=None, title=None, ffmpeg=False,
+               ffmpeg_accurate_cut=False, no_cleanup=True, count=1,
+               encoder_workers=1, partial_download=False, highlights=False, scene_detection=False, preview=False,
+               adaptive=False):
     """
     Chop a video and post it on social media.
     :param youtube_video_download_link: Youtube video link.
@@ -73,13 +99,64 @@ def chop_video(youtube_video_download_link: str = None, tiktok_video_link=None,
     :param skip_duplicate_check:
     :param schedule:
     :param platforms:
+    :param count: number of clips to cut
+    :param encoder_workers: number of clips to encode concurrently
+    :param partial_download: only download the part of the video needed for the clip
+    :param highlights: start the clips on the highlights of the video
+    :param scene_detection: include scene changes in the highlight scores
+    :param preview: review low resolution previews before the full quality encode
+    :param adaptive: download the adaptive youtube streams (best quality)
     :return:
     """
     chop(youtube_video_download_link=youtube_video_download_link, output_filename=output_filename,
          description=description, start_time=start_time, tiktok_video_link=tiktok_video_link,
          google_drive_link=google_drive_link, local_video_path=local_video_path, clip_length=clip_length,
          skip_intro_time=skip_intro_time, skip_duplicate_check=skip_duplicate_check, schedule=schedule,
-         platforms=platforms, title=title, ffmpeg=ffmpeg, no_cleanup=no_cleanup)
+         platforms=platforms, title=title, ffmpeg=ffmpeg, ffmpeg_accurate_cut=ffmpeg_accurate_cut,
+         no_cleanup=no_cleanup, count=count, encoder_workers=encoder_workers,
+         partial_download=partial_download, highlights=highlights, scene_detection=scene_detection,
+         preview=preview, adaptive=adaptive)
+
+
+@cli.command('batch')
+@click.argument('sources_file')
+@click.option('--length', '-l', "clip_length", default=33, help="Length of the clips in seconds")
+@click.option('--skip', '-s', "skip_intro_time", default=0, help="Skip the first x seconds of the videos")
+@click.option("--description", "-d", "description", default=None, help="Description for the posts.")
+@click.option('--force', '-f', "skip_duplicate_check", is_flag=True, default=False,
+              help="Clip the videos even when the clips overlap previous ones.")
+@click.option('--schedule', '-t', "schedule", default=None,
+              help="Schedule the posts for a specific time. Format: YYYY-MM-DD HH:MM:SS")
+@click.option('--platforms', '-p', "platforms", default="tiktok,instagram,facebook,twitter,youtube")
+@click.option('--ffmpeg', '-fm', 'ffmpeg', required=False, default=False, is_flag=True,
+              help="Cut the clips with ffmpeg stream copies")
+@click.option('--accurate-cut', '-ac', 'ffmpeg_accurate_cut', required=False, default=False, is_flag=True,
+              help="With --ffmpeg, re-encode up to the first keyframe instead of snapping the start to it")
+@click.option('--partial', '-pd', 'partial_download', required=False, is_flag=True, default=False,
+              help="Only download the part of the youtube videos needed for the clips")
+@click.option('--highlights', '-hl', 'highlights', required=False, is_flag=True, default=False,
+              help="Start the clips on the highlights of the videos")
+@click.option('--adaptive', '-ad', 'adaptive', required=False, is_flag=True, default=False,
+              help="Download the best quality youtube video & audio streams in parallel")
+@click.option('--download-workers', 'download_workers', default=2, help="Number of concurrent downloads")
+@click.option('--clip-workers', 'clip_workers', default=1, help="Number of concurrent encodes")
+@click.option('--upload-workers', 'upload_workers', default=2, help="Number of concurrent uploads")
+@click.option('--post-workers', 'post_workers', default=1, help="Number of concurrent posts")
+@click.option('--queue-size', '-q', 'queue_size', default=1,
+              help="Number of sources waiting between two stages before the earlier stage pauses")
+def batch_chop(sources_file, clip_length=33, skip_intro_time=0, description=None, skip_duplicate_check=False,
+               schedule=None, platforms=None, ffmpeg=False, ffmpeg_accurate_cut=False, partial_download=False,
+               highlights=False, adaptive=False, download_workers=2, clip_workers=1, upload_workers=2,
+               post_workers=1, queue_size=1):
+    """
+    Clip & post a video from every source in SOURCES_FILE (one link or local path per line).
+    The downloads, encodes, uploads & posts of different sources run at the same time.
+    """
+    batch(sources_file, clip_length=clip_length, skip_intro_time=skip_intro_time, description=description,
+          skip_duplicate_check=skip_duplicate_check, schedule=schedule, platforms=platforms, ffmpeg=ffmpeg,
+          ffmpeg_accurate_cut=ffmpeg_accurate_cut, partial_download=partial_download, highlights=highlights,
+          adaptive=adaptive, download_workers=download_workers, clip_workers=clip_workers,
+          upload_workers=upload_workers, post_workers=post_workers, queue_size=queue_size)
 
 
 @cli.command('image')
@@ -134,6 +211,16 @@ def download_tiktok(url, output_filename):
     tiktok_download(url, output_filename)
 
 
+@cli.command('refresh_metadata')
+@click.argument('url')
+def refresh_source_metadata(url):
+    """
+    Drop the cached title, description, keywords & thumbnail of a source and fetch them again.
+    :param url: youtube, tiktok or google drive url
+    """
+    refresh_metadata(url)
+
+
 @cli.command('images')
 def image_posts():
     """
@@ -236,6 +323,74 @@ def view_email_templates():
     view_email_templates_command()
 
 
+@cli.command('post_uploads')
+@click.argument('upload_ids')
+@click.option('--platforms', '-p', "platforms", default="tiktok,instagram,facebook,twitter,youtube")
+@click.option('--schedule', '-t', "schedule", default=None,
+              help="Schedule the posts for a specific time. Format: YYYY-MM-DD HH:MM:SS")
+@click.option('--interval', '-i', "interval", type=int, default=None,
+              help="With --schedule, minutes between the scheduled times of consecutive uploads")
+@click.option("--description", "-d", "description", default=None, help="Description for the posts.")
+@click.option("--title", "title", default=None, help="Title for the posts, defaults to the title of the clips.")
+@click.option("--hashtags", "hashtags", default=None, help="Comma separated hashtags for the posts.")
+@click.option("--profiles", "profile_keys", default=None,
+              help="Comma separated Ayrshare profile keys to post every upload to.")
+@click.option('--concurrency', '-c', 'concurrency', default=8, help="Number of posts sent at the same time")
+@click.option('--rate', '-r', 'rate', default=4.0, help="Most posts sent per second")
+def post_uploads_command(upload_ids, platforms=None, schedule=None, interval=None, description=None, title=None,
+                         hashtags=None, profile_keys=None, concurrency=8, rate=4.0):
+    """
+    Post previously uploaded media (UPLOAD_IDS, comma separated) to the platforms, all at the same time.
+    """
+    post_uploads(upload_ids, platforms=platforms, schedule=schedule, interval=interval, description=description,
+                 title=title, hashtags=hashtags, profile_keys=profile_keys, concurrency=concurrency, rate=rate)
+
+
+@cli.command('benchmark_posting')
+@click.option('--posts', '-n', 'posts', default=40, help="Number of posts to send")
+@click.option('--platforms', '-p', "platforms", default="tiktok,instagram,youtube")
+@click.option('--latency', '-l', 'latency', default=0.5, help="Seconds the mock server takes per post")
+@click.option('--rate-limit', 'rate_limit', type=int, default=None,
+              help="Posts per second the mock server accepts before answering with 429s")
+@click.option('--concurrency', '-c', 'concurrency', default=8, help="Number of posts sent at the same time")
+@click.option('--rate', '-r', 'rate', default=4.0, help="Most posts sent per second")
+def benchmark_posting_command(posts=40, platforms=None, latency=0.5, rate_limit=None, concurrency=8, rate=4.0):
+    """
+    Compare posting one at a time with the concurrent posting engine, against a local mock Ayrshare server.
+    """
+    benchmark_posting(posts=posts, platforms=platforms, latency=latency, rate_limit=rate_limit,
+                      concurrency=concurrency, rate=rate)
+
+
+@cli.command('check_partial_download')
+@click.argument('sample')
+@click.option('--start', '-s', 'start_time', default=0.0, help="Start of the clip window in seconds")
+@click.option('--length', '-l', 'clip_length', default=33.0, help="Length of the clip window in seconds")
+@click.option('--no-ranges', 'no_ranges', is_flag=True, default=False,
+              help="Serve the sample without Range support, the partial download has to refuse it")
+def check_partial_download_command(sample, start_time=0.0, clip_length=33.0, no_ranges=False):
+    """
+    Partially download a window of the SAMPLE mp4 from a local Range capable server & check that it decodes.
+    """
+    if not check_partial_download(sample, start_time=start_time, clip_length=clip_length, ranges=not no_ranges):
+        raise SystemExit(1)
+
+
+@cli.command('check_upload')
+@click.argument('file')
+@click.option('--drops', 'drops', default=1, help="Uploads that lose their connection halfway through")
+@click.option('--errors', 'errors', default=1, help="Uploads answered with a 503 after the drops")
+@click.option('--single', 'single', is_flag=True, default=False,
+              help="Stand in for a url only signed for a single PUT, instead of a multipart capable storage")
+@click.option('--part-size', 'part_size', default=1024 * 1024, help="Bytes per part of the multipart upload")
+def check_upload_command(file, drops=1, errors=1, single=False, part_size=1024 * 1024):
+    """
+    Upload FILE to a local stand-in of the media storage that fails the first attempts & check what it stored.
+    """
+    if not check_upload(file, drops=drops, errors=errors, multipart=not single, part_size=part_size):
+        raise SystemExit(1)
+
+
 @cli.command('test_mail')
 @click.option('--template', '-t', "template", default=None, help="Template to use for the email.")
 def test_mail(template):
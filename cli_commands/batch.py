@@ -0,0 +1,136 @@
+import os
+
+import click
+from flask import current_app
+
+from bot import VidBot
+from bot.services.ayrshare import get_client
+from bot.services.pipeline import Pipeline, Stage
+from bot.services.source_metadata import is_youtube_url, is_tiktok_url, is_google_drive_url
+from bot.webapp.models import MediaUpload, VideoClip
+
+
+def read_sources(sources_file):
+    """
+    Read the sources of a batch: one youtube, tiktok or google drive link (or local video path) per line.
+    Blank lines & lines starting with # are skipped.
+    """
+    with open(os.path.expanduser(sources_file), 'r') as f:
+        return [line.strip() for line in f if line.strip() != "" and not line.strip().startswith("#")]
+
+
+def source_bot(source, **kwargs):
+    """
+    Create the VidBot for a single source of the batch.
+    :return: VidBot, or None if the source isn't a supported link or an existing file.
+    """
+    if is_youtube_url(source):
+        return VidBot(youtube_video_download_link=source, **kwargs)
+    if is_tiktok_url(source):
+        return VidBot(tiktok_video_url=source, **kwargs)
+    if is_google_drive_url(source):
+        return VidBot(google_drive_link=source, **kwargs)
+    if os.path.exists(os.path.expanduser(source)):
+        return VidBot(local_video_clip_location=os.path.expanduser(source), **kwargs)
+    return None
+
+
+class BatchItem(object):
+    """
+    A source going through the batch pipeline, with what each stage produced for it.
+    Records are passed on by id: every stage runs in its own threads, with its own database session.
+    """
+
+    def __init__(self, source, bot: VidBot):
+        self.source = source
+        self.bot = bot
+        self.clip_path = None
+        self.clip_id = None
+        self.media_upload_id = None
+
+    def __repr__(self):
+        return f"BatchItem(source={self.source})"
+
+
+def download_stage(item: BatchItem):
+    item.bot.prepare_source()
+    return item
+
+
+def clip_stage(item: BatchItem):
+    item.clip_path, clip_record = item.bot.create_video_clip()
+    if clip_record is None:
+        return None
+
+    item.clip_id = clip_record.id
+    return item
+
+
+def upload_stage(item: BatchItem):
+    clip_record = VideoClip.query.get(item.clip_id)
+    upload = clip_record.upload
+    if upload is not None and not upload.is_expired:
+        click.echo(f"Reusing existing upload {upload.access_url}")
+        item.media_upload_id = upload.id
+        return item
+
+    media_upload = item.bot.upload_file_to_cloud(video_clip=clip_record, filename=item.clip_path)
+    if media_upload is None:
+        return None
+
+    item.media_upload_id = media_upload.id
+    return item
+
+
+def post_stage(item: BatchItem):
+    item.bot.post_to_socials(MediaUpload.query.get(item.media_upload_id))
+    print(f"Posted {item.source} to {','.join(item.bot.platforms)}")
+    item.bot.cleanup_files()
+    return item
+
+
+def cleanup_item(item: BatchItem):
+    item.bot.cleanup_files()
+
+
+def batch(sources_file, clip_length=33, skip_intro_time=0, description=None, skip_duplicate_check=False,
+          schedule=None, platforms=None, ffmpeg=False, ffmpeg_accurate_cut=False, partial_download=False,
+          highlights=False, adaptive=False, download_workers=2, clip_workers=1, upload_workers=2, post_workers=1,
+          queue_size=1):
+    """
+    Clip & post every source of the file, overlapping the downloads, encodes, uploads & posts of different sources.
+    Runs unattended: the clips aren't previewed before they're uploaded & posted.
+    """
+    sources = read_sources(sources_file)
+    if len(sources) == 0:
+        click.echo(f"No sources found in {sources_file}")
+        return
+
+    bot_options = dict(clip_length=clip_length, skip_intro_time=skip_intro_time, post_description=description,
+                       skip_duplicate_check=skip_duplicate_check, scheduled_date=schedule,
+                       platforms=platforms.split(',') if "," in platforms else [platforms], ffmpeg=ffmpeg,
+                       ffmpeg_accurate_cut=ffmpeg_accurate_cut, partial_download=partial_download,
+                       highlights=highlights, adaptive=adaptive)
+
+    items = []
+    for source in sources:
+        bot = source_bot(source, **bot_options)
+        if bot is None:
+            click.echo(f"Skipping {source}: not a youtube, tiktok or google drive link, or an existing file.")
+            continue
+        items.append(BatchItem(source, bot))
+
+    # The database session & config are per thread, every worker runs in its own app context.
+    app = current_app._get_current_object()
+    pipeline = Pipeline([
+        Stage("download", download_stage, workers=download_workers, on_drop=cleanup_item),
+        Stage("clip", clip_stage, workers=clip_workers, on_drop=cleanup_item),
+        Stage("upload", upload_stage, workers=upload_workers, on_drop=cleanup_item),
+        Stage("post", post_stage, workers=post_workers, on_drop=cleanup_item),
+    ], queue_size=queue_size, context=app.app_context)
+
+    click.echo(f"Running {len(items)} sources through the pipeline")
+    posted = pipeline.run(items)
+    pipeline.print_stats()
+    get_client(app.config.get("AYRSHARE_API_KEY")).print_stats()
+    click.echo(f"Posted {len(posted)} of {len(items)} sources.")
@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+from bot.services.ayrshare import AyrshareClient
+from bot.services.posting_engine import PostingEngine, PostJob
+
+
+class MockAyrshareServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Ayrshare post endpoint: every post takes `latency` seconds & more than
+    `rate_limit` posts per second are answered with a 429.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.5, rate_limit=None):
+        super().__init__(('127.0.0.1', 0), MockAyrshareHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.rate_limited = 0
+        self.recent = deque()
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+    def is_rate_limited(self):
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return False
+
+            now = time.monotonic()
+            while len(self.recent) > 0 and self.recent[0] <= now - 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                self.rate_limited += 1
+                return True
+
+            self.recent.append(now)
+            return False
+
+
+class MockAyrshareHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status_code, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        post_data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        if self.path != "/api/post":
+            self.respond(404, {"status": "error", "message": "Not found"})
+            return
+
+        if self.server.is_rate_limited():
+            self.respond(429, {"status": "error", "message": "Rate limit exceeded"}, {'Retry-After': '1'})
+            return
+
+        time.sleep(self.server.latency)
+        post_id = uuid.uuid4().hex
+        self.respond(200, {
+            "status": "scheduled" if "scheduleDate" in post_data else "success",
+            "id": post_id,
+            "postIds": [{"status": "success", "platform": platform, "id": post_id,
+                         "postUrl": f"https://example.com/{platform}/{post_id}"}
+                        for platform in post_data.get('platforms', [])],
+        })
+
+
+def benchmark_jobs(posts, platforms):
+    return [PostJob(None, platforms, post_data={"post": f"Benchmark post {index}", "platforms": platforms,
+                                                "mediaUrls": [f"https://example.com/media/{index}.mp4"],
+                                                "isVideo": True})
+            for index in range(posts)]
+
+
+def print_results(name, results, elapsed, server):
+    latencies = sorted(result.elapsed for result in results) or [0.0]
+    posted = len([result for result in results if result.succeeded])
+    click.echo(f"{name:<12} {posted:>6}/{len(results):<6} {elapsed:>8.2f}s {posted / elapsed:>8.2f}/s "
+               f"{latencies[len(latencies) // 2]:>7.2f}s {latencies[int(len(latencies) * 0.95) - 1]:>7.2f}s "
+               f"{server.rate_limited:>6}")
+
+
+def benchmark_posting(posts=40, platforms="tiktok,instagram,youtube", latency=0.5, rate_limit=None, concurrency=8,
+                      rate=4.0):
+    """
+    Post the same batch to a local mock Ayrshare server one after the other & with the posting engine.
+    Nothing is sent to Ayrshare or recorded in the database.
+    """
+    platforms = platforms.split(',')
+    server = MockAyrshareServer(latency=latency, rate_limit=rate_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    click.echo(f"Posting {posts} posts to a mock server ({latency}s per post"
+               f"{f', {rate_limit} posts per second' if rate_limit is not None else ''})")
+    click.echo(f"{'':<12} {'posted':>13} {'time':>9} {'rate':>10} {'p50':>8} {'p95':>8} {'429s':>6}")
+
+    try:
+        client = AyrshareClient("benchmark", base_url=server.base_url, pool_size=1)
+        start = time.perf_counter()
+        results = PostingEngine(client=client, concurrency=1, rate=float(posts), burst=posts).run(
+            benchmark_jobs(posts, platforms), record=False)
+        print_results("sequential", results, time.perf_counter() - start, server)
+
+        server.rate_limited = 0
+        client = AyrshareClient("benchmark", base_url=server.base_url, pool_size=concurrency)
+        start = time.perf_counter()
+        results = PostingEngine(client=client, concurrency=concurrency, rate=rate).run(
+            benchmark_jobs(posts, platforms), record=False)
+        print_results("engine", results, time.perf_counter() - start, server)
+        client.print_stats()
+    finally:
+        server.shutdown()
+        server.server_close()
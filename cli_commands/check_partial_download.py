@@ -0,0 +1,175 @@
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+from bot.services.partial_download import download_clip_window, PartialDownloadError
+
+
+class RangeFileServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the video host: serves a single file, answering Range requests with 206 partial content.
+    Records the bytes it sent, so the size of a partial download can be compared with the whole file.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, ranges=True):
+        """
+        :param path: file served at every url
+        :param ranges: whether Range requests are honoured, the whole file is sent with a 200 otherwise
+        """
+        super().__init__(('127.0.0.1', 0), RangeFileHandler)
+        self.path = path
+        self.ranges = ranges
+        self.size = os.path.getsize(path)
+        self.requests = 0
+        self.sent_bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/{os.path.basename(self.path)}"
+
+    def record(self, sent_bytes):
+        with self.lock:
+            self.requests += 1
+            self.sent_bytes += sent_bytes
+
+
+class RangeFileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def byte_range(self):
+        """
+        Parse the (single) Range header of the request.
+        :return: (first byte, last byte), None when the whole file is requested, or False if the range is invalid.
+        """
+        header = self.headers.get('Range')
+        if header is None or not self.server.ranges:
+            return None
+
+        size = self.server.size
+        try:
+            first, last = header.split('=', 1)[1].split(',')[0].split('-', 1)
+            if first == "":
+                # Suffix range: the last n bytes.
+                first, last = max(0, size - int(last)), size - 1
+            else:
+                first, last = int(first), min(int(last), size - 1) if last != "" else size - 1
+        except (IndexError, ValueError):
+            return False
+
+        if first < 0 or first > last:
+            return False
+        return first, last
+
+    def do_GET(self):
+        byte_range = self.byte_range()
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{self.server.size}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        first, last = byte_range if byte_range is not None else (0, self.server.size - 1)
+        self.send_response(206 if byte_range is not None else 200)
+        if byte_range is not None:
+            self.send_header('Content-Range', f"bytes {first}-{last}/{self.server.size}")
+        self.send_header('Accept-Ranges', 'bytes' if self.server.ranges else 'none')
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+
+        sent = 0
+        with open(self.server.path, 'rb') as f:
+            f.seek(first)
+            while sent < last - first + 1:
+                data = f.read(min(1024 * 1024, last - first + 1 - sent))
+                if not data:
+                    break
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    break
+                sent += len(data)
+
+        self.server.record(sent)
+
+
+def decode_errors(path, start_time, duration):
+    """
+    Decode [start_time, start_time + duration] of the file, like cutting a clip from it would.
+    :return: ffmpeg's errors, empty when the window decoded cleanly
+    """
+    command = [
+        'ffmpeg',
+        '-v', 'error',
+        '-ss', "%0.3f" % start_time,
+        '-i', path,
+        '-t', "%0.3f" % duration,
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-f', 'null',
+        '-'
+    ]
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
+    errors = process.stderr.strip()
+    if process.returncode != 0 and errors == "":
+        errors = f"ffmpeg exited with {process.returncode}"
+    return errors
+
+
+def check_partial_download(sample, start_time=0, clip_length=33, ranges=True):
+    """
+    Partially download the clip window of a sample MP4 from a local Range capable server, then check
+    that the window of the sparse copy decodes. Without ranges the server ignores Range requests,
+    which the partial download has to report instead of writing a broken file.
+    :return: True if the check passed
+    """
+    sample = os.path.expanduser(sample)
+    server = RangeFileServer(sample, ranges=ranges)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    work_dir = tempfile.mkdtemp(prefix="partial-check-")
+    output_path = os.path.join(work_dir, os.path.basename(sample))
+
+    try:
+        try:
+            download_clip_window(server.url, start_time, clip_length, output_path)
+        except PartialDownloadError as e:
+            if ranges:
+                click.echo(f"!! Partial download failed: {e}")
+                return False
+            click.echo(f"+ The server ignored Range requests & the partial download refused it: {e}")
+            return True
+
+        if not ranges:
+            click.echo("!! The partial download went ahead without Range support")
+            return False
+
+        click.echo(f"~ {server.requests} requests fetched {server.sent_bytes} of {server.size} bytes "
+                   f"({server.sent_bytes / server.size * 100:.1f}%)")
+
+        if shutil.which('ffmpeg') is None:
+            click.echo("!! ffmpeg isn't installed, can't decode the downloaded window")
+            return False
+
+        errors = decode_errors(output_path, start_time, clip_length)
+        if errors != "":
+            click.echo(f"!! [{start_time}s - {start_time + clip_length}s] of the partial download doesn't decode:\n"
+                       f"{errors}")
+            return False
+
+        click.echo(f"+ [{start_time}s - {start_time + clip_length}s] of the partial download decodes cleanly")
+        return True
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
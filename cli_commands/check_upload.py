@@ -0,0 +1,204 @@
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import click
+
+from bot.services.source_cache import file_sha256
+from bot.services.uploader import Uploader, UploadError, print_upload_progress, xml_elements
+
+
+class MockStorageServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the storage the media urls point at. Like a signed url it only accepts a PUT with
+    the content type it was signed for (403 otherwise). With multipart it also supports S3 multipart
+    uploads: POST ?uploads starts one, PUT ?partNumber&uploadId uploads a part, GET ?uploadId lists the parts
+    & POST ?uploadId completes it. The first `drops` PUTs lose their connection halfway through the body &
+    the following `errors` PUTs get a 503, so retries (& resuming) can be checked.
+    """
+    daemon_threads = True
+
+    def __init__(self, content_type, drops=0, errors=0, multipart=False):
+        super().__init__(('127.0.0.1', 0), MockStorageHandler)
+        self.content_type = content_type
+        self.drops = drops
+        self.errors = errors
+        self.multipart = multipart
+        self.requests = 0
+        self.part_requests = 0
+        self.stored = None
+        # {upload id: {part number: bytes}}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/media/upload?X-Goog-Signature=mock"
+
+    def next_failure(self):
+        """
+        :return: 'drop', 'error' or None for the upload being received
+        """
+        with self.lock:
+            self.requests += 1
+            if self.drops > 0:
+                self.drops -= 1
+                return 'drop'
+            if self.errors > 0:
+                self.errors -= 1
+                return 'error'
+            return None
+
+
+class MockStorageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status_code, body=b"", headers=None):
+        self.send_response(status_code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @property
+    def query(self):
+        return parse_qs(urlsplit(self.path).query, keep_blank_values=True)
+
+    def do_POST(self):
+        query = self.query
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.server.multipart or ('uploads' not in query and 'uploadId' not in query):
+            # The url is signed for a PUT, anything else doesn't match the signature.
+            self.close_connection = True
+            self.respond(403)
+            return
+
+        if 'uploads' in query:
+            if self.headers.get('Content-Type') != self.server.content_type:
+                self.respond(403)
+                return
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = {}
+            self.respond(200, f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>"
+                              f"</InitiateMultipartUploadResult>".encode('utf-8'))
+            return
+
+        parts = self.server.uploads.get(query['uploadId'][0])
+        if parts is None:
+            self.respond(404)
+            return
+
+        # Every part listed has to be the part that was uploaded.
+        data = b""
+        for part in xml_elements(body.decode('utf-8'), 'Part'):
+            values = {child.tag: child.text for child in part}
+            number = int(values['PartNumber'])
+            if number not in parts or values['ETag'] != f'"{hashlib.md5(parts[number]).hexdigest()}"':
+                self.respond(400, b"<Error><Code>InvalidPart</Code></Error>")
+                return
+            data += parts[number]
+
+        self.server.stored = data
+        del self.server.uploads[query['uploadId'][0]]
+        self.respond(200, b"<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+
+    def do_GET(self):
+        query = self.query
+        parts = self.server.uploads.get(query['uploadId'][0]) if 'uploadId' in query else None
+        if not self.server.multipart or parts is None:
+            self.respond(404)
+            return
+
+        self.respond(200, ("<ListPartsResult>" + "".join(
+            f'<Part><PartNumber>{number}</PartNumber><ETag>"{hashlib.md5(data).hexdigest()}"</ETag>'
+            f'<Size>{len(data)}</Size></Part>' for number, data in sorted(parts.items())) +
+                           "</ListPartsResult>").encode('utf-8'))
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length', 0))
+        query = self.query
+        is_part = self.server.multipart and 'partNumber' in query and 'uploadId' in query
+        if not is_part and self.headers.get('Content-Type') != self.server.content_type:
+            self.close_connection = True
+            self.respond(403)
+            return
+
+        failure = self.server.next_failure()
+        if failure == 'drop':
+            self.rfile.read(length // 2)
+            self.close_connection = True
+            self.connection.close()
+            return
+
+        data = self.rfile.read(length)
+        if failure == 'error':
+            self.respond(503)
+            return
+
+        if is_part:
+            parts = self.server.uploads.get(query['uploadId'][0])
+            if parts is None:
+                self.respond(404)
+                return
+            with self.server.lock:
+                self.server.part_requests += 1
+                parts[int(query['partNumber'][0])] = data
+            self.respond(200, headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+            return
+
+        self.server.stored = data
+        self.respond(200)
+
+
+def check_upload(path, drops=1, errors=1, multipart=True, part_size=1024 * 1024):
+    """
+    Upload a file to a local stand-in of the media storage that drops & fails the first attempts,
+    then check the stored bytes are the file's. With multipart the file is sent in parts & the upload
+    is first interrupted (without retries) to check it resumes with the parts that are missing.
+    :return: True if the check passed
+    """
+    path = os.path.expanduser(path)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    server = MockStorageServer(content_type, drops=drops, errors=errors, multipart=multipart)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        if multipart:
+            parts = max(1, -(-os.path.getsize(path) // part_size))
+            try:
+                Uploader(retries=0, multipart_threshold=0, part_size=part_size).upload(server.url, path, content_type)
+            except UploadError as e:
+                click.echo(f"~ Interrupted the first upload: {e}")
+            else:
+                click.echo("~ The first upload went through without interruptions, nothing to resume")
+
+            sent = server.part_requests
+            Uploader(retries=drops + errors + 1, multipart_threshold=0, part_size=part_size,
+                     progress_callback=print_upload_progress).upload(server.url, path, content_type)
+            click.echo(f"~ {sent} of {parts} parts were uploaded before the interruption, "
+                       f"{server.part_requests - sent} after it")
+        else:
+            Uploader(retries=drops + errors + 1, multipart_threshold=None,
+                     progress_callback=print_upload_progress).upload(server.url, path, content_type)
+    except UploadError as e:
+        click.echo(f"!! {e}")
+        return False
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if server.stored is None or hashlib.sha256(server.stored).hexdigest() != file_sha256(path):
+        click.echo("!! The stored upload doesn't match the file")
+        return False
+
+    click.echo(f"+ Uploaded {os.path.getsize(path)} bytes in {server.requests} attempts, the stored bytes match")
+    return True
@@ -11,13 +11,20 @@ def chop(youtube_video_download_link: str = None, tiktok_video_link=None, google
          output_filename: str = None,
          description: str = None,
          start_time: int = None,
-         skip_duplicate_check=False, schedule=None, platforms=None, title=None, ffmpeg=False, no_cleanup=True):
+         skip_duplicate_check=False, schedule=None, platforms=None, title=None, ffmpeg=False,
+         ffmpeg_accurate_cut=False, no_cleanup=True, count=1,
+         encoder_workers=1, partial_download=False, highlights=False, scene_detection=False,
+         preview=False, adaptive=False):
 
 
     if "." not in output_filename:
         click.echo("Please provide a filename with an extension")
         return
 
+    if count > 1 and clip_length == -1:
+        click.echo("Please provide a clip length (--length) to cut multiple clips")
+        return
+
     if google_drive_link is None and youtube_video_download_link is None and local_video_path is None and tiktok_video_link is None:
         click.echo(
             "ERROR: You must provide a video link.\n\n See --help for more information")
@@ -34,5 +41,13 @@ def chop(youtube_video_download_link: str = None, tiktok_video_link=None, google
                  subclip_start=start_time,
                  post_description=description, skip_duplicate_check=skip_duplicate_check, scheduled_date=schedule,
                  platforms=platforms.split(',') if "," in platforms else [platforms], post_title=title, ffmpeg=ffmpeg,
-                 no_cleanup=no_cleanup)
-    bot.chop_and_post_video()
+                 ffmpeg_accurate_cut=ffmpeg_accurate_cut, no_cleanup=no_cleanup,
+                 encoder_workers=encoder_workers, partial_download=partial_download, highlights=highlights,
+                 scene_detection=scene_detection, preview=preview,
+                 adaptive=adaptive)
+    if count > 1:
+        bot.chop_and_post_videos(count)
+    else:
+        bot.chop_and_post_video()
+
+    bot.ayrshare.print_stats()
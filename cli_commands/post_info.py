@@ -1,8 +1,9 @@
 import click
-import requests
 
+from bot.services.ayrshare import get_client
+from bot.services.source_metadata import canonical_source_id
 from bot.webapp.config import DefaultConfig
-from bot.webapp.models import SocialMediaPost, ImageDb, VideoClip as BotClip
+from bot.webapp.models import SocialMediaPost, ImageDb, VideoClip as BotClip, VideoClip
 
 
 def post_info(clip_id=None, url=None, image_id=None, print_intro_header=True):
@@ -94,7 +95,7 @@ def post_info(clip_id=None, url=None, image_id=None, print_intro_header=True):
 
     if url is not None:
         if 'tiktok' in url or 'youtube' in url or 'drive.google' in url or "youtu.be" in url:
-            clip = VideoClip.query.filter_by(url=url).first()
+            clip = VideoClip.query.filter_by(source_id=canonical_source_id(url)).order_by(VideoClip.id.desc()).first()
 
             if clip is None:
                 click.echo(f"Could not find clip with url {url}")
@@ -138,8 +139,7 @@ def post_info(clip_id=None, url=None, image_id=None, print_intro_header=True):
             continue
 
         for post in posts_with_clip:
-            req = requests.get(f'https://app.ayrshare.com/api/history/{post.api_id}',
-                               headers={'Authorization': f'Bearer {DefaultConfig.AYRSHARE_API_KEY}'})
+            req = get_client(DefaultConfig.AYRSHARE_API_KEY).history(post.api_id)
             resp = req.json()
 
             post_info.append(get_post_data(post, resp))
@@ -0,0 +1,48 @@
+import click
+
+from bot.services.posting_engine import PostingEngine, PostJob
+from bot.utils import get_maya_time
+from bot.webapp.models import MediaUpload
+
+
+def post_uploads(upload_ids, platforms=None, schedule=None, interval=None, description=None, title=None,
+                 hashtags=None, profile_keys=None, concurrency=8, rate=4.0, batch_size=25):
+    """
+    Post (or schedule) previously uploaded media, all of them at the same time.
+    :param upload_ids: comma separated ids of the MediaUploads
+    :param interval: minutes between the scheduled times of consecutive uploads, all at schedule when None
+    :param profile_keys: comma separated Ayrshare profile keys every upload is posted to
+    """
+    ids = [int(upload_id) for upload_id in upload_ids.split(',') if upload_id.strip() != ""]
+
+    uploads = {upload.id: upload for upload in MediaUpload.query.filter(MediaUpload.id.in_(ids)).all()}
+    start_time = get_maya_time(schedule) if schedule is not None else None
+
+    jobs = []
+    for upload_id in ids:
+        upload = uploads.get(upload_id)
+        if upload is None:
+            click.echo(f"Could not find upload with id {upload_id}")
+            continue
+
+        if upload.is_expired:
+            click.echo(f"Upload {upload_id} has expired, redo its clip to upload it again.")
+            continue
+
+        post_time = start_time
+        if start_time is not None and interval is not None:
+            post_time = start_time.add(minutes=interval * len(jobs))
+
+        jobs.append(PostJob(upload, platforms.split(','), schedule=post_time.iso8601() if post_time else None,
+                            description=description, title=title,
+                            hashtags=hashtags.split(',') if hashtags is not None else None,
+                            profile_keys=profile_keys.split(',') if profile_keys is not None else None))
+
+    if len(jobs) == 0:
+        click.echo("Nothing to post.")
+        return
+
+    engine = PostingEngine(concurrency=concurrency, rate=rate, batch_size=batch_size)
+    results = engine.run(jobs)
+    engine.client.print_stats()
+    click.echo(f"Posted {len([result for result in results if result.succeeded])} of {len(jobs)} uploads.")
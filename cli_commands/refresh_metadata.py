@@ -0,0 +1,16 @@
+import click
+
+from bot.services.source_metadata import get_source_metadata
+
+
+def refresh_metadata(url):
+    """
+    Drop the cached metadata of a source & fetch it again.
+    :param url: url of the source (youtube, tiktok or google drive)
+    """
+    metadata = get_source_metadata(url)
+    metadata.invalidate()
+
+    click.echo(f"Refreshed metadata of {metadata.source_id}")
+    click.echo(f"Title: {metadata.title}")
+    click.echo(f"Keywords: {', '.join(metadata.keywords or [])}")